@@ -7,8 +7,14 @@ from supabase import AsyncClient
 import openai
 import os
 
-from app.services.openai import OpenAIService
+from app.services.openai import EMBEDDING_CACHE_MODEL
+from app.services.openai_pool import openai_service_pool
+from app.services.answer_cache import mcp_answer_cache
+from app.services.embedding_cache import normalize_question
+from app.services.single_flight import retrieval_flight, answer_flight, answer_streams
+from app.services.metrics import span
 from app.utils.get_context import get_context
+from app.utils.corpus_version import get_corpus_version
 from app.db.client import get_db_client
 
 
@@ -31,6 +37,24 @@ class MCPRequestBody(BaseModel):
   query: str
   model: str
 
+###########################################################################################################
+# HELPERS
+###########################################################################################################
+# identical questions in flight at the same time share the embedding, the retrieval and the answer.
+# shared calls lease their own OpenAIService, since they can outlive the request that started them
+async def embed_question(openai_api_key: str, question: str) -> List[float]:
+  key = f"embed:{EMBEDDING_CACHE_MODEL}:{normalize_question(question)}"
+  with span("embed_question"):
+    return await retrieval_flight.do(
+      key,
+      lambda: openai_service_pool.run(openai_api_key, lambda openai_service: openai_service.embed_query(question))
+    )
+
+async def retrieve_context(embedded_query: List[float], question: str, supabase: AsyncClient) -> Optional[str]:
+  key = f"context:{EMBEDDING_CACHE_MODEL}:{normalize_question(question)}"
+  with span("retrieve_context"):
+    return await retrieval_flight.do(key, lambda: get_context(embedded_query, supabase, query_text=question))
+
 ###########################################################################################################
 # ENDPOINTS
 ###########################################################################################################
@@ -48,14 +72,18 @@ async def ask_mesh_ai(body: ChatCompletionRequest, credentials: HTTPAuthorizatio
   if openai_api_key is None:
     raise ValueError("OpenAI api key is missing")
 
-  openai_service = OpenAIService(openai_api_key)
-
   try:
     question = body.messages[-1].content
 
-    embedded_query = await openai_service.embed_query(question)
-    context = await get_context(embedded_query, supabase)
-    generator = openai_service.get_answer(question=question, context=context)
+    embedded_query = await embed_question(openai_api_key, question)
+    context = await retrieve_context(embedded_query, question, supabase)
+    generator = answer_streams.subscribe(
+      f"{body.model}:{normalize_question(question)}",
+      lambda: openai_service_pool.stream(
+        openai_api_key,
+        lambda openai_service: openai_service.get_answer(question=question, context=context)
+      )
+    )
     return StreamingResponse(generator, media_type="text/event-stream")
 
   except (openai.APIError, openai.AuthenticationError, openai.RateLimitError) as e:
@@ -83,16 +111,35 @@ async def ask_mesh_ai(body: MCPRequestBody, authorization: str = Header(None), s
 
   try:
     OPENAI_KEY = authorization.split(" ")[-1]
-    openai_service = OpenAIService(OPENAI_KEY)
+    # the key is the only credential here, and a cached or shared answer would never show it is bad
+    await openai_service_pool.verify(OPENAI_KEY)
 
     question = body.query
     model = body.model
 
-    embedded_query = await openai_service.embed_query(question)
-    context = await get_context(embedded_query, supabase)
-    response = await openai_service.get_mcp_answer(question=question, context=context, model=model)
+    embedded_query = await embed_question(OPENAI_KEY, question)
+    corpus_version = await get_corpus_version(supabase)
+    cached_response = mcp_answer_cache.get(embedded_query, model, corpus_version)
+    if cached_response is not None:
+      return cached_response
+
+    context = await retrieve_context(embedded_query, question, supabase)
+    response = await answer_flight.do(
+      f"{model}:{normalize_question(question)}",
+      lambda: openai_service_pool.run(
+        OPENAI_KEY,
+        lambda openai_service: openai_service.get_mcp_answer(question=question, context=context, model=model)
+      )
+    )
+    mcp_answer_cache.set(embedded_query, model, corpus_version, response)
     return response
 
+  except openai.AuthenticationError as e:
+    print(e)
+    raise HTTPException(
+      status_code=status.HTTP_401_UNAUTHORIZED,
+      detail="You are not authorized"
+    )
   except (openai.APIError, openai.AuthenticationError, openai.RateLimitError) as e:
     print(e)
     raise HTTPException(
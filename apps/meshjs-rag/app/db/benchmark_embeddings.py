@@ -0,0 +1,125 @@
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from typing import List, Tuple
+
+from setup_db import connect_db, vector_index_options, vector_search_setting
+
+DEFAULT_SETTINGS = "vector:1536,halfvec:1536,vector:768,halfvec:768,halfvec:512,halfvec:256"
+
+def parse_settings(value: str) -> List[Tuple[str, int]]:
+  settings = []
+  for item in value.split(","):
+    storage, dimensions = item.strip().split(":")
+    if storage not in ("vector", "halfvec"):
+      raise ValueError(f"Unknown storage type {storage}")
+    settings.append((storage, int(dimensions)))
+  return settings
+
+def project(embeddings: np.ndarray, dimensions: int) -> np.ndarray:
+  projected = embeddings[:, :dimensions]
+  norms = np.linalg.norm(projected, axis=1, keepdims=True)
+  norms[norms == 0] = 1
+  return projected / norms
+
+def exact_neighbours(embeddings: np.ndarray, query_rows: np.ndarray, k: int) -> np.ndarray:
+  normalized = project(embeddings, embeddings.shape[1])
+  scores = normalized[query_rows] @ normalized.T
+  # a query is a stored chunk, so it does not count as its own neighbour
+  scores[np.arange(len(query_rows)), query_rows] = -np.inf
+  top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+  return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+async def benchmark_setting(conn, storage: str, dimensions: int, queries: np.ndarray, query_ids: np.ndarray, truth: List[set], k: int) -> dict:
+  await conn.execute("DROP TABLE IF EXISTS bench_embeddings")
+  await conn.execute(f"""
+    CREATE TEMP TABLE bench_embeddings AS
+    SELECT id, l2_normalize(subvector(embedding::vector, 1, {dimensions}))::{storage}({dimensions}) AS embedding
+    FROM docs
+    WHERE embedding IS NOT NULL
+  """)
+
+  started = time.perf_counter()
+  await conn.execute(f"CREATE INDEX bench_embeddings_index ON bench_embeddings {vector_index_options(storage)}")
+  build_seconds = time.perf_counter() - started
+
+  index_bytes = await conn.fetchval("SELECT pg_relation_size('bench_embeddings_index')")
+  table_bytes = await conn.fetchval("SELECT pg_table_size('bench_embeddings')")
+
+  latencies = []
+  recalls = []
+  for query, query_id, expected in zip(project(queries, dimensions), query_ids, truth):
+    vector = "[" + ",".join(f"{value:.7g}" for value in query) + "]"
+    started = time.perf_counter()
+    rows = await conn.fetch(
+      f"SELECT id FROM bench_embeddings ORDER BY embedding <=> $1::text::{storage} LIMIT $2",
+      vector,
+      k + 1
+    )
+    latencies.append((time.perf_counter() - started) * 1000)
+
+    found = [row["id"] for row in rows if row["id"] != query_id][:k]
+    recalls.append(len(expected.intersection(found)) / k)
+
+  await conn.execute("DROP TABLE bench_embeddings")
+
+  return {
+    "setting": f"{storage}({dimensions})",
+    f"recall@{k}": round(float(np.mean(recalls)), 4),
+    "index_mb": round(index_bytes / 1024 / 1024, 2),
+    "table_mb": round(table_bytes / 1024 / 1024, 2),
+    "build_seconds": round(build_seconds, 2),
+    "latency_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+    "latency_p95_ms": round(float(np.percentile(latencies, 95)), 2)
+  }
+
+# compares ann search over re-projected copies of docs.embedding against exact search on the stored
+# vectors, using sampled chunks as queries. run it against a copy of production, it builds full indexes
+async def benchmark_embeddings(settings: List[Tuple[str, int]], query_count: int, k: int, seed: int) -> List[dict]:
+  conn = await connect_db()
+
+  try:
+    rows = await conn.fetch("SELECT id, embedding::vector::text AS embedding FROM docs WHERE embedding IS NOT NULL ORDER BY id")
+    if len(rows) <= k:
+      raise ValueError(f"Need more than {k} embedded docs to benchmark")
+
+    ids = np.array([row["id"] for row in rows])
+    embeddings = np.array([json.loads(row["embedding"]) for row in rows], dtype=np.float32)
+    stored_dimensions = embeddings.shape[1]
+
+    query_rows = np.random.default_rng(seed).choice(len(rows), size=min(query_count, len(rows)), replace=False)
+    truth = [set(ids[neighbours].tolist()) for neighbours in exact_neighbours(embeddings, query_rows, k)]
+
+    # session-wide, like the SET clause on match_docs; seq scans would make every setting exact
+    await conn.execute(vector_search_setting)
+    await conn.execute("SET enable_seqscan = off")
+
+    results = []
+    for storage, dimensions in settings:
+      if dimensions > stored_dimensions:
+        print(f"Skipping {storage}({dimensions}), docs.embedding only has {stored_dimensions} dimensions")
+        continue
+
+      result = await benchmark_setting(conn, storage, dimensions, embeddings[query_rows], ids[query_rows], truth, k)
+      print(json.dumps(result))
+      results.append(result)
+
+    return results
+  finally:
+    await conn.close()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark embedding dimensions and storage types against docs.embedding")
+  parser.add_argument("--settings", default=DEFAULT_SETTINGS, help="comma separated storage:dimensions pairs")
+  parser.add_argument("--queries", type=int, default=200)
+  parser.add_argument("--k", type=int, default=10)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", help="write the results to this json file")
+  args = parser.parse_args()
+
+  results = asyncio.run(benchmark_embeddings(parse_settings(args.settings), args.queries, args.k, args.seed))
+  if args.output:
+    with open(args.output, "w", encoding="utf-8") as f:
+      json.dump(results, f, indent=2)
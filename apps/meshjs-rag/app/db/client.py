@@ -1,5 +1,6 @@
 import os
-from supabase import acreate_client, AsyncClient as Client
+import httpx
+from supabase import acreate_client, AsyncClient as Client, AsyncClientOptions
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -7,6 +8,46 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 if not SUPABASE_URL or not SUPABASE_KEY:
   raise ValueError("SUPABASE_URL and SUPABASE_KEY are required")
 
-async def get_db_client() -> Client:
-  return await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE") or 20)
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY") or 30)
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT") or 120)
+
+_http_client: httpx.AsyncClient = None
+_db_client: Client = None
+
+async def init_db_client() -> Client:
+  global _http_client, _db_client
+
+  if _db_client is not None:
+    return _db_client
+
+  # one pooled, keep-alive connection set shared by every request for the lifetime of the app
+  _http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=SUPABASE_TIMEOUT,
+    limits=httpx.Limits(
+      max_connections=SUPABASE_POOL_SIZE,
+      max_keepalive_connections=SUPABASE_POOL_SIZE,
+      keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY
+    )
+  )
+  _db_client = await acreate_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=AsyncClientOptions(httpx_client=_http_client)
+  )
+  return _db_client
 
+async def close_db_client():
+  global _http_client, _db_client
+
+  if _http_client is not None:
+    await _http_client.aclose()
+
+  _http_client = None
+  _db_client = None
+
+async def get_db_client() -> Client:
+  if _db_client is None:
+    return await init_db_client()
+  return _db_client
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import pathlib
+import argparse
+import numpy as np
+from typing import List, Optional, Tuple
+
+from setup_db import connect_db, get_embedding_type, vector_index_options, vector_index_type, embedding_storage, embedding_dimensions
+from benchmark_embeddings import parse_settings, project
+
+# build_context and the embedding client are shared with the service, so the numbers are what get_context sends
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[2]))
+from app.services.openai import OpenAIService, EMBEDDING_CACHE_MODEL
+from app.utils.build_context import build_context, estimate_tokens
+
+DEFAULT_THRESHOLDS = "0,0.2,0.3,0.4,0.5"
+DEFAULT_KS = "3,5,10,20"
+SEARCH_SETTING = {"hnsw": "hnsw.ef_search", "ivfflat": "ivfflat.probes"}
+
+# a labelled set is a jsonl file, one question per line with the chunk(s) that answer it:
+#   {"question": "How do I mint a token?", "filepath": "guides/minting.mdx", "chunk_title": "Minting assets"}
+#   {"question": "...", "expected": [{"filepath": "a.mdx"}, {"filepath": "b.mdx", "chunk_title": "Setup"}]}
+# without a chunk_title, any chunk of the file counts
+def load_questions(path: str) -> List[dict]:
+  questions = []
+  with open(path, encoding="utf-8") as f:
+    for line in f:
+      if not line.strip():
+        continue
+      item = json.loads(line)
+      expected = item.get("expected") or [{"filepath": item["filepath"], "chunk_title": item.get("chunk_title")}]
+      questions.append({"question": item["question"], "expected": expected})
+  return questions
+
+def is_relevant(row: dict, expected: List[dict]) -> bool:
+  return any(
+    row["filepath"] == item["filepath"] and (not item.get("chunk_title") or row["chunk_title"] == item["chunk_title"])
+    for item in expected
+  )
+
+async def embed_questions(questions: List[dict], cache_path: Optional[str]) -> np.ndarray:
+  texts = [item["question"] for item in questions]
+  if cache_path and os.path.exists(cache_path):
+    with open(cache_path, encoding="utf-8") as f:
+      cached = json.load(f)
+    if cached["model"] == EMBEDDING_CACHE_MODEL and cached["questions"] == texts:
+      return np.array(cached["embeddings"], dtype=np.float32)
+
+  openai_api_key = os.getenv("OPENAI_KEY") or None
+  if openai_api_key is None:
+    raise ValueError("OpenAI api key is missing")
+
+  service = OpenAIService(openai_api_key=openai_api_key)
+  try:
+    embeddings = await service.get_batch_embeddings(texts)
+  finally:
+    await service.aclose()
+
+  if cache_path:
+    with open(cache_path, "w", encoding="utf-8") as f:
+      json.dump({"model": EMBEDDING_CACHE_MODEL, "questions": texts, "embeddings": embeddings}, f)
+  return np.array(embeddings, dtype=np.float32)
+
+def summarize(results: List[Tuple[float, List[dict]]], questions: List[dict], k: int, threshold: float) -> dict:
+  recalls = []
+  reciprocal_ranks = []
+  context_recalls = []
+  context_tokens = []
+  for (_, rows), item in zip(results, questions):
+    # the same filter as match_docs: the nearest k first, then the threshold
+    matches = [row for row in rows[:k] if row["similarity"] > threshold]
+    expected = item["expected"]
+
+    found = sum(any(is_relevant(row, [target]) for row in matches) for target in expected)
+    recalls.append(found / len(expected))
+    rank = next((i for i, row in enumerate(matches, 1) if is_relevant(row, expected)), None)
+    reciprocal_ranks.append(1 / rank if rank else 0.0)
+
+    context = build_context(matches) if matches else None
+    context_tokens.append(estimate_tokens(context) if context else 0)
+    # the chunk has to survive the gap cut, mmr and the token budget to reach the prompt
+    context_recalls.append(float(bool(context) and any(is_relevant(row, expected) and row["contextual_text"] in context for row in matches)))
+
+  latencies = [latency for latency, _ in results]
+  return {
+    "k": k,
+    "threshold": threshold,
+    "recall": round(float(np.mean(recalls)), 4),
+    "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+    "context_recall": round(float(np.mean(context_recalls)), 4),
+    "context_tokens_avg": round(float(np.mean(context_tokens)), 1),
+    "latency_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+    "latency_p95_ms": round(float(np.percentile(latencies, 95)), 2)
+  }
+
+async def search(conn, storage: str, queries: np.ndarray, k: int) -> List[Tuple[float, List[dict]]]:
+  results = []
+  for query in queries:
+    vector = "[" + ",".join(f"{value:.7g}" for value in query) + "]"
+    started = time.perf_counter()
+    # the same shape as match_docs, with the pairwise similarities build_context uses for mmr
+    rows = await conn.fetch(
+      f"""
+      WITH matches AS (
+        SELECT id, filepath, chunk_id, chunk_title, contextual_text, embedding,
+               1 - (embedding <=> $1::text::{storage}) AS similarity
+        FROM eval_docs
+        ORDER BY embedding <=> $1::text::{storage}
+        LIMIT $2
+      )
+      SELECT id, filepath, chunk_id, chunk_title, contextual_text, similarity,
+             (SELECT jsonb_object_agg(other.id, 1 - (matches.embedding <=> other.embedding)) FROM matches AS other)::text AS similarities
+      FROM matches
+      ORDER BY similarity DESC
+      """,
+      vector,
+      k
+    )
+    results.append((
+      (time.perf_counter() - started) * 1000,
+      [{**dict(row), "similarities": json.loads(row["similarities"])} for row in rows]
+    ))
+  return results
+
+async def evaluate_setting(conn, storage: str, dimensions: int, queries: np.ndarray, questions: List[dict], ks: List[int], thresholds: List[float], search_values: List[int]) -> List[dict]:
+  await conn.execute("DROP TABLE IF EXISTS eval_docs")
+  await conn.execute(f"""
+    CREATE TEMP TABLE eval_docs AS
+    SELECT id, filepath, chunk_id, chunk_title, contextual_text,
+           l2_normalize(subvector(embedding::vector, 1, {dimensions}))::{storage}({dimensions}) AS embedding
+    FROM docs
+    WHERE embedding IS NOT NULL
+  """)
+  queries = project(queries, dimensions)
+
+  rows = []
+
+  async def run(name: str):
+    for k in ks:
+      results = await search(conn, storage, queries, k)
+      for threshold in thresholds:
+        row = {"setting": f"{storage}({dimensions})", "search": name, **summarize(results, questions, k, threshold)}
+        print(json.dumps(row))
+        rows.append(row)
+
+  # exact search first, while there is no index to use; it is the ceiling the index settings are measured against
+  await run("exact")
+
+  if search_values:
+    # built with the HNSW_* / IVFFLAT_* settings setup_db uses, run again with others to compare builds
+    await conn.execute(f"CREATE INDEX eval_docs_index ON eval_docs {vector_index_options(storage)}")
+    await conn.execute("SET enable_seqscan = off")
+    for value in search_values:
+      await conn.execute(f"SET {SEARCH_SETTING[vector_index_type]} = {value}")
+      await run(f"{SEARCH_SETTING[vector_index_type]}={value}")
+
+  await conn.execute("RESET enable_seqscan")
+  await conn.execute("DROP TABLE eval_docs")
+  return rows
+
+def recommend(rows: List[dict], tolerance: float) -> Optional[dict]:
+  # the smallest context whose answers are still found about as often as with the best setting
+  best = max((row["context_recall"] for row in rows), default=0)
+  candidates = [row for row in rows if row["context_recall"] >= best - tolerance]
+  return min(candidates, key=lambda row: (row["context_tokens_avg"], row["latency_p95_ms"]), default=None)
+
+# measures how often the labelled chunk is retrieved and reaches the built context for every
+# combination of dimensions, index search setting, k and threshold. questions are embedded once,
+# at the stored dimensions, and projected down like migrate_embeddings does with the docs
+async def evaluate_retrieval(questions: List[dict], settings: List[Tuple[str, int]], ks: List[int], thresholds: List[float], search_values: List[int], cache_path: Optional[str]) -> List[dict]:
+  queries = await embed_questions(questions, cache_path)
+  conn = await connect_db()
+
+  try:
+    embedding_type = await get_embedding_type(conn)
+    stored_dimensions = int(embedding_type.split("(")[1].rstrip(")"))
+    if queries.shape[1] != stored_dimensions:
+      raise ValueError(f"Questions were embedded with {queries.shape[1]} dimensions but docs.embedding is {embedding_type}, set EMBEDDING_DIMENSIONS")
+
+    rows = []
+    for storage, dimensions in settings:
+      if dimensions > stored_dimensions:
+        print(f"Skipping {storage}({dimensions}), docs.embedding only has {stored_dimensions} dimensions")
+        continue
+      rows.extend(await evaluate_setting(conn, storage, dimensions, queries, questions, ks, thresholds, search_values))
+    return rows
+  finally:
+    await conn.close()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Evaluate retrieval quality, latency and context size over match_docs parameters")
+  parser.add_argument("questions", help="jsonl file of questions and the filepath/chunk_title that answers them")
+  parser.add_argument("--settings", default=None, help="comma separated storage:dimensions pairs, defaults to the stored type")
+  parser.add_argument("--k", default=DEFAULT_KS, help="comma separated match counts")
+  parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help="comma separated similarity thresholds")
+  parser.add_argument("--search", default="40,100,200" if vector_index_type == "hnsw" else "1,10,20",
+                      help=f"comma separated {SEARCH_SETTING[vector_index_type]} values")
+  parser.add_argument("--tolerance", type=float, default=0.02, help="context recall a recommended setting may give up")
+  parser.add_argument("--cache", help="reuse question embeddings from this json file, or write them to it")
+  parser.add_argument("--output", help="write the results to this json file")
+  args = parser.parse_args()
+
+  questions = load_questions(args.questions)
+  settings = parse_settings(args.settings) if args.settings else [(embedding_storage, embedding_dimensions)]
+
+  rows = asyncio.run(evaluate_retrieval(
+    questions,
+    settings,
+    [int(k) for k in args.k.split(",")],
+    [float(threshold) for threshold in args.thresholds.split(",")],
+    [int(value) for value in args.search.split(",") if value.strip()],
+    args.cache
+  ))
+
+  recommended = recommend(rows, args.tolerance)
+  if recommended:
+    print(f"Smallest context within {args.tolerance} of the best context recall: {json.dumps(recommended)}")
+
+  if args.output:
+    with open(args.output, "w", encoding="utf-8") as f:
+      json.dump({"questions": len(questions), "results": rows, "recommended": recommended}, f, indent=2)
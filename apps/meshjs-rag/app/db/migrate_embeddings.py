@@ -0,0 +1,62 @@
+import asyncio
+
+from setup_db import (
+  connect_db,
+  embedding_dimensions,
+  embedding_storage,
+  embedding_type,
+  get_embedding_type,
+  setup_db
+)
+
+# text-embedding-3 vectors can be shortened by keeping the leading dimensions and renormalizing,
+# which gives the same result as asking the api for fewer dimensions, so existing rows are
+# re-projected in place instead of being embedded again. needs pgvector >= 0.7
+async def migrate_embeddings():
+  conn = None
+
+  try:
+    conn = await connect_db()
+
+    current_type = await get_embedding_type(conn)
+    if current_type == embedding_type:
+      print(f"docs.embedding is already {embedding_type}")
+      return
+
+    current_dimensions = int(current_type[current_type.index("(") + 1:-1])
+    if embedding_dimensions > current_dimensions:
+      raise ValueError(
+        f"Cannot re-project {current_type} rows up to {embedding_dimensions} dimensions, the docs have to be embedded again"
+      )
+
+    print(f"Migrating docs.embedding from {current_type} to {embedding_type}")
+
+    async with conn.transaction():
+      # the vector index is tied to the column type, setup_db builds the new one afterwards
+      indexes = await conn.fetch(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'docs' AND indexname LIKE 'idx_docs_embedding%'"
+      )
+      for index in indexes:
+        await conn.execute(f'DROP INDEX IF EXISTS "{index["indexname"]}"')
+
+      await conn.execute(f"""
+        ALTER TABLE docs ALTER COLUMN embedding TYPE {embedding_type}
+        USING l2_normalize(subvector(embedding::vector, 1, {embedding_dimensions}))::{embedding_storage}
+      """)
+
+      # a column rewrite fires no triggers; touching every row bumps the corpus version and makes
+      # the local vector snapshots and answer caches start over
+      await conn.execute("UPDATE docs SET updated_at = now()")
+
+    print("Embeddings migrated")
+  except Exception as e:
+    print("Error migrating the embeddings: ", e)
+    raise
+  finally:
+    if conn:
+      await conn.close()
+
+  await setup_db()
+
+if __name__ == "__main__":
+  asyncio.run(migrate_embeddings())
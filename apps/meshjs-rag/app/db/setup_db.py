@@ -3,7 +3,7 @@ import asyncpg
 import asyncio
 
 db_host = os.getenv("DB_HOST")
-db_port = int(os.getenv("DB_PORT", 5432))
+db_port = int(os.getenv("DB_PORT") or 5432)
 db_user = os.getenv("DB_USER")
 db_name = os.getenv("DB_NAME")
 db_password = os.getenv("DB_PASSWORD")
@@ -11,15 +11,46 @@ db_password = os.getenv("DB_PASSWORD")
 if not all([db_host, db_user, db_name, db_password]):
   raise ValueError("Missing required DB environment variables")
 
+embedding_dimensions = int(os.getenv("EMBEDDING_DIMENSIONS") or 1536)
+embedding_storage = (os.getenv("EMBEDDING_STORAGE") or "vector").lower()
+
+if embedding_storage not in ("vector", "halfvec"):
+  raise ValueError("EMBEDDING_STORAGE must be either 'vector' or 'halfvec'")
+
+embedding_type = f"{embedding_storage}({embedding_dimensions})"
+
+vector_index_type = (os.getenv("VECTOR_INDEX_TYPE") or "hnsw").lower()
+hnsw_m = int(os.getenv("HNSW_M") or 16)
+hnsw_ef_construction = int(os.getenv("HNSW_EF_CONSTRUCTION") or 64)
+hnsw_ef_search = int(os.getenv("HNSW_EF_SEARCH") or 40)
+ivfflat_lists = int(os.getenv("IVFFLAT_LISTS") or 100)
+ivfflat_probes = int(os.getenv("IVFFLAT_PROBES") or 10)
+
+if vector_index_type not in ("hnsw", "ivfflat"):
+  raise ValueError("VECTOR_INDEX_TYPE must be either 'hnsw' or 'ivfflat'")
+
+def vector_index_options(storage: str) -> str:
+  if vector_index_type == "hnsw":
+    return f"USING hnsw (embedding {storage}_cosine_ops) WITH (m = {hnsw_m}, ef_construction = {hnsw_ef_construction})"
+  return f"USING ivfflat (embedding {storage}_cosine_ops) WITH (lists = {ivfflat_lists})"
+
+# the storage type and build parameters are part of the name so changing them replaces the index
+if vector_index_type == "hnsw":
+  vector_index_name = f"idx_docs_embedding_{embedding_storage}{embedding_dimensions}_hnsw_m{hnsw_m}_ef{hnsw_ef_construction}"
+  vector_search_setting = f"SET hnsw.ef_search = {hnsw_ef_search}"
+else:
+  vector_index_name = f"idx_docs_embedding_{embedding_storage}{embedding_dimensions}_ivfflat_l{ivfflat_lists}"
+  vector_search_setting = f"SET ivfflat.probes = {ivfflat_probes}"
+
 ########## SCHEMAS ###########
-sql_schema = """
+sql_schema = f"""
 CREATE EXTENSION IF NOT EXISTS vector;
 
 CREATE TABLE IF NOT EXISTS docs(
   id bigserial primary key,
   content text,
   contextual_text text,
-  embedding vector(1536),
+  embedding {embedding_type},
   filepath text NOT NULL,
   chunk_id INTEGER NOT NULL,
   chunk_title text NOT NULL,
@@ -46,9 +77,135 @@ EXECUTE FUNCTION set_updated_at();
 """
 
 
-match_docs_schema = """
+vector_index_schema = f"""
+CREATE INDEX IF NOT EXISTS {vector_index_name} ON docs {vector_index_options(embedding_storage)};
+"""
+
+
+full_text_schema = """
+ALTER TABLE docs ADD COLUMN IF NOT EXISTS fts tsvector
+GENERATED ALWAYS AS (
+  setweight(to_tsvector('simple', coalesce(chunk_title, '')), 'A') ||
+  setweight(to_tsvector('english', coalesce(contextual_text, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_docs_fts ON docs USING gin (fts);
+
+CREATE OR REPLACE AGGREGATE tsquery_or_agg(tsquery) (SFUNC = tsquery_or, STYPE = tsquery);
+"""
+
+
+# reciprocal rank fusion of the full-text and vector rankings; the lexical side ORs the
+# query terms so exact identifiers like MeshTxBuilder match without every other word of the question.
+# titles are indexed unstemmed ('simple') and bodies stemmed ('english'), so every word is looked up
+# with both configs; an 'english' query alone would stem BlockfrostProvider past the title lexeme
+hybrid_match_docs_schema = f"""
+DROP FUNCTION IF EXISTS hybrid_match_docs(text, vector, integer, double precision, double precision, integer);
+DROP FUNCTION IF EXISTS hybrid_match_docs(text, halfvec, integer, double precision, double precision, integer);
+
+CREATE OR REPLACE FUNCTION hybrid_match_docs(
+  query_text text,
+  query_embedding {embedding_type},
+  match_count int,
+  full_text_weight float DEFAULT 1,
+  semantic_weight float DEFAULT 1,
+  rrf_k int DEFAULT 50
+)
+RETURNS TABLE(
+  id bigint,
+  contextual_text text,
+  similarity float,
+  filepath text,
+  chunk_id INTEGER,
+  chunk_title text,
+  checksum text,
+  similarities jsonb,
+  score float
+)
+LANGUAGE sql STABLE
+{vector_search_setting}
+AS $$
+  WITH words AS (
+    SELECT word
+    FROM regexp_split_to_table(query_text, '[[:space:]]+') AS word
+    -- stopwords are kept by 'simple' and would match nearly every title
+    WHERE numnode(plainto_tsquery('english', word)) > 0
+  ),
+  query AS (
+    SELECT
+      (SELECT tsquery_or_agg(plainto_tsquery('simple', word)) FROM words) ||
+      (SELECT tsquery_or_agg(plainto_tsquery('english', word)) FROM words) AS tsquery
+  ),
+  full_text AS (
+    SELECT
+      ranked.id,
+      row_number() OVER (ORDER BY ranked.rank DESC) AS rank_ix
+    FROM (
+      SELECT docs.id, ts_rank_cd(docs.fts, query.tsquery) AS rank
+      FROM docs, query
+      WHERE docs.fts @@ query.tsquery
+      ORDER BY rank DESC
+      LIMIT match_count * 2
+    ) AS ranked
+  ),
+  semantic AS (
+    SELECT
+      nearest.id,
+      row_number() OVER (ORDER BY nearest.distance) AS rank_ix
+    FROM (
+      SELECT docs.id, docs.embedding <=> query_embedding AS distance
+      FROM docs
+      ORDER BY docs.embedding <=> query_embedding
+      LIMIT match_count * 2
+    ) AS nearest
+  ),
+  fused AS (
+    SELECT
+      docs.id,
+      docs.contextual_text,
+      1 - (docs.embedding <=> query_embedding) AS similarity,
+      docs.filepath,
+      docs.chunk_id,
+      docs.chunk_title,
+      docs.checksum,
+      docs.embedding,
+      coalesce(1.0 / (rrf_k + full_text.rank_ix), 0.0) * full_text_weight +
+      coalesce(1.0 / (rrf_k + semantic.rank_ix), 0.0) * semantic_weight AS score
+    FROM full_text
+    FULL OUTER JOIN semantic ON full_text.id = semantic.id
+    JOIN docs ON docs.id = coalesce(full_text.id, semantic.id)
+    ORDER BY score DESC
+    LIMIT match_count
+  )
+  SELECT
+    fused.id,
+    fused.contextual_text,
+    fused.similarity,
+    fused.filepath,
+    fused.chunk_id,
+    fused.chunk_title,
+    fused.checksum,
+    (
+      SELECT jsonb_object_agg(other.id, 1 - (fused.embedding <=> other.embedding))
+      FROM fused AS other
+    ) AS similarities,
+    fused.score
+  FROM fused
+  ORDER BY fused.score DESC;
+$$;
+"""
+
+
+# the nearest neighbours are taken in index order first, the threshold only filters that small set.
+# build_context only needs the embeddings to compare the matches with each other, so those
+# similarities come back instead of the vectors: {id: similarity} per match, a few hundred bytes
+# instead of a pgvector text of every embedding
+match_docs_schema = f"""
+DROP FUNCTION IF EXISTS match_docs(vector, double precision, integer);
+DROP FUNCTION IF EXISTS match_docs(halfvec, double precision, integer);
+
 CREATE OR REPLACE FUNCTION match_docs(
-  query_embedding vector(1536),
+  query_embedding {embedding_type},
   match_threshold float,
   match_count int
 )
@@ -59,40 +216,290 @@ RETURNS TABLE(
   filepath text,
   chunk_id INTEGER,
   chunk_title text,
-  checksum text
+  checksum text,
+  similarities jsonb
 )
 LANGUAGE sql STABLE
+{vector_search_setting}
 AS $$
+  WITH matches AS (
+    SELECT *
+    FROM (
+      SELECT
+        docs.id,
+        docs.contextual_text,
+        1 - (docs.embedding <=> query_embedding) AS similarity,
+        docs.filepath,
+        docs.chunk_id,
+        docs.chunk_title,
+        docs.checksum,
+        docs.embedding
+      FROM docs
+      ORDER BY docs.embedding <=> query_embedding
+      LIMIT match_count
+    ) AS nearest
+    WHERE nearest.similarity > match_threshold
+  )
   SELECT
-    docs.id,
-    docs.contextual_text,
-    1 - (docs.embedding <=> query_embedding) AS similarity,
-    docs.filepath,
-    docs.chunk_id,
-    docs.chunk_title,
-    docs.checksum
-  FROM docs
-  WHERE 1 - (docs.embedding <=> query_embedding) > match_threshold
-  ORDER BY similarity DESC
-  LIMIT match_count;
+    matches.id,
+    matches.contextual_text,
+    matches.similarity,
+    matches.filepath,
+    matches.chunk_id,
+    matches.chunk_title,
+    matches.checksum,
+    (
+      SELECT jsonb_object_agg(other.id, 1 - (matches.embedding <=> other.embedding))
+      FROM matches AS other
+    ) AS similarities
+  FROM matches
+  ORDER BY matches.similarity DESC;
+$$;
+"""
+
+upsert_docs_schema = f"""
+DROP FUNCTION IF EXISTS upsert_docs(jsonb);
+
+-- every change to a file in one statement: chunks that left the file are deleted together with
+-- the writes of the ones that replace them, so a failed call leaves the file as it was
+CREATE OR REPLACE FUNCTION upsert_docs(payload jsonb, delete_ids bigint[] DEFAULT '{{}}')
+RETURNS TABLE(
+  id bigint,
+  chunk_title text,
+  action text
+)
+LANGUAGE sql VOLATILE
+AS $$
+  WITH input AS (
+    SELECT *
+    FROM jsonb_to_recordset(payload) AS r(
+      record_id bigint,
+      content text,
+      contextual_text text,
+      embedding jsonb,
+      filepath text,
+      chunk_id INTEGER,
+      chunk_title text,
+      checksum text
+    )
+  ),
+  updated AS (
+    UPDATE docs SET
+      content = input.content,
+      contextual_text = input.contextual_text,
+      embedding = input.embedding::text::{embedding_storage},
+      filepath = input.filepath,
+      chunk_id = input.chunk_id,
+      chunk_title = input.chunk_title,
+      checksum = input.checksum
+    FROM input
+    WHERE input.record_id IS NOT NULL AND docs.id = input.record_id
+    RETURNING docs.id, docs.chunk_title, 'updated'::text AS action
+  ),
+  inserted AS (
+    INSERT INTO docs (content, contextual_text, embedding, filepath, chunk_id, chunk_title, checksum)
+    SELECT
+      input.content,
+      input.contextual_text,
+      input.embedding::text::{embedding_storage},
+      input.filepath,
+      input.chunk_id,
+      input.chunk_title,
+      input.checksum
+    FROM input
+    WHERE input.record_id IS NULL
+    RETURNING docs.id, docs.chunk_title, 'inserted'::text AS action
+  ),
+  deleted AS (
+    DELETE FROM docs
+    WHERE docs.id = ANY(delete_ids)
+    RETURNING docs.id, docs.chunk_title, 'deleted'::text AS action
+  )
+  SELECT * FROM updated
+  UNION ALL
+  SELECT * FROM inserted
+  UNION ALL
+  SELECT * FROM deleted;
+$$;
+"""
+
+reorder_docs_schema = """
+CREATE OR REPLACE FUNCTION reorder_docs(
+  target_filepath text,
+  moved_chunks jsonb DEFAULT '[]'::jsonb
+)
+RETURNS integer
+LANGUAGE plpgsql VOLATILE
+AS $$
+DECLARE
+  renumbered integer;
+BEGIN
+  UPDATE docs SET
+    chunk_id = moved.chunk_id,
+    chunk_title = CASE
+      WHEN position('_' in docs.chunk_title) > 0 THEN split_part(docs.chunk_title, '_', 1) || '_' || moved.chunk_id
+      ELSE docs.chunk_title
+    END
+  FROM jsonb_to_recordset(moved_chunks) AS moved(id bigint, chunk_id integer)
+  WHERE docs.id = moved.id AND docs.filepath = target_filepath;
+
+  UPDATE docs SET
+    chunk_id = ordered.new_idx,
+    chunk_title = CASE
+      WHEN position('_' in docs.chunk_title) > 0 THEN split_part(docs.chunk_title, '_', 1) || '_' || ordered.new_idx
+      ELSE docs.chunk_title
+    END
+  FROM (
+    SELECT
+      d.id,
+      (row_number() OVER (ORDER BY d.chunk_id, d.id) - 1)::integer AS new_idx
+    FROM docs d
+    WHERE d.filepath = target_filepath
+  ) AS ordered
+  WHERE docs.id = ordered.id AND docs.chunk_id <> ordered.new_idx;
+
+  GET DIAGNOSTICS renumbered = ROW_COUNT;
+  RETURN renumbered;
+END;
 $$;
 """
 
+ingest_manifest_schema = """
+CREATE TABLE IF NOT EXISTS ingest_manifest(
+  source text NOT NULL,
+  filepath text NOT NULL,
+  checksum text NOT NULL,
+  last_ingested timestamptz DEFAULT now() NOT NULL,
+  PRIMARY KEY (source, filepath)
+);
+
+CREATE OR REPLACE FUNCTION delete_missing_docs(
+  target_source text,
+  current_filepaths text[]
+)
+RETURNS integer
+LANGUAGE plpgsql VOLATILE
+AS $$
+DECLARE
+  deleted integer;
+BEGIN
+  WITH missing AS (
+    DELETE FROM ingest_manifest m
+    WHERE m.source = target_source AND NOT (m.filepath = ANY(current_filepaths))
+    RETURNING m.filepath
+  )
+  DELETE FROM docs
+  USING missing
+  WHERE docs.filepath = missing.filepath
+    AND NOT EXISTS (
+      SELECT 1 FROM ingest_manifest other
+      WHERE other.filepath = missing.filepath AND other.source <> target_source
+    );
+
+  GET DIAGNOSTICS deleted = ROW_COUNT;
+  RETURN deleted;
+END;
+$$;
+"""
+
+ingest_jobs_schema = """
+CREATE TABLE IF NOT EXISTS ingest_jobs(
+  id uuid primary key DEFAULT gen_random_uuid(),
+  source text NOT NULL,
+  status text DEFAULT 'queued' NOT NULL,
+  files INTEGER DEFAULT 0 NOT NULL,
+  processed INTEGER DEFAULT 0 NOT NULL,
+  unchanged INTEGER DEFAULT 0 NOT NULL,
+  failed jsonb DEFAULT '[]'::jsonb NOT NULL,
+  files_per_second float DEFAULT 0 NOT NULL,
+  attempts INTEGER DEFAULT 1 NOT NULL,
+  error text,
+  summary jsonb,
+  created_at timestamptz DEFAULT now() NOT NULL,
+  updated_at timestamptz DEFAULT now() NOT NULL
+);
+
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS mode text DEFAULT 'interactive' NOT NULL;
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS heartbeat_at timestamptz;
+
+DROP TRIGGER IF EXISTS set_updated_at_trigger ON ingest_jobs;
+CREATE TRIGGER set_updated_at_trigger
+BEFORE UPDATE ON ingest_jobs
+FOR EACH ROW
+EXECUTE FUNCTION set_updated_at();
+"""
+
+corpus_version_schema = """
+CREATE TABLE IF NOT EXISTS corpus_meta(
+  id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  version bigint DEFAULT 0 NOT NULL,
+  updated_at timestamptz DEFAULT now() NOT NULL
+);
+
+INSERT INTO corpus_meta (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_corpus_version()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE corpus_meta SET version = version + 1, updated_at = now() WHERE id = 1;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bump_corpus_version_trigger ON docs;
+CREATE TRIGGER bump_corpus_version_trigger
+AFTER INSERT OR UPDATE OR DELETE ON docs
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_corpus_version();
+"""
+
+async def connect_db() -> asyncpg.Connection:
+  return await asyncpg.connect(
+    host=db_host,
+    port=db_port,
+    user=db_user,
+    password=db_password,
+    database=db_name,
+    ssl="require"
+  )
+
+async def get_embedding_type(conn: asyncpg.Connection) -> str:
+  return await conn.fetchval("""
+    SELECT format_type(atttypid, atttypmod)
+    FROM pg_attribute
+    WHERE attrelid = 'docs'::regclass AND attname = 'embedding'
+  """)
+
 async def setup_db():
   conn = None
 
   try:
-    conn = await asyncpg.connect(
-      host=db_host,
-      port=db_port,
-      user=db_user,
-      password=db_password,
-      database=db_name,
-      ssl="require"
-    )
+    conn = await connect_db()
 
     await conn.execute(sql_schema)
+
+    current_type = await get_embedding_type(conn)
+    if current_type != embedding_type:
+      raise ValueError(
+        f"docs.embedding is {current_type} but {embedding_type} is configured, run `make migrate_embeddings` first"
+      )
+
+    stale_indexes = await conn.fetch(
+      "SELECT indexname FROM pg_indexes WHERE tablename = 'docs' AND indexname LIKE 'idx_docs_embedding%' AND indexname <> $1",
+      vector_index_name
+    )
+    for index in stale_indexes:
+      await conn.execute(f'DROP INDEX IF EXISTS "{index["indexname"]}"')
+    await conn.execute(vector_index_schema)
+
+    await conn.execute(full_text_schema)
     await conn.execute(match_docs_schema)
+    await conn.execute(hybrid_match_docs_schema)
+    await conn.execute(upsert_docs_schema)
+    await conn.execute(reorder_docs_schema)
+    await conn.execute(ingest_manifest_schema)
+    await conn.execute(ingest_jobs_schema)
+    await conn.execute(corpus_version_schema)
 
     print("Database schema setup completed")
   except Exception as e:
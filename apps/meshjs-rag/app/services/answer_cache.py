@@ -0,0 +1,97 @@
+import os
+import time
+import numpy as np
+from typing import List, Optional
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE") or 512)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL") or 3600)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD") or 0.97)
+
+class AnswerCache:
+  def __init__(
+      self,
+      max_size: int = ANSWER_CACHE_SIZE,
+      ttl: float = ANSWER_CACHE_TTL,
+      threshold: float = ANSWER_CACHE_THRESHOLD
+  ):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.threshold = threshold
+    self.corpus_version: Optional[int] = None
+    # per model: unit-normalized question embeddings stacked as a float32 matrix, plus the answers
+    self._embeddings: dict[str, np.ndarray] = {}
+    self._answers: dict[str, List[tuple[str, float]]] = {}
+    self.hits = 0
+    self.misses = 0
+
+  def _sync_version(self, corpus_version: int):
+    if corpus_version != self.corpus_version:
+      self._embeddings.clear()
+      self._answers.clear()
+      self.corpus_version = corpus_version
+
+  def _prune(self, model: str):
+    now = time.monotonic()
+    answers = self._answers[model]
+    keep = [i for i, (_, created_at) in enumerate(answers) if now - created_at <= self.ttl][-self.max_size:]
+    if len(keep) != len(answers):
+      self._embeddings[model] = self._embeddings[model][keep]
+      self._answers[model] = [answers[i] for i in keep]
+
+  @staticmethod
+  def _normalize(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+  def get(self, embedding: List[float], model: str, corpus_version: Optional[int]) -> Optional[str]:
+    if corpus_version is None:
+      return None
+
+    self._sync_version(corpus_version)
+
+    if model not in self._answers:
+      self.misses += 1
+      return None
+
+    self._prune(model)
+    matrix = self._embeddings[model]
+    if not len(matrix):
+      self.misses += 1
+      return None
+
+    similarities = matrix @ self._normalize(embedding)
+    best = int(np.argmax(similarities))
+    if similarities[best] < self.threshold:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    return self._answers[model][best][0]
+
+  def set(self, embedding: List[float], model: str, corpus_version: Optional[int], answer: str):
+    if corpus_version is None or not answer:
+      return
+
+    self._sync_version(corpus_version)
+
+    vector = self._normalize(embedding)[np.newaxis, :]
+    if model in self._answers:
+      self._embeddings[model] = np.vstack([self._embeddings[model], vector])
+      self._answers[model].append((answer, time.monotonic()))
+      self._prune(model)
+    else:
+      self._embeddings[model] = vector
+      self._answers[model] = [(answer, time.monotonic())]
+
+  def stats(self) -> dict:
+    return {
+      "size": sum(len(answers) for answers in self._answers.values()),
+      "max_size": self.max_size,
+      "hits": self.hits,
+      "misses": self.misses,
+      "corpus_version": self.corpus_version
+    }
+
+
+mcp_answer_cache = AnswerCache()
@@ -0,0 +1,147 @@
+import os
+import time
+import array
+import sqlite3
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+CHUNK_CACHE_PATH = os.getenv("CHUNK_CACHE_PATH", "chunk-cache.sqlite3") or None
+CHUNK_CACHE_SIZE = int(os.getenv("CHUNK_CACHE_SIZE") or 200000)
+
+# content-addressed store of situate_context outputs and their embeddings, keyed by the checksum of
+# the document and of the chunk. it lives outside the docs table so reverted files and fresh or
+# staging databases reuse the work instead of paying for the llm call and the embedding again
+class ChunkCache:
+  def __init__(self, path: Optional[str] = CHUNK_CACHE_PATH, max_size: int = CHUNK_CACHE_SIZE):
+    self.path = path
+    self.max_size = max_size
+    self._writes = 0
+    self.hits = 0
+    self.misses = 0
+
+    if self.path:
+      with self._connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS chunks(
+            doc_checksum TEXT NOT NULL,
+            chunk_checksum TEXT NOT NULL,
+            contextual_text TEXT NOT NULL,
+            embedding_model TEXT,
+            embedding BLOB,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (doc_checksum, chunk_checksum)
+          )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_created_at ON chunks (created_at)")
+
+  def _connect(self) -> sqlite3.Connection:
+    return sqlite3.connect(self.path, timeout=5)
+
+  def _get_many(self, doc_checksum: str, chunk_checksums: List[str]) -> List[tuple]:
+    with self._connect() as conn:
+      placeholders = ",".join("?" * len(chunk_checksums))
+      return conn.execute(
+        f"""
+        SELECT chunk_checksum, contextual_text, embedding_model, embedding
+        FROM chunks
+        WHERE doc_checksum = ? AND chunk_checksum IN ({placeholders})
+        """,
+        (doc_checksum, *chunk_checksums)
+      ).fetchall()
+
+  def _trim(self, conn: sqlite3.Connection):
+    # trimming is a full index walk, so only do it every so often
+    self._writes += 1
+    if self._writes % 100 == 0:
+      conn.execute("""
+        DELETE FROM chunks WHERE rowid NOT IN (
+          SELECT rowid FROM chunks ORDER BY created_at DESC LIMIT ?
+        )
+      """, (self.max_size,))
+
+  def _set_contexts(self, doc_checksum: str, contexts: Dict[str, str]):
+    with self._connect() as conn:
+      # a new context invalidates the embedding made from the old one
+      conn.executemany(
+        """
+        INSERT INTO chunks (doc_checksum, chunk_checksum, contextual_text, created_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (doc_checksum, chunk_checksum) DO UPDATE SET
+          contextual_text = excluded.contextual_text,
+          embedding_model = NULL,
+          embedding = NULL,
+          created_at = excluded.created_at
+        """,
+        [(doc_checksum, chunk_checksum, text, time.time()) for chunk_checksum, text in contexts.items()]
+      )
+      self._trim(conn)
+
+  def _set_embeddings(self, doc_checksum: str, embeddings: Dict[str, List[float]], embedding_model: str):
+    with self._connect() as conn:
+      conn.executemany(
+        """
+        UPDATE chunks SET embedding_model = ?, embedding = ?, created_at = ?
+        WHERE doc_checksum = ? AND chunk_checksum = ?
+        """,
+        [
+          (embedding_model, array.array("f", embedding).tobytes(), time.time(), doc_checksum, chunk_checksum)
+          for chunk_checksum, embedding in embeddings.items()
+        ]
+      )
+
+  async def get_many(
+      self,
+      doc_checksum: str,
+      chunk_checksums: List[str],
+      embedding_model: str
+  ) -> Dict[str, Tuple[str, Optional[List[float]]]]:
+    # embeddings made for another model or dimension are dropped, the contextual text is still reused
+    if not self.path or not chunk_checksums:
+      return {}
+
+    try:
+      rows = await asyncio.to_thread(self._get_many, doc_checksum, chunk_checksums)
+    except sqlite3.Error as e:
+      print(f"Failed to read from the chunk cache: {e}")
+      return {}
+
+    cached = {}
+    for chunk_checksum, contextual_text, model, blob in rows:
+      embedding = None
+      if blob is not None and model == embedding_model:
+        vector = array.array("f")
+        vector.frombytes(blob)
+        embedding = vector.tolist()
+      cached[chunk_checksum] = (contextual_text, embedding)
+
+    self.hits += len(cached)
+    self.misses += len(chunk_checksums) - len(cached)
+    return cached
+
+  async def set_contexts(self, doc_checksum: str, contexts: Dict[str, str]):
+    if not self.path or not contexts:
+      return
+
+    try:
+      await asyncio.to_thread(self._set_contexts, doc_checksum, contexts)
+    except sqlite3.Error as e:
+      print(f"Failed to write to the chunk cache: {e}")
+
+  async def set_embeddings(self, doc_checksum: str, embeddings: Dict[str, List[float]], embedding_model: str):
+    if not self.path or not embeddings:
+      return
+
+    try:
+      await asyncio.to_thread(self._set_embeddings, doc_checksum, embeddings, embedding_model)
+    except sqlite3.Error as e:
+      print(f"Failed to write to the chunk cache: {e}")
+
+  def stats(self) -> dict:
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "persistent": self.path is not None
+    }
+
+
+chunk_cache = ChunkCache()
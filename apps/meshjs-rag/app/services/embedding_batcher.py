@@ -0,0 +1,86 @@
+import os
+import asyncio
+from typing import List, Optional, Tuple
+
+from app.services.openai import OpenAIService, EMBEDDING_BATCH_TOKENS, estimate_embedding_tokens
+
+EMBEDDING_COALESCE_DELAY = float(os.getenv("EMBEDDING_COALESCE_DELAY") or 0.05)
+
+# during bulk ingestion many files finish contextualizing at about the same time; their embedding
+# requests are held for a moment and sent together so the api sees a few full batches instead of
+# one small request per file
+class EmbeddingBatcher:
+  def __init__(
+      self,
+      service: OpenAIService,
+      delay: float = EMBEDDING_COALESCE_DELAY,
+      max_tokens: int = EMBEDDING_BATCH_TOKENS
+  ):
+    self.service = service
+    self.delay = delay
+    self.max_tokens = max_tokens
+    self._pending: List[Tuple[List[str], asyncio.Future]] = []
+    self._pending_tokens = 0
+    self._timer: Optional[asyncio.TimerHandle] = None
+    self._tasks = set()
+
+  async def embed(self, texts: List[str]) -> List[List[float]]:
+    if not texts:
+      return []
+
+    future = asyncio.get_running_loop().create_future()
+    self._pending.append((texts, future))
+    self._pending_tokens += sum(estimate_embedding_tokens(text) for text in texts)
+
+    if self._pending_tokens >= self.max_tokens:
+      self._flush()
+    elif self._timer is None:
+      self._timer = asyncio.get_running_loop().call_later(self.delay, self._flush)
+
+    return await future
+
+  def _flush(self):
+    if self._timer:
+      self._timer.cancel()
+      self._timer = None
+
+    pending = self._pending
+    self._pending = []
+    self._pending_tokens = 0
+
+    if pending:
+      task = asyncio.create_task(self._run(pending))
+      self._tasks.add(task)
+      task.add_done_callback(self._tasks.discard)
+
+  async def _run_alone(self, texts: List[str], future: asyncio.Future):
+    try:
+      embeddings = await self.service.get_batch_embeddings(texts)
+    except Exception as e:
+      if not future.done():
+        future.set_exception(e)
+      return
+    if not future.done():
+      future.set_result(embeddings)
+
+  async def _run(self, pending: List[Tuple[List[str], asyncio.Future]]):
+    texts = [text for request_texts, _ in pending for text in request_texts]
+    try:
+      embeddings = await self.service.get_batch_embeddings(texts)
+    except Exception as e:
+      if len(pending) == 1:
+        _, future = pending[0]
+        if not future.done():
+          future.set_exception(e)
+        return
+      # one bad input fails the whole request; send each file's texts on their own so only
+      # the file that caused it fails
+      print(f"A coalesced embedding request for {len(pending)} files failed, retrying them one by one: {e}")
+      await asyncio.gather(*(self._run_alone(request_texts, future) for request_texts, future in pending))
+      return
+
+    start = 0
+    for request_texts, future in pending:
+      if not future.done():
+        future.set_result(embeddings[start:start + len(request_texts)])
+      start += len(request_texts)
@@ -0,0 +1,142 @@
+import os
+import time
+import array
+import sqlite3
+import asyncio
+from collections import OrderedDict
+from typing import List, Optional
+
+from app.utils.checksum import calculate_checksum
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE") or 1024)
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL") or 86400)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or None
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE") or 100000)
+
+def normalize_question(text: str) -> str:
+  return " ".join(text.split()).lower()
+
+
+class SQLiteEmbeddingStore:
+  def __init__(self, path: str, max_size: int = EMBEDDING_CACHE_DISK_SIZE):
+    self.path = path
+    self.max_size = max_size
+    self._writes = 0
+
+    with self._connect() as conn:
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("""
+        CREATE TABLE IF NOT EXISTS query_embeddings(
+          key TEXT PRIMARY KEY,
+          embedding BLOB NOT NULL,
+          created_at REAL NOT NULL
+        )
+      """)
+      conn.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_created_at ON query_embeddings (created_at)")
+
+  def _connect(self) -> sqlite3.Connection:
+    return sqlite3.connect(self.path, timeout=5)
+
+  def get(self, key: str, ttl: float) -> Optional[array.array]:
+    with self._connect() as conn:
+      row = conn.execute(
+        "SELECT embedding FROM query_embeddings WHERE key = ? AND created_at > ?",
+        (key, time.time() - ttl)
+      ).fetchone()
+
+    if row is None:
+      return None
+
+    embedding = array.array("f")
+    embedding.frombytes(row[0])
+    return embedding
+
+  def set(self, key: str, embedding: array.array):
+    with self._connect() as conn:
+      conn.execute(
+        "INSERT OR REPLACE INTO query_embeddings (key, embedding, created_at) VALUES (?, ?, ?)",
+        (key, embedding.tobytes(), time.time())
+      )
+
+      # trimming is a full index walk, so only do it every so often
+      self._writes += 1
+      if self._writes % 100 == 0:
+        conn.execute("""
+          DELETE FROM query_embeddings WHERE key NOT IN (
+            SELECT key FROM query_embeddings ORDER BY created_at DESC LIMIT ?
+          )
+        """, (self.max_size,))
+
+
+class EmbeddingCache:
+  def __init__(
+      self,
+      max_size: int = EMBEDDING_CACHE_SIZE,
+      ttl: float = EMBEDDING_CACHE_TTL,
+      path: Optional[str] = EMBEDDING_CACHE_PATH
+  ):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._entries: "OrderedDict[str, tuple[array.array, float]]" = OrderedDict()
+    self._store = SQLiteEmbeddingStore(path) if path else None
+    self.hits = 0
+    self.misses = 0
+
+  def _key(self, text: str, model: str) -> str:
+    return calculate_checksum(f"{model}:{normalize_question(text)}")
+
+  def _remember(self, key: str, embedding: array.array, created_at: float):
+    self._entries[key] = (embedding, created_at)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  async def get(self, text: str, model: str) -> Optional[List[float]]:
+    key = self._key(text, model)
+    entry = self._entries.get(key)
+
+    if entry and time.monotonic() - entry[1] <= self.ttl:
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return entry[0].tolist()
+
+    if entry:
+      del self._entries[key]
+
+    if self._store:
+      try:
+        embedding = await asyncio.to_thread(self._store.get, key, self.ttl)
+      except sqlite3.Error as e:
+        print(f"Failed to read from the embedding cache: {e}")
+        embedding = None
+
+      if embedding is not None:
+        self._remember(key, embedding, time.monotonic())
+        self.hits += 1
+        return embedding.tolist()
+
+    self.misses += 1
+    return None
+
+  async def set(self, text: str, model: str, embedding: List[float]):
+    key = self._key(text, model)
+    compact = array.array("f", embedding)
+    self._remember(key, compact, time.monotonic())
+
+    if self._store:
+      try:
+        await asyncio.to_thread(self._store.set, key, compact)
+      except sqlite3.Error as e:
+        print(f"Failed to write to the embedding cache: {e}")
+
+  def stats(self) -> dict:
+    return {
+      "size": len(self._entries),
+      "max_size": self.max_size,
+      "hits": self.hits,
+      "misses": self.misses,
+      "persistent": self._store is not None
+    }
+
+
+query_embedding_cache = EmbeddingCache()
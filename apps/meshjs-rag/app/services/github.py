@@ -1,16 +1,28 @@
 import os
+import json
 import httpx
 import asyncio
 import pathlib
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+GITHUB_API_URL = os.getenv("GITHUB_API_URL") or "https://api.github.com"
+GITHUB_DOWNLOAD_CONCURRENCY = int(os.getenv("GITHUB_DOWNLOAD_CONCURRENCY") or 16)
+MANIFEST_FILENAME = ".github-manifest.json"
+# downloaded files waiting for the ingest pipeline; downloads pause while it is full
+GITHUB_STREAM_QUEUE_SIZE = int(os.getenv("GITHUB_STREAM_QUEUE_SIZE") or 32)
+
+OnFile = Optional[Callable[[str], Awaitable[None]]]
 
 class GithubService:
-  def __init__(self, owner, repo, doc_path, output_path):
-    self.base_url="https://api.github.com"
+  def __init__(self, owner, repo, doc_path, output_path, ref="HEAD"):
+    self.base_url=GITHUB_API_URL
     self.owner=owner
     self.repo=repo
-    self.doc_path=doc_path
+    self.doc_path=doc_path.strip("/")
     self.output_path=output_path
+    self.ref=ref
     self.token=os.getenv("GITHUB_TOKEN") or None
+    self.manifest_path=pathlib.Path(output_path) / MANIFEST_FILENAME
 
   def _get_headers(self):
     headers = {
@@ -28,7 +40,7 @@ class GithubService:
       response = await client.get(url)
       response.raise_for_status()
       return response.json()
-    except httpx.HTTPError as e:
+    except httpx.HTTPStatusError as e:
       print(f"Error fetching the directory '{remote_path}': HTTP status {e.response.status_code}")
       return None
     except httpx.RequestError as e:
@@ -47,7 +59,8 @@ class GithubService:
       print(f"Network error while downloading file '{download_url}': {e}")
       return None
 
-  async def _download_and_save(self, client: httpx.AsyncClient, download_url: str, local_path: pathlib.Path):
+  # returns whether the file is on disk and was handed on, downloaded now or left from an earlier run
+  async def _download_and_save(self, client: httpx.AsyncClient, download_url: str, local_path: pathlib.Path, on_file: OnFile = None) -> bool:
     content = await self._download_github_file(client, download_url)
     if content:
       try:
@@ -55,29 +68,207 @@ class GithubService:
         print(f"Downloaded: {download_url} to {local_path}")
       except OSError as e:
         print(f"Failed to write the file to {local_path}: {e}")
+        return False
+    # a failed download still leaves the previous version to ingest
+    elif not local_path.exists():
+      return False
 
-  async def _process_path(self, client: httpx.AsyncClient, current_github_path: str, local_dir: str):
+    if on_file:
+      await on_file(local_path.relative_to(self.output_path).as_posix())
+    return True
+
+  # returns False when a directory could not be listed or a file is missing, so the files handed on
+  # are not the whole tree
+  async def _process_path(self, client: httpx.AsyncClient, current_github_path: str, local_dir: str, on_file: OnFile = None) -> bool:
     items = await self._fetch_github_dir(client, current_github_path)
     if items is None:
-      return
+      return False
 
+    complete = True
     file_tasks = []
     for item in items:
       local_path = pathlib.Path(local_dir) / item["name"]
       if item["type"] == "file" and item.get("download_url"):
-        file_tasks.append(self._download_and_save(client, item["download_url"], local_path))
+        file_tasks.append(self._download_and_save(client, item["download_url"], local_path, on_file))
       elif item["type"] == "dir":
         sub_dir = pathlib.Path(local_dir) / item["name"]
         sub_dir.mkdir(parents=True, exist_ok=True)
-        await self._process_path(client, item["path"], str(sub_dir))
+        complete = await self._process_path(client, item["path"], str(sub_dir), on_file) and complete
 
     if file_tasks:
-      await asyncio.gather(*file_tasks)
+      complete = all(await asyncio.gather(*file_tasks)) and complete
+    return complete
+
+  def _load_manifest(self) -> dict:
+    try:
+      return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+      return {"etag": None, "files": {}}
+
+  def _save_manifest(self, manifest: dict):
+    try:
+      self.manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+    except OSError as e:
+      print(f"Failed to write the download manifest to {self.manifest_path}: {e}")
+
+  async def _fetch_tree(self, client: httpx.AsyncClient, etag: str = None):
+    url = f"{self.base_url}/repos/{self.owner}/{self.repo}/git/trees/{self.ref}"
+    headers = {"If-None-Match": etag} if etag else {}
+    try:
+      response = await client.get(url, params={"recursive": 1}, headers=headers)
+      if response.status_code == 304:
+        return None, etag
+      response.raise_for_status()
+      return response.json(), response.headers.get("ETag")
+    except httpx.HTTPStatusError as e:
+      print(f"Error fetching the tree of '{self.owner}/{self.repo}': HTTP status {e.response.status_code}")
+      raise
+    except httpx.RequestError as e:
+      print(f"Network error while fetching the tree of '{self.owner}/{self.repo}': {e}")
+      raise
+
+  async def _download_blob(self, client: httpx.AsyncClient, sha: str, local_path: pathlib.Path) -> bool:
+    url = f"{self.base_url}/repos/{self.owner}/{self.repo}/git/blobs/{sha}"
+    try:
+      response = await client.get(url, headers={"Accept": "application/vnd.github.raw+json"})
+      response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+      print(f"Error downloading blob '{sha}' for {local_path}: HTTP status {e.response.status_code}")
+      return False
+    except httpx.RequestError as e:
+      print(f"Network error while downloading blob '{sha}' for {local_path}: {e}")
+      return False
+
+    try:
+      local_path.parent.mkdir(parents=True, exist_ok=True)
+      local_path.write_text(response.text, encoding="utf-8")
+      print(f"Downloaded: {sha} to {local_path}")
+      return True
+    except OSError as e:
+      print(f"Failed to write the file to {local_path}: {e}")
+      return False
+
+  async def _sync_file(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, sha: str, path: str, on_file: OnFile) -> bool:
+    local_path = pathlib.Path(self.output_path) / path
+    # the slot is held until the file is handed on, so a full ingest queue slows the downloads down
+    async with semaphore:
+      downloaded = await self._download_blob(client, sha, local_path)
+      # a failed download still leaves the previous version to ingest
+      if on_file and (downloaded or local_path.exists()):
+        await on_file(path)
+    return downloaded
+
+  async def _sync_tree(self, client: httpx.AsyncClient, on_file: OnFile = None) -> bool:
+    manifest = self._load_manifest()
+    output_dir = pathlib.Path(self.output_path)
 
-  async def download_docs(self):
+    try:
+      tree, etag = await self._fetch_tree(client, manifest.get("etag"))
+    except httpx.HTTPError:
+      return False
+
+    # 304: nothing changed upstream, only restore files that went missing locally
+    if tree is None:
+      if all((output_dir / path).exists() for path in manifest["files"]):
+        print(f"No changes in '{self.owner}/{self.repo}/{self.doc_path}'")
+        if on_file:
+          for path in manifest["files"]:
+            await on_file(path)
+        return True
+      try:
+        tree, etag = await self._fetch_tree(client)
+      except httpx.HTTPError:
+        return False
+
+    if tree.get("truncated"):
+      print(f"The tree of '{self.owner}/{self.repo}' is truncated, falling back to walking the directories")
+      return False
+
+    prefix = f"{self.doc_path}/"
+    remote_files = {
+      item["path"][len(prefix):]: item["sha"]
+      for item in tree.get("tree", [])
+      if item["type"] == "blob" and item["path"].startswith(prefix)
+    }
+    local_files = manifest.get("files", {})
+
+    semaphore = asyncio.Semaphore(max(GITHUB_DOWNLOAD_CONCURRENCY, 1))
+    changed = []
+    unchanged = []
+    for path, sha in remote_files.items():
+      if local_files.get(path) != sha or not (output_dir / path).exists():
+        changed.append(path)
+      else:
+        unchanged.append(path)
+
+    # files already on disk are handed on while the changed ones download
+    async def hand_on_unchanged():
+      if on_file:
+        for path in unchanged:
+          await on_file(path)
+
+    _, *results = await asyncio.gather(
+      hand_on_unchanged(),
+      *(self._sync_file(client, semaphore, remote_files[path], path, on_file) for path in changed)
+    )
+
+    for path in set(local_files) - set(remote_files):
+      try:
+        (output_dir / path).unlink(missing_ok=True)
+        print(f"Removed: {output_dir / path}")
+      except OSError as e:
+        print(f"Failed to remove {output_dir / path}: {e}")
+
+    # failed downloads keep their old sha (or none) so they are retried next time
+    downloaded = dict(zip(changed, results))
+    files = {
+      path: sha if downloaded.get(path, True) else local_files.get(path)
+      for path, sha in remote_files.items()
+    }
+    files = {path: sha for path, sha in files.items() if sha}
+
+    self._save_manifest({"etag": etag if all(results) else None, "files": files})
+    print(f"Synced '{self.owner}/{self.repo}/{self.doc_path}': {sum(results)}/{len(changed)} changed files downloaded")
+
+    # a file that failed with no earlier copy on disk was never handed on, so the listing is not the whole tree
+    missing = [path for path in changed if not downloaded[path] and not (output_dir / path).exists()]
+    if missing:
+      raise RuntimeError(f"{len(missing)} files of '{self.owner}/{self.repo}/{self.doc_path}' could not be downloaded: {', '.join(missing[:5])}")
+    return True
+
+  # on_file is awaited with the path (relative to output_path) of every file that is ready on disk,
+  # unchanged ones first and changed ones as soon as they are downloaded. raises once the files are
+  # handed on if part of the tree could not be downloaded, so nothing treats it as complete
+  async def download_docs(self, on_file: OnFile = None):
     pathlib.Path(self.output_path).mkdir(parents=True, exist_ok=True)
     async with httpx.AsyncClient(headers=self._get_headers()) as client:
-      await self._process_path(client, self.doc_path, self.output_path)
+      if await self._sync_tree(client, on_file):
+        return
+      if not await self._process_path(client, self.doc_path, self.output_path, on_file):
+        raise RuntimeError(f"Part of '{self.owner}/{self.repo}/{self.doc_path}' could not be downloaded")
+
+  # yields the files of download_docs while it is still running, so they can be ingested as they arrive
+  async def stream_docs(self) -> AsyncIterator[str]:
+    queue = asyncio.Queue(maxsize=max(GITHUB_STREAM_QUEUE_SIZE, 1))
+
+    async def download():
+      try:
+        await self.download_docs(on_file=queue.put)
+      finally:
+        await queue.put(None)
+
+    task = asyncio.create_task(download())
+    try:
+      while True:
+        path = await queue.get()
+        if path is None:
+          break
+        yield path
+      # surfaces an error of the download itself
+      await task
+    finally:
+      if not task.done():
+        task.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+from supabase import AsyncClient
+
+INGEST_JOB_PROGRESS_INTERVAL = float(os.getenv("INGEST_JOB_PROGRESS_INTERVAL") or 2)
+INGEST_JOB_STALE_AFTER = float(os.getenv("INGEST_JOB_STALE_AFTER") or 300)
+# well under INGEST_JOB_STALE_AFTER, so a download or batch poll without progress doesn't look dead
+INGEST_JOB_HEARTBEAT_INTERVAL = float(os.getenv("INGEST_JOB_HEARTBEAT_INTERVAL") or 30)
+
+RESUMABLE_STATUSES = ("failed", "cancelled", "interrupted")
+
+Runner = Callable[[AsyncClient, Optional[Callable[[dict], Awaitable[None]]]], Awaitable[dict]]
+
+# jobs running in this worker; other workers only see them through the ingest_jobs table
+_running_jobs: Dict[str, asyncio.Task] = {}
+_cancel_requested = set()
+
+async def _update_job(supabase: AsyncClient, job_id: str, fields: dict) -> Optional[dict]:
+  try:
+    response = await supabase.table("ingest_jobs").update(fields).eq("id", job_id).execute()
+  except Exception as e:
+    print(f"Failed to update the ingest job {job_id}: {e}")
+    return None
+
+  return response.data[0] if response.data else None
+
+async def _run_job(supabase: AsyncClient, job_id: str, runner: Runner):
+  await _update_job(supabase, job_id, {"status": "running", "error": None})
+  last_update = 0.0
+
+  # every write returns the row, which is where a cancel from another worker shows up
+  def check_cancelled(job: Optional[dict]):
+    if job and job["status"] == "cancelling" and job_id in _running_jobs:
+      _cancel_requested.add(job_id)
+      _running_jobs[job_id].cancel()
+
+  async def on_progress(progress: dict):
+    nonlocal last_update
+    now = time.monotonic()
+    if now - last_update < INGEST_JOB_PROGRESS_INTERVAL and progress["processed"] < progress["files"]:
+      return
+    last_update = now
+    check_cancelled(await _update_job(supabase, job_id, progress))
+
+  # for the whole run, not only while files are processed: downloads and batch polls report no progress
+  async def heartbeat():
+    while True:
+      await asyncio.sleep(INGEST_JOB_HEARTBEAT_INTERVAL)
+      check_cancelled(await _update_job(supabase, job_id, {"heartbeat_at": datetime.now(timezone.utc).isoformat()}))
+
+  heartbeat_task = asyncio.create_task(heartbeat())
+  try:
+    try:
+      summary = await runner(supabase, on_progress)
+    finally:
+      heartbeat_task.cancel()
+  except asyncio.CancelledError:
+    status = "cancelled" if job_id in _cancel_requested else "interrupted"
+    print(f"Ingest job {job_id} {status}")
+    await _update_job(supabase, job_id, {"status": status})
+    raise
+  except Exception as e:
+    print(f"Ingest job {job_id} failed: {e}")
+    await _update_job(supabase, job_id, {"status": "failed", "error": str(e)})
+  else:
+    await _update_job(supabase, job_id, {
+      "status": "completed",
+      "summary": summary,
+      "files": summary["files"],
+      "processed": summary["files"],
+      "unchanged": summary["unchanged"],
+      "failed": summary["failed"],
+      "files_per_second": summary["files_per_second"]
+    })
+  finally:
+    _running_jobs.pop(job_id, None)
+    _cancel_requested.discard(job_id)
+
+def _start(supabase: AsyncClient, job: dict, runner: Runner) -> dict:
+  _running_jobs[job["id"]] = asyncio.create_task(_run_job(supabase, job["id"], runner))
+  return job
+
+async def enqueue_job(supabase: AsyncClient, source: str, runner: Runner, mode: str = "interactive") -> dict:
+  response = await supabase.table("ingest_jobs").insert({"source": source, "mode": mode}).execute()
+  return _start(supabase, response.data[0], runner)
+
+async def resume_job(supabase: AsyncClient, job: dict, runner: Runner) -> Optional[dict]:
+  if job["id"] in _running_jobs:
+    return None
+
+  # claimed in one conditional update, so of two workers resuming the same job only one starts it,
+  # and a job whose runner is still alive elsewhere (fresh updated_at) is left alone
+  stale_before = (datetime.now(timezone.utc) - timedelta(seconds=INGEST_JOB_STALE_AFTER)).isoformat()
+  response = await supabase.table("ingest_jobs") \
+                          .update({"status": "queued", "error": None, "attempts": job["attempts"] + 1}) \
+                          .eq("id", job["id"]) \
+                          .or_(f'status.in.({",".join(RESUMABLE_STATUSES)}),updated_at.lt."{stale_before}"') \
+                          .execute()
+  if not response.data:
+    return None
+
+  # files recorded in the ingest manifest are skipped, so a resumed job only redoes unfinished files
+  return _start(supabase, response.data[0], runner)
+
+async def get_job(supabase: AsyncClient, job_id: str) -> Optional[dict]:
+  response = await supabase.table("ingest_jobs").select("*").eq("id", job_id).execute()
+  if not response.data:
+    return None
+
+  job = response.data[0]
+  if job["status"] in ("queued", "running", "cancelling") and job["id"] not in _running_jobs:
+    updated_at = datetime.fromisoformat(job["updated_at"])
+    if (datetime.now(timezone.utc) - updated_at).total_seconds() > INGEST_JOB_STALE_AFTER:
+      # no heartbeat for a while: the worker running it died
+      job["status"] = "interrupted"
+  return job
+
+async def cancel_job(supabase: AsyncClient, job_id: str) -> Optional[dict]:
+  task = _running_jobs.get(job_id)
+  if task:
+    _cancel_requested.add(job_id)
+    task.cancel()
+    return await get_job(supabase, job_id)
+
+  # running in another worker: it picks the flag up with its next progress write
+  try:
+    await supabase.table("ingest_jobs") \
+                  .update({"status": "cancelling"}) \
+                  .eq("id", job_id) \
+                  .in_("status", ["queued", "running"]) \
+                  .execute()
+  except Exception as e:
+    print(f"Failed to cancel the ingest job {job_id}: {e}")
+  return await get_job(supabase, job_id)
+
+async def shutdown_jobs():
+  tasks = list(_running_jobs.values())
+  for task in tasks:
+    task.cancel()
+  await asyncio.gather(*tasks, return_exceptions=True)
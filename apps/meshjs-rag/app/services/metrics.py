@@ -0,0 +1,93 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# with several gunicorn workers every process writes its samples under this directory and /metrics
+# merges them, so a scrape sees the whole pod whichever worker answers it
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or None
+
+STAGE_SECONDS = Histogram(
+  "meshai_stage_seconds",
+  "Time spent in each stage of answering and ingesting",
+  ["stage"],
+  buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+
+OPENAI_TOKENS = Counter(
+  "meshai_openai_tokens_total",
+  "OpenAI tokens used, by endpoint, model and kind (prompt or completion)",
+  ["endpoint", "model", "kind"]
+)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# spans of the current request, turned into a Server-Timing header by ServerTimingMiddleware
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("request_timings", default=None)
+
+def observe(stage: str, seconds: float):
+  STAGE_SECONDS.labels(stage).observe(seconds)
+  timings = _request_timings.get()
+  if timings is not None:
+    timings.append((stage, seconds))
+
+@contextmanager
+def span(stage: str):
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    observe(stage, time.perf_counter() - start)
+
+def record_token_usage(endpoint: str, model: Optional[str], usage) -> None:
+  if usage is None:
+    return
+
+  if isinstance(usage, dict):
+    prompt_tokens = usage.get("prompt_tokens")
+    completion_tokens = usage.get("completion_tokens")
+  else:
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+
+  model = model or "unknown"
+  if prompt_tokens:
+    OPENAI_TOKENS.labels(endpoint, model, "prompt").inc(prompt_tokens)
+  if completion_tokens:
+    OPENAI_TOKENS.labels(endpoint, model, "completion").inc(completion_tokens)
+
+def render_metrics() -> bytes:
+  if PROMETHEUS_MULTIPROC_DIR:
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+  return generate_latest(REGISTRY)
+
+
+class ServerTimingMiddleware:
+  # plain asgi so streaming responses pass straight through; spans that finish after the headers
+  # are sent (time to first token, stream duration) only show up in /metrics
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+
+    timings = []
+    token = _request_timings.set(timings)
+
+    async def send_with_timing(message):
+      if message["type"] == "http.response.start" and timings:
+        header = ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings)
+        message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+      await send(message)
+
+    try:
+      await self.app(scope, receive, send_with_timing)
+    finally:
+      _request_timings.reset(token)
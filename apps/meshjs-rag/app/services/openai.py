@@ -1,7 +1,68 @@
-from openai import AsyncOpenAI
-from typing import List
+from openai import AsyncOpenAI, RateLimitError
+from typing import List, Optional
 from tenacity import retry, wait_random_exponential, stop_after_attempt
+import os
+import time
 import json
+import asyncio
+
+from app.services.embedding_cache import query_embedding_cache
+from app.services.rate_limiter import RateLimiter
+from app.services.metrics import span, observe, record_token_usage
+from app.utils.sse import SSE_PASSTHROUGH, coalesce_frames
+
+CONTEXT_MODEL = "gpt-4o-mini"
+EMBEDDING_MODEL = "text-embedding-3-small"
+# must match EMBEDDING_DIMENSIONS used by setup_db for docs.embedding
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 1536)
+# cached query embeddings are only valid for the dimension they were requested with
+EMBEDDING_CACHE_MODEL = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}"
+
+# openai allows 8191 tokens per input, 2048 inputs and 300k tokens per request
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE") or 512)
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS") or 200000)
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY") or 4)
+# code-heavy docs run closer to 3 characters per token than 4, stay on the safe side of the limits
+EMBEDDING_CHARS_PER_TOKEN = 3
+
+def estimate_embedding_tokens(text: str) -> int:
+  return len(text) // EMBEDDING_CHARS_PER_TOKEN + 1
+
+def split_embedding_input(text: str) -> List[str]:
+  # cut oversized inputs into pieces under the per-input limit, at a line break where possible
+  max_chars = EMBEDDING_MAX_INPUT_TOKENS * EMBEDDING_CHARS_PER_TOKEN
+  pieces = []
+  while len(text) > max_chars:
+    cut = text.rfind("\n", max_chars // 2, max_chars)
+    cut = cut if cut > 0 else max_chars
+    pieces.append(text[:cut])
+    text = text[cut:]
+  pieces.append(text)
+  return pieces
+
+def pack_embedding_batches(texts: List[str]) -> List[List[int]]:
+  batches = []
+  batch, batch_tokens = [], 0
+  for i, text in enumerate(texts):
+    tokens = estimate_embedding_tokens(text)
+    if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or batch_tokens + tokens > EMBEDDING_BATCH_TOKENS):
+      batches.append(batch)
+      batch, batch_tokens = [], 0
+    batch.append(i)
+    batch_tokens += tokens
+  if batch:
+    batches.append(batch)
+  return batches
+
+def combine_embeddings(embeddings: List[List[float]], weights: List[int]) -> List[float]:
+  # length-weighted mean of the pieces of a split input, renormalized like the api output
+  combined = [0.0] * len(embeddings[0])
+  for embedding, weight in zip(embeddings, weights):
+    for j, value in enumerate(embedding):
+      combined[j] += value * weight
+  norm = sum(value * value for value in combined) ** 0.5
+  return [value / norm for value in combined] if norm else combined
 
 DOCUMENT_CONTEXT_PROMPT = """
 <document>
@@ -19,9 +80,37 @@ Please give a short succinct context to situate this chunk within the overall do
 Answer only with the succinct context and nothing else.
 """
 
+def situate_context_messages(doc: str, chunk: str) -> List[dict]:
+  return [
+    {
+      "role": "user",
+      "content": DOCUMENT_CONTEXT_PROMPT.format(doc_content=doc)
+    },
+    {
+      "role": "user",
+      "content": CHUNK_CONTEXT_PROMPT.format(chunk_content=chunk)
+    }
+  ]
+
 class OpenAIService:
-  def __init__(self, openai_api_key):
+  def __init__(
+      self,
+      openai_api_key,
+      rate_limiter: Optional[RateLimiter] = None,
+      embedding_rate_limiter: Optional[RateLimiter] = None
+  ):
     self.client = AsyncOpenAI(api_key=openai_api_key)
+    # chat and embedding calls are limited per model, so each gets its own limiter and rate limit headers
+    self.rate_limiter = rate_limiter
+    self.embedding_rate_limiter = embedding_rate_limiter
+    self._embedding_semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+  async def aclose(self):
+    await self.client.close()
+
+  async def check_key(self):
+    # costs no tokens, and openai answers it with a 401 for a key it does not know
+    await self.client.models.retrieve(EMBEDDING_MODEL)
 
   @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
   async def _chat(self, messages, model="gpt-4o-mini", temperature=0.0, max_tokens=None, prompt_cache_key=None, stream: bool = False):
@@ -32,48 +121,114 @@ class OpenAIService:
       "stream": stream
     }
 
+    if stream:
+      # the last chunk then carries the token usage
+      kwargs["stream_options"] = {"include_usage": True}
     if prompt_cache_key:
       kwargs["prompt_cache_key"] = prompt_cache_key
     if max_tokens:
       kwargs["max_tokens"] = max_tokens
 
-    return await self.client.chat.completions.create(**kwargs)
+    if self.rate_limiter is None:
+      return await self.client.chat.completions.create(**kwargs)
 
-  async def situate_context(self, doc: str, chunk: str, cache_key: str) -> str:
-    messages = [
-      {
-        "role": "user",
-        "content": DOCUMENT_CONTEXT_PROMPT.format(doc_content=doc)
-      },
-      {
-        "role": "user",
-        "content": CHUNK_CONTEXT_PROMPT.format(chunk_content=chunk)
-      }
-    ]
+    # rough estimate (~4 chars per token); openai also counts max_tokens against the budget
+    estimated_tokens = sum(len(message["content"]) for message in messages) // 4 + (max_tokens or 0)
+    await self.rate_limiter.acquire(estimated_tokens)
+
+    try:
+      raw_response = await self.client.chat.completions.with_raw_response.create(**kwargs)
+    except RateLimitError as e:
+      self.rate_limiter.backoff(e.response.headers)
+      raise
 
-    response = await self._chat(messages=messages, max_tokens=1024, prompt_cache_key=cache_key)
+    self.rate_limiter.update_from_headers(raw_response.headers)
+    return raw_response.parse()
+
+  async def situate_context(self, doc: str, chunk: str, cache_key: str) -> str:
+    messages = situate_context_messages(doc, chunk)
+    with span("situate_context"):
+      response = await self._chat(messages=messages, model=CONTEXT_MODEL, max_tokens=1024, prompt_cache_key=cache_key)
+    record_token_usage("situate_context", response.model, response.usage)
     return response.choices[0].message.content
 
   @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6), reraise=True)
+  async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+    kwargs = {
+      "model": EMBEDDING_MODEL,
+      "input": texts,
+      "dimensions": EMBEDDING_DIMENSIONS,
+      "encoding_format": "float"
+    }
+
+    async with self._embedding_semaphore:
+      with span("embed_batch"):
+        if self.embedding_rate_limiter is None:
+          response = await self.client.embeddings.create(**kwargs)
+        else:
+          await self.embedding_rate_limiter.acquire(sum(estimate_embedding_tokens(text) for text in texts))
+
+          try:
+            raw_response = await self.client.embeddings.with_raw_response.create(**kwargs)
+          except RateLimitError as e:
+            self.embedding_rate_limiter.backoff(e.response.headers)
+            raise
+
+          self.embedding_rate_limiter.update_from_headers(raw_response.headers)
+          response = raw_response.parse()
+
+    record_token_usage("ingest_embeddings", response.model, response.usage)
+    return [data.embedding for data in sorted(response.data, key=lambda data: data.index)]
+
   async def get_batch_embeddings(self, texts: List[str]) -> List[List[float]]:
-    response = await self.client.embeddings.create(
-      model="text-embedding-3-small",
-      input=texts,
-      encoding_format="float"
-    )
+    pieces = []
+    owners = []
+    for i, text in enumerate(texts):
+      for piece in split_embedding_input(text):
+        pieces.append(piece)
+        owners.append(i)
+
+    # token-bounded sub-batches go out concurrently; each one is retried on its own
+    batches = pack_embedding_batches(pieces)
+    results = await asyncio.gather(*(self._embed_batch([pieces[i] for i in batch]) for batch in batches))
 
-    return [data.embedding for data in response.data]
+    piece_embeddings = [None] * len(pieces)
+    for batch, embeddings in zip(batches, results):
+      for i, embedding in zip(batch, embeddings):
+        piece_embeddings[i] = embedding
+
+    grouped = [([], []) for _ in texts]
+    for piece, owner, embedding in zip(pieces, owners, piece_embeddings):
+      grouped[owner][0].append(embedding)
+      grouped[owner][1].append(len(piece))
+
+    return [
+      embeddings[0] if len(embeddings) == 1 else combine_embeddings(embeddings, weights)
+      for embeddings, weights in grouped
+    ]
 
   @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6), reraise=True)
-  async def embed_query(self, text: str) -> List[float]:
+  async def _embed_query(self, text: str) -> List[float]:
     response = await self.client.embeddings.create(
-      model="text-embedding-3-small",
+      model=EMBEDDING_MODEL,
       input=text,
+      dimensions=EMBEDDING_DIMENSIONS,
       encoding_format="float"
     )
 
+    record_token_usage("embed_query", response.model, response.usage)
     return response.data[0].embedding
 
+  async def embed_query(self, text: str) -> List[float]:
+    with span("embed_query"):
+      cached = await query_embedding_cache.get(text, EMBEDDING_CACHE_MODEL)
+      if cached is not None:
+        return cached
+
+      embedding = await self._embed_query(text)
+      await query_embedding_cache.set(text, EMBEDDING_CACHE_MODEL, embedding)
+      return embedding
+
   @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6), reraise=True)
   async def get_answer(self, question: str, context: str, model="gpt-4o-mini"):
     messages = [
@@ -87,12 +242,47 @@ class OpenAIService:
       }
     ]
 
+    start = time.perf_counter()
+    first_frame = True
     stream = await self._chat(messages=messages, stream=True, model=model)
 
-    async for chunk in stream:
-      yield f"data: {json.dumps(chunk.model_dump())}\n\n"
+    try:
+      async for frame in coalesce_frames(self._sse_frames(stream)):
+        if first_frame:
+          observe("answer_first_token", time.perf_counter() - start)
+          first_frame = False
+        yield frame
+    finally:
+      observe("answer_stream", time.perf_counter() - start)
+      await stream.close()
+
+  async def _sse_frames(self, stream):
+    if SSE_PASSTHROUGH:
+      # openai already sends the frames we would write, forward its bytes without parsing them
+      tail = b""
+      async for chunk in stream.response.aiter_bytes():
+        tail = (tail + chunk)[-4096:]
+        yield chunk
+      if not tail.rstrip().endswith(b"[DONE]"):
+        yield b"data: [DONE]\n\n"
 
-    yield "data: [DONE]\n\n"
+      # only the usage chunk at the end gets parsed
+      for frame in reversed(tail.split(b"\n\n")):
+        if frame.startswith(b"data: {") and b'"usage"' in frame:
+          try:
+            usage_chunk = json.loads(frame[len(b"data: "):])
+          except ValueError:
+            break
+          record_token_usage("chat_completions", usage_chunk.get("model"), usage_chunk.get("usage"))
+          break
+      return
+
+    # pydantic-core serializes straight to json, without the intermediate dict
+    async for chunk in stream:
+      if chunk.usage is not None:
+        record_token_usage("chat_completions", chunk.model, chunk.usage)
+      yield b"data: " + chunk.model_dump_json().encode("utf-8") + b"\n\n"
+    yield b"data: [DONE]\n\n"
 
   @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6), reraise=True)
   async def get_mcp_answer(self, question: str, context: str, model="gpt-4o-mini"):
@@ -107,5 +297,7 @@ class OpenAIService:
       }
     ]
 
-    response = await self._chat(messages=messages, model=model)
+    with span("mcp_answer"):
+      response = await self._chat(messages=messages, model=model)
+    record_token_usage("mcp", response.model, response.usage)
     return response.choices[0].message.content
\ No newline at end of file
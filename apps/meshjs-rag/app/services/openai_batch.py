@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import asyncio
+import pathlib
+from typing import Awaitable, Callable, Dict, List, Optional
+from openai import AsyncOpenAI
+
+from app.services.metrics import record_token_usage
+
+INGEST_BATCH_DIR = os.getenv("INGEST_BATCH_DIR") or "ingest-batches"
+INGEST_BATCH_POLL_INTERVAL = float(os.getenv("INGEST_BATCH_POLL_INTERVAL") or 30)
+# openai accepts up to 50,000 requests and 200 MB per batch input file
+INGEST_BATCH_MAX_REQUESTS = int(os.getenv("INGEST_BATCH_MAX_REQUESTS") or 50000)
+INGEST_BATCH_MAX_BYTES = int(os.getenv("INGEST_BATCH_MAX_BYTES") or 150 * 1024 * 1024)
+
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def _write_parts(name: str, endpoint: str, requests: Dict[str, dict]) -> List[pathlib.Path]:
+  batch_dir = pathlib.Path(INGEST_BATCH_DIR)
+  batch_dir.mkdir(parents=True, exist_ok=True)
+  prefix = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}"
+
+  parts = []
+  lines = []
+  size = 0
+
+  def flush():
+    path = batch_dir / f"{prefix}-{len(parts)}.jsonl"
+    path.write_text("".join(lines), encoding="utf-8")
+    parts.append(path)
+
+  for custom_id, body in requests.items():
+    line = json.dumps({"custom_id": custom_id, "method": "POST", "url": endpoint, "body": body}) + "\n"
+    line_size = len(line.encode("utf-8"))
+    if lines and (len(lines) >= INGEST_BATCH_MAX_REQUESTS or size + line_size > INGEST_BATCH_MAX_BYTES):
+      flush()
+      lines = []
+      size = 0
+    lines.append(line)
+    size += line_size
+
+  if lines:
+    flush()
+  return parts
+
+async def _run_part(
+    client: AsyncOpenAI,
+    path: pathlib.Path,
+    endpoint: str,
+    heartbeat: Optional[Callable[[], Awaitable[None]]]
+) -> Dict[str, dict]:
+  content = await asyncio.to_thread(path.read_bytes)
+  uploaded = await client.files.create(file=(path.name, content), purpose="batch")
+  batch = await client.batches.create(input_file_id=uploaded.id, endpoint=endpoint, completion_window="24h")
+  print(f"Submitted OpenAI batch {batch.id} for {path.name}")
+
+  try:
+    while batch.status not in FINAL_STATUSES:
+      if heartbeat:
+        await heartbeat()
+      await asyncio.sleep(INGEST_BATCH_POLL_INTERVAL)
+      batch = await client.batches.retrieve(batch.id)
+  except asyncio.CancelledError:
+    try:
+      await client.batches.cancel(batch.id)
+    except Exception as e:
+      print(f"Failed to cancel the OpenAI batch {batch.id}: {e}")
+    raise
+
+  if batch.status == "failed":
+    raise RuntimeError(f"OpenAI batch {batch.id} failed: {batch.errors}")
+
+  # expired and cancelled batches still return the requests that finished
+  results = {}
+  # counted apart from the interactive calls, batch tokens are billed at half the price
+  usage_endpoint = "batch_" + endpoint.removeprefix("/v1/").replace("/", "_")
+  if batch.output_file_id:
+    output = await client.files.content(batch.output_file_id)
+    for line in output.text.splitlines():
+      if not line.strip():
+        continue
+      result = json.loads(line)
+      response = result.get("response") or {}
+      if response.get("status_code") == 200:
+        results[result["custom_id"]] = response["body"]
+        record_token_usage(usage_endpoint, response["body"].get("model"), response["body"].get("usage"))
+
+  print(f"OpenAI batch {batch.id} {batch.status}: {len(results)} succeeded, {batch.request_counts.failed if batch.request_counts else 0} failed")
+  return results
+
+async def run_batch(
+    client: AsyncOpenAI,
+    name: str,
+    endpoint: str,
+    requests: Dict[str, dict],
+    heartbeat: Optional[Callable[[], Awaitable[None]]] = None
+) -> Dict[str, dict]:
+  # request bodies are keyed by custom_id, only the successful response bodies come back
+  if not requests:
+    return {}
+
+  parts = await asyncio.to_thread(_write_parts, name, endpoint, requests)
+  results = {}
+  for part_results in await asyncio.gather(*(_run_part(client, path, endpoint, heartbeat) for path in parts)):
+    results.update(part_results)
+  return results
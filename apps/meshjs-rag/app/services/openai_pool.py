@@ -0,0 +1,159 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, TypeVar
+
+from app.services.openai import OpenAIService
+from app.utils.checksum import calculate_checksum
+
+OPENAI_CLIENT_CACHE_SIZE = int(os.getenv("OPENAI_CLIENT_CACHE_SIZE") or 128)
+OPENAI_CLIENT_IDLE_TTL = float(os.getenv("OPENAI_CLIENT_IDLE_TTL") or 600)
+OPENAI_KEY_VERIFIED_TTL = float(os.getenv("OPENAI_KEY_VERIFIED_TTL") or 300)
+
+T = TypeVar("T")
+
+class _PooledService:
+  def __init__(self, service: OpenAIService, now: float):
+    self.service = service
+    self.last_used = now
+    self.leases = 0
+    self.evicted = False
+
+class OpenAIServicePool:
+  def __init__(
+      self,
+      max_size: int = OPENAI_CLIENT_CACHE_SIZE,
+      idle_ttl: float = OPENAI_CLIENT_IDLE_TTL,
+      verified_ttl: float = OPENAI_KEY_VERIFIED_TTL
+  ):
+    self.max_size = max_size
+    self.idle_ttl = idle_ttl
+    self.verified_ttl = verified_ttl
+    self._services: "OrderedDict[str, _PooledService]" = OrderedDict()
+    self._lock = asyncio.Lock()
+    # key hash -> when openai last accepted the key, and the checks still running
+    self._verified: Dict[str, float] = {}
+    self._verifying: Dict[str, asyncio.Task] = {}
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  async def _close(self, entry: _PooledService):
+    try:
+      await entry.service.aclose()
+    except Exception as e:
+      print(f"Failed to close the evicted OpenAI client: {e}")
+
+  async def _evict(self, keys: List[str]):
+    self.evictions += len(keys)
+    for key in keys:
+      entry = self._services.pop(key)
+      entry.evicted = True
+      # a service still in use is closed by its last lease instead
+      if entry.leases == 0:
+        await self._close(entry)
+
+  async def _acquire(self, openai_api_key: str) -> _PooledService:
+    # keyed by a hash so raw api keys are never kept around as dict keys
+    key = calculate_checksum(openai_api_key)
+    now = time.monotonic()
+
+    async with self._lock:
+      await self._evict([
+        k for k, entry in self._services.items()
+        if entry.leases == 0 and now - entry.last_used > self.idle_ttl and k != key
+      ])
+
+      entry = self._services.get(key)
+      if entry:
+        self.hits += 1
+        self._services.move_to_end(key)
+      else:
+        self.misses += 1
+        entry = _PooledService(OpenAIService(openai_api_key), now)
+        self._services[key] = entry
+
+      entry.leases += 1
+      entry.last_used = now
+
+      if len(self._services) > self.max_size:
+        await self._evict(list(self._services.keys())[:len(self._services) - self.max_size])
+
+      return entry
+
+  async def _release(self, entry: _PooledService):
+    entry.leases -= 1
+    entry.last_used = time.monotonic()
+    if entry.evicted and entry.leases == 0:
+      await self._close(entry)
+
+  # the service is only closed once every lease on it has been released, even if it was evicted meanwhile
+  @asynccontextmanager
+  async def lease(self, openai_api_key: str) -> AsyncIterator[OpenAIService]:
+    entry = await self._acquire(openai_api_key)
+    try:
+      yield entry.service
+    finally:
+      await self._release(entry)
+
+  async def run(self, openai_api_key: str, fn: Callable[[OpenAIService], Awaitable[T]]) -> T:
+    async with self.lease(openai_api_key) as service:
+      return await fn(service)
+
+  # holds the lease for as long as the stream is read, which can be after the request handler returned
+  async def stream(self, openai_api_key: str, start: Callable[[OpenAIService], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+    async with self.lease(openai_api_key) as service:
+      async for frame in start(service):
+        yield frame
+
+  async def _check(self, openai_api_key: str, key: str):
+    await self.run(openai_api_key, lambda service: service.check_key())
+    now = time.monotonic()
+    self._verified = {k: checked_at for k, checked_at in self._verified.items() if now - checked_at < self.verified_ttl}
+    self._verified[key] = now
+
+  def _forget_check(self, key: str, task: asyncio.Task):
+    if self._verifying.get(key) is task:
+      del self._verifying[key]
+    # every caller may have left before the check finished
+    if not task.cancelled():
+      task.exception()
+
+  # cache hits and calls shared with other requests never reach openai with the caller's key, so
+  # callers have to prove it works first; raises openai.AuthenticationError for a key openai rejects
+  async def verify(self, openai_api_key: str):
+    key = calculate_checksum(openai_api_key)
+    checked_at = self._verified.get(key)
+    if checked_at is not None and time.monotonic() - checked_at < self.verified_ttl:
+      return
+
+    task = self._verifying.get(key)
+    if task is None:
+      task = asyncio.create_task(self._check(openai_api_key, key))
+      self._verifying[key] = task
+      task.add_done_callback(lambda done: self._forget_check(key, done))
+    await asyncio.shield(task)
+
+  async def aclose(self):
+    async with self._lock:
+      entries = list(self._services.values())
+      self._services.clear()
+      for entry in entries:
+        entry.evicted = True
+        await self._close(entry)
+
+  def stats(self) -> dict:
+    return {
+      "size": len(self._services),
+      "max_size": self.max_size,
+      "in_use": sum(1 for entry in self._services.values() if entry.leases),
+      "verified_keys": len(self._verified),
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions
+    }
+
+
+openai_service_pool = OpenAIServicePool()
@@ -0,0 +1,112 @@
+import os
+import re
+import time
+import asyncio
+from typing import Mapping, Optional
+
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE") or 500)
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE") or 200000)
+# openai limits every model separately, and the embedding model's budget is much larger than the chat model's
+OPENAI_EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_EMBEDDING_REQUESTS_PER_MINUTE") or 3000)
+OPENAI_EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_EMBEDDING_TOKENS_PER_MINUTE") or 1000000)
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+  # openai reports resets like "20ms", "1.5s" or "6m0s"
+  if not value:
+    return None
+  matches = DURATION_PATTERN.findall(value)
+  if not matches:
+    try:
+      return float(value)
+    except ValueError:
+      return None
+  return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in matches)
+
+
+class RateLimiter:
+  def __init__(
+      self,
+      requests_per_minute: int = OPENAI_REQUESTS_PER_MINUTE,
+      tokens_per_minute: int = OPENAI_TOKENS_PER_MINUTE
+  ):
+    self.requests_per_minute = requests_per_minute
+    self.tokens_per_minute = tokens_per_minute
+    self._requests = float(requests_per_minute)
+    self._tokens = float(tokens_per_minute)
+    self._updated_at = time.monotonic()
+    self._paused_until = 0.0
+    self._lock = asyncio.Lock()
+
+  def _refill(self):
+    now = time.monotonic()
+    elapsed = now - self._updated_at
+    self._updated_at = now
+    self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+    self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+  async def acquire(self, tokens: int = 1):
+    # the lock is held while waiting so callers are served in arrival order
+    async with self._lock:
+      while True:
+        self._refill()
+        tokens_needed = min(tokens, self.tokens_per_minute)
+        now = time.monotonic()
+
+        if now < self._paused_until:
+          wait = self._paused_until - now
+        elif self._requests >= 1 and self._tokens >= tokens_needed:
+          self._requests -= 1
+          self._tokens -= tokens_needed
+          return
+        else:
+          wait = max(
+            (1 - self._requests) * 60 / self.requests_per_minute,
+            (tokens_needed - self._tokens) * 60 / self.tokens_per_minute,
+            0.01
+          )
+
+        await asyncio.sleep(wait)
+
+  def update_from_headers(self, headers: Mapping[str, str]):
+    try:
+      limit_requests = headers.get("x-ratelimit-limit-requests")
+      limit_tokens = headers.get("x-ratelimit-limit-tokens")
+      remaining_requests = headers.get("x-ratelimit-remaining-requests")
+      remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+
+      # follow whatever tier the key is actually on
+      if limit_requests:
+        self.requests_per_minute = int(limit_requests)
+      if limit_tokens:
+        self.tokens_per_minute = int(limit_tokens)
+
+      self._refill()
+      if remaining_requests:
+        self._requests = min(self._requests, float(remaining_requests))
+      if remaining_tokens:
+        self._tokens = min(self._tokens, float(remaining_tokens))
+    except ValueError as e:
+      print(f"Ignoring malformed rate limit headers: {e}")
+
+  def backoff(self, headers: Optional[Mapping[str, str]] = None, default: float = 2.0):
+    headers = headers or {}
+    retry_after = None
+    if headers.get("retry-after-ms"):
+      retry_after = parse_duration(headers["retry-after-ms"] + "ms")
+    retry_after = retry_after or parse_duration(headers.get("retry-after"))
+    retry_after = retry_after or max(
+      parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+      parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0
+    ) or default
+
+    print(f"OpenAI rate limit hit, pausing requests for {retry_after:.2f}s")
+    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+    self._requests = 0
+    self._tokens = 0
+
+
+openai_rate_limiter = RateLimiter()
+openai_embedding_rate_limiter = RateLimiter(OPENAI_EMBEDDING_REQUESTS_PER_MINUTE, OPENAI_EMBEDDING_TOKENS_PER_MINUTE)
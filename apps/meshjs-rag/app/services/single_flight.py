@@ -0,0 +1,150 @@
+import os
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+SINGLE_FLIGHT_RETRIEVAL = (os.getenv("SINGLE_FLIGHT_RETRIEVAL") or "true").lower() in ("1", "true", "yes")
+SINGLE_FLIGHT_ANSWERS = (os.getenv("SINGLE_FLIGHT_ANSWERS") or "true").lower() in ("1", "true", "yes")
+
+T = TypeVar("T")
+
+# concurrent calls with the same key share one in-flight task. the task is not owned by any caller,
+# so the first caller disconnecting does not cancel it for the others
+class SingleFlight:
+  def __init__(self, enabled: bool = True):
+    self.enabled = enabled
+    self._calls: Dict[str, asyncio.Task] = {}
+    self.calls = 0
+    self.shared = 0
+
+  def _forget(self, key: str, task: asyncio.Task):
+    if self._calls.get(key) is task:
+      del self._calls[key]
+    # nobody may be left to look at the outcome
+    if not task.cancelled():
+      task.exception()
+
+  async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+    if not self.enabled:
+      return await fn()
+
+    task = self._calls.get(key)
+    if task is None:
+      self.calls += 1
+      task = asyncio.create_task(fn())
+      self._calls[key] = task
+      task.add_done_callback(lambda done: self._forget(key, done))
+      return await asyncio.shield(task)
+
+    self.shared += 1
+    try:
+      return await asyncio.shield(task)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      # the shared call can fail for reasons of its own, e.g. the api key it ran with; don't inherit that
+      return await fn()
+
+  def stats(self) -> dict:
+    return {
+      "in_flight": len(self._calls),
+      "calls": self.calls,
+      "shared": self.shared
+    }
+
+
+class _Broadcast:
+  def __init__(self):
+    self.frames: List[bytes] = []
+    self.finished = False
+    self.error: Optional[BaseException] = None
+    self.subscribers = 0
+    self.changed = asyncio.Condition()
+    self.task: Optional[asyncio.Task] = None
+
+
+# one upstream stream per key, replayed to every subscriber from the first frame on. subscribers
+# can join while it is running; the upstream is cancelled once the last one has left
+class StreamFanout:
+  def __init__(self, enabled: bool = True):
+    self.enabled = enabled
+    self._streams: Dict[str, _Broadcast] = {}
+    self.streams = 0
+    self.shared = 0
+
+  async def _pump(self, key: str, broadcast: _Broadcast, stream: AsyncIterator[bytes]):
+    try:
+      async for frame in stream:
+        async with broadcast.changed:
+          broadcast.frames.append(frame)
+          broadcast.changed.notify_all()
+    except BaseException as e:
+      broadcast.error = e
+      if isinstance(e, asyncio.CancelledError):
+        raise
+    finally:
+      if self._streams.get(key) is broadcast:
+        del self._streams[key]
+      async with broadcast.changed:
+        broadcast.finished = True
+        broadcast.changed.notify_all()
+
+  async def subscribe(self, key: str, start: Callable[[], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+    if not self.enabled:
+      async for frame in start():
+        yield frame
+      return
+
+    broadcast = self._streams.get(key)
+    joined = broadcast is not None
+    if broadcast is None:
+      self.streams += 1
+      broadcast = _Broadcast()
+      self._streams[key] = broadcast
+      broadcast.task = asyncio.create_task(self._pump(key, broadcast, start()))
+    else:
+      self.shared += 1
+
+    broadcast.subscribers += 1
+    sent = 0
+    try:
+      while True:
+        async with broadcast.changed:
+          await broadcast.changed.wait_for(lambda: len(broadcast.frames) > sent or broadcast.finished)
+          frames = broadcast.frames[sent:]
+          finished = broadcast.finished
+
+        for frame in frames:
+          yield frame
+        sent += len(frames)
+
+        if finished and sent >= len(broadcast.frames):
+          break
+    finally:
+      broadcast.subscribers -= 1
+      if broadcast.subscribers == 0 and not broadcast.finished:
+        if self._streams.get(key) is broadcast:
+          del self._streams[key]
+        broadcast.task.cancel()
+
+    if broadcast.error is None:
+      return
+    # like SingleFlight.do, a joined stream that failed before sending anything can have failed for
+    # reasons of its own; start one for this caller instead. after the first frame a retry would
+    # repeat what the caller already got
+    if joined and sent == 0 and not isinstance(broadcast.error, asyncio.CancelledError):
+      async for frame in start():
+        yield frame
+      return
+    raise broadcast.error
+
+  def stats(self) -> dict:
+    return {
+      "in_flight": len(self._streams),
+      "streams": self.streams,
+      "shared": self.shared
+    }
+
+
+retrieval_flight = SingleFlight(enabled=SINGLE_FLIGHT_RETRIEVAL)
+answer_flight = SingleFlight(enabled=SINGLE_FLIGHT_ANSWERS)
+answer_streams = StreamFanout(enabled=SINGLE_FLIGHT_ANSWERS)
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import asyncio
+import pathlib
+import numpy as np
+from typing import List, Optional
+from supabase import AsyncClient
+
+from app.utils.corpus_version import get_corpus_version
+from app.utils.build_context import add_similarities
+
+VECTOR_SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR") or "vector-snapshot"
+VECTOR_SNAPSHOT_DTYPE = os.getenv("VECTOR_SNAPSHOT_DTYPE") or "float32"
+VECTOR_SNAPSHOT_PAGE_SIZE = 1000
+# rows of a float16 snapshot upcast at a time for scoring
+VECTOR_SNAPSHOT_BLOCK_ROWS = 4096
+
+if VECTOR_SNAPSHOT_DTYPE not in ("float32", "float16"):
+  raise ValueError("VECTOR_SNAPSHOT_DTYPE must be either 'float32' or 'float16'")
+
+ROW_COLUMNS = ("id", "contextual_text", "filepath", "chunk_id", "chunk_title", "checksum", "updated_at")
+
+# read-only replica of docs.embedding as a memory-mapped matrix of unit vectors. snapshots live in
+# versioned directories behind a CURRENT pointer, so gunicorn workers map the same pages and a
+# rebuild never touches a file that is being read
+class LocalVectorIndex:
+  def __init__(self, snapshot_dir: str = VECTOR_SNAPSHOT_DIR, dtype: str = VECTOR_SNAPSHOT_DTYPE):
+    self.snapshot_dir = pathlib.Path(snapshot_dir)
+    self.dtype = dtype
+    self.matrix: Optional[np.ndarray] = None
+    self.rows: List[dict] = []
+    self.corpus_version: Optional[int] = None
+    self.max_updated_at: Optional[str] = None
+    self._snapshot_name: Optional[str] = None
+    self._refresh_task: Optional[asyncio.Task] = None
+
+  def _load(self) -> bool:
+    try:
+      name = (self.snapshot_dir / "CURRENT").read_text(encoding="utf-8").strip()
+      if name == self._snapshot_name:
+        return True
+
+      path = self.snapshot_dir / name
+      meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+      rows = json.loads((path / "rows.json").read_text(encoding="utf-8"))
+      matrix = np.load(path / "embeddings.npy", mmap_mode="r")
+    except (OSError, ValueError) as e:
+      print(f"Local vector snapshot is not available: {e}")
+      return False
+
+    self.matrix = matrix
+    self.rows = rows
+    self.corpus_version = meta["corpus_version"]
+    self.max_updated_at = meta["max_updated_at"]
+    self._snapshot_name = name
+    return True
+
+  def _write(self, rows: List[dict], embeddings: np.ndarray, corpus_version: Optional[int]):
+    self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+    name = f"v{corpus_version}-{time.time_ns()}"
+    path = self.snapshot_dir / name
+    path.mkdir()
+
+    np.save(path / "embeddings.npy", np.ascontiguousarray(embeddings, dtype=self.dtype))
+    (path / "rows.json").write_text(json.dumps(rows), encoding="utf-8")
+    (path / "meta.json").write_text(json.dumps({
+      "corpus_version": corpus_version,
+      "max_updated_at": max((row["updated_at"] for row in rows), default=None),
+      "dtype": self.dtype
+    }), encoding="utf-8")
+
+    pointer = self.snapshot_dir / "CURRENT.tmp"
+    pointer.write_text(name, encoding="utf-8")
+    os.replace(pointer, self.snapshot_dir / "CURRENT")
+
+    # workers still mapping an older snapshot keep their pages after the unlink
+    for old in self.snapshot_dir.iterdir():
+      if old.is_dir() and old.name not in (name, self._snapshot_name):
+        shutil.rmtree(old, ignore_errors=True)
+
+  def _lock(self):
+    self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+    lock_file = open(self.snapshot_dir / ".lock", "w")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+  @staticmethod
+  async def _fetch_rows(supabase: AsyncClient, columns, updated_after: Optional[str] = None) -> List[dict]:
+    rows = []
+    start = 0
+    while True:
+      query = supabase.table("docs").select(*columns)
+      if updated_after:
+        query = query.gte("updated_at", updated_after)
+      response = await query.order("id").range(start, start + VECTOR_SNAPSHOT_PAGE_SIZE - 1).execute()
+      rows.extend(response.data)
+      if len(response.data) < VECTOR_SNAPSHOT_PAGE_SIZE:
+        return rows
+      start += VECTOR_SNAPSHOT_PAGE_SIZE
+
+  @staticmethod
+  def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+  async def _rebuild(self, supabase: AsyncClient, corpus_version: Optional[int]):
+    # only rows changed since the last snapshot are downloaded; deletions are found from the id list
+    incremental = self.matrix is not None and self.max_updated_at is not None
+    changed = await self._fetch_rows(
+      supabase,
+      (*ROW_COLUMNS, "embedding"),
+      updated_after=self.max_updated_at if incremental else None
+    )
+    current_ids = {row["id"] for row in await self._fetch_rows(supabase, ("id",))} if incremental else None
+
+    changed = [row for row in changed if row.get("embedding")]
+    vectors = []
+    for row in changed:
+      embedding = row.pop("embedding")
+      vectors.append(json.loads(embedding) if isinstance(embedding, str) else embedding)
+    changed_embeddings = np.array(vectors, dtype=np.float32)
+    changed_ids = {row["id"] for row in changed}
+
+    if incremental:
+      keep = [i for i, row in enumerate(self.rows) if row["id"] in current_ids and row["id"] not in changed_ids]
+      rows = [self.rows[i] for i in keep] + changed
+      # after an embedding migration every row comes back changed, in the new dimension
+      parts = [np.asarray(self.matrix[keep], dtype=np.float32)] if keep else []
+      if len(changed):
+        parts.append(self._normalize(changed_embeddings))
+      embeddings = np.vstack(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+    else:
+      rows = changed
+      embeddings = self._normalize(changed_embeddings) if len(changed) else np.zeros((0, 0), dtype=np.float32)
+
+    await asyncio.to_thread(self._write, rows, embeddings, corpus_version)
+    print(f"Local vector snapshot at corpus version {corpus_version}: {len(rows)} rows ({len(changed)} fetched)")
+
+  async def refresh(self, supabase: AsyncClient, corpus_version: Optional[int]):
+    lock_file = await asyncio.to_thread(self._lock)
+    try:
+      # another worker may have built this version while we waited for the lock
+      await asyncio.to_thread(self._load)
+      if self.matrix is not None and self.corpus_version == corpus_version:
+        return
+      await self._rebuild(supabase, corpus_version)
+      await asyncio.to_thread(self._load)
+    except Exception as e:
+      print(f"Failed to refresh the local vector snapshot: {e}")
+    finally:
+      lock_file.close()
+
+  def _schedule_refresh(self, supabase: AsyncClient, corpus_version: Optional[int]):
+    if self._refresh_task is None or self._refresh_task.done():
+      self._refresh_task = asyncio.create_task(self.refresh(supabase, corpus_version))
+
+  def _scores(self, queries: np.ndarray) -> np.ndarray:
+    if self.matrix.dtype == np.float32:
+      return queries @ self.matrix.T
+
+    # numpy has no blas for float16; upcasting a block at a time keeps the mapped pages shared
+    # and the per-query copy small, instead of a float32 copy of the whole matrix
+    scores = np.empty((len(queries), len(self.matrix)), dtype=np.float32)
+    for start in range(0, len(self.matrix), VECTOR_SNAPSHOT_BLOCK_ROWS):
+      block = self.matrix[start:start + VECTOR_SNAPSHOT_BLOCK_ROWS]
+      scores[:, start:start + len(block)] = queries @ block.astype(np.float32).T
+    return scores
+
+  def _top_k(self, queries: np.ndarray, match_count: int, match_threshold: float) -> List[List[dict]]:
+    queries = self._normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+    scores = self._scores(queries)
+
+    k = min(match_count, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k else np.zeros((len(queries), 0), dtype=int)
+
+    results = []
+    for query_scores, candidates in zip(scores, top):
+      ordered = [i for i in candidates[np.argsort(-query_scores[candidates])] if query_scores[i] > match_threshold]
+      matches = [{**self.rows[i], "similarity": float(query_scores[i])} for i in ordered]
+      results.append(add_similarities(matches, np.asarray(self.matrix[ordered], dtype=np.float32)) if matches else [])
+    return results
+
+  async def search(
+      self,
+      supabase: AsyncClient,
+      embedding: List[float],
+      match_count: int,
+      match_threshold: float
+  ) -> Optional[List[dict]]:
+    corpus_version = await get_corpus_version(supabase)
+
+    if self.matrix is None and not self._load():
+      # no snapshot yet: build one in the background and let the caller fall back to match_docs
+      self._schedule_refresh(supabase, corpus_version)
+      return None
+
+    if corpus_version != self.corpus_version:
+      if not self._load() or corpus_version != self.corpus_version:
+        self._schedule_refresh(supabase, corpus_version)
+
+    if self.matrix.ndim != 2 or not len(self.matrix):
+      return None
+
+    if self.matrix.shape[1] != len(embedding):
+      # snapshot from before an embedding migration
+      self._schedule_refresh(supabase, corpus_version)
+      return None
+
+    return self._top_k(np.asarray(embedding, dtype=np.float32), match_count, match_threshold)[0]
+
+
+local_vector_index = LocalVectorIndex()
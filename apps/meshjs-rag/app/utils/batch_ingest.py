@@ -0,0 +1,149 @@
+import pathlib
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+from supabase import AsyncClient
+
+from app.services.chunk_cache import chunk_cache
+from app.services.openai import (
+  CONTEXT_MODEL,
+  EMBEDDING_CACHE_MODEL,
+  EMBEDDING_DIMENSIONS,
+  EMBEDDING_MODEL,
+  combine_embeddings,
+  situate_context_messages,
+  split_embedding_input
+)
+from app.services.openai_batch import run_batch
+from app.utils.checksum import calculate_checksum
+from app.utils.get_file_content import get_file_content
+from app.utils.ingest_manifest import load_manifest
+from app.utils.process_chunks import join_context, openai_service
+
+PAGE_SIZE = 1000
+
+async def _existing_checksums(supabase: AsyncClient) -> Dict[str, Set[str]]:
+  existing = defaultdict(set)
+  start = 0
+  while True:
+    response = await supabase.table("docs") \
+                            .select("filepath", "checksum") \
+                            .order("id") \
+                            .range(start, start + PAGE_SIZE - 1) \
+                            .execute()
+    for row in response.data:
+      existing[row["filepath"]].add(row["checksum"])
+    if len(response.data) < PAGE_SIZE:
+      return existing
+    start += PAGE_SIZE
+
+def _by_document(keys) -> Dict[str, List[str]]:
+  grouped = defaultdict(list)
+  for doc_checksum, chunk_checksum in keys:
+    grouped[doc_checksum].append(chunk_checksum)
+  return grouped
+
+# offline half of a batch ingest: every chunk the normal path would send to situate_context and the
+# embeddings endpoint goes through the Batch API instead, and the results land in the chunk cache.
+# the regular ingest_files run afterwards then finds them there and only writes to the database;
+# anything the batches did not return is still done interactively
+async def prewarm_chunk_cache(
+    files: List[Tuple[Union[str, pathlib.Path], str]],
+    chunk_file: Callable[[str, str], List[str]],
+    supabase: AsyncClient,
+    source: str,
+    on_progress: Optional[Callable[[dict], Awaitable[None]]] = None
+):
+  if not chunk_cache.path:
+    raise ValueError("Batch ingestion needs the chunk cache, set CHUNK_CACHE_PATH")
+
+  async def heartbeat():
+    if on_progress:
+      await on_progress({"files": len(files), "processed": 0, "unchanged": 0, "failed": [], "files_per_second": 0.0})
+
+  manifest = await load_manifest(supabase, source)
+  existing = await _existing_checksums(supabase)
+
+  # same checks as process_chunks_and_update_db: unchanged files and chunks are never sent
+  chunks: Dict[Tuple[str, str], Tuple[str, str]] = {}
+  for abs_path, relative_path in files:
+    try:
+      file_content = get_file_content(abs_path)
+    except (FileNotFoundError, IOError):
+      continue
+
+    doc_checksum = calculate_checksum(file_content)
+    if manifest.get(relative_path) == doc_checksum:
+      continue
+
+    for chunk in chunk_file(file_content, relative_path):
+      chunk_checksum = calculate_checksum(chunk)
+      if chunk_checksum not in existing.get(relative_path, ()):
+        chunks[(doc_checksum, chunk_checksum)] = (file_content, chunk)
+
+  contexts: Dict[Tuple[str, str], str] = {}
+  embedded: Set[Tuple[str, str]] = set()
+  for doc_checksum, chunk_checksums in _by_document(chunks).items():
+    cached = await chunk_cache.get_many(doc_checksum, chunk_checksums, EMBEDDING_CACHE_MODEL)
+    for chunk_checksum, (contextual_text, embedding) in cached.items():
+      contexts[(doc_checksum, chunk_checksum)] = contextual_text
+      if embedding is not None:
+        embedded.add((doc_checksum, chunk_checksum))
+
+  print(f"Batch ingest of {source}: {len(chunks)} changed chunks, {len(contexts)} contexts and {len(embedded)} embeddings already cached")
+
+  context_requests = {
+    f"{doc_checksum}:{chunk_checksum}": {
+      "model": CONTEXT_MODEL,
+      "messages": situate_context_messages(file_content, chunk),
+      "max_tokens": 1024,
+      "temperature": 0.0
+    }
+    for (doc_checksum, chunk_checksum), (file_content, chunk) in chunks.items()
+    if (doc_checksum, chunk_checksum) not in contexts
+  }
+
+  try:
+    results = await run_batch(openai_service.client, f"{source}-contexts", "/v1/chat/completions", context_requests, heartbeat)
+  except Exception as e:
+    print(f"Context batch for {source} failed, those chunks will be contextualized interactively: {e}")
+    results = {}
+
+  new_contexts = defaultdict(dict)
+  for custom_id, body in results.items():
+    doc_checksum, chunk_checksum = custom_id.split(":")
+    contextual_text = join_context(body["choices"][0]["message"]["content"], chunks[(doc_checksum, chunk_checksum)][1])
+    contexts[(doc_checksum, chunk_checksum)] = contextual_text
+    new_contexts[doc_checksum][chunk_checksum] = contextual_text
+
+  for doc_checksum, doc_contexts in new_contexts.items():
+    await chunk_cache.set_contexts(doc_checksum, doc_contexts)
+
+  # oversized inputs are sent as several pieces in one request and combined like get_batch_embeddings does
+  pieces = {key: split_embedding_input(text) for key, text in contexts.items() if key not in embedded}
+  embedding_requests = {
+    f"{doc_checksum}:{chunk_checksum}": {
+      "model": EMBEDDING_MODEL,
+      "input": key_pieces,
+      "dimensions": EMBEDDING_DIMENSIONS,
+      "encoding_format": "float"
+    }
+    for (doc_checksum, chunk_checksum), key_pieces in pieces.items()
+  }
+
+  try:
+    results = await run_batch(openai_service.client, f"{source}-embeddings", "/v1/embeddings", embedding_requests, heartbeat)
+  except Exception as e:
+    print(f"Embedding batch for {source} failed, those chunks will be embedded interactively: {e}")
+    results = {}
+
+  new_embeddings = defaultdict(dict)
+  for custom_id, body in results.items():
+    doc_checksum, chunk_checksum = custom_id.split(":")
+    embeddings = [data["embedding"] for data in sorted(body["data"], key=lambda data: data["index"])]
+    weights = [len(piece) for piece in pieces[(doc_checksum, chunk_checksum)]]
+    new_embeddings[doc_checksum][chunk_checksum] = embeddings[0] if len(embeddings) == 1 else combine_embeddings(embeddings, weights)
+
+  for doc_checksum, doc_embeddings in new_embeddings.items():
+    await chunk_cache.set_embeddings(doc_checksum, doc_embeddings, EMBEDDING_CACHE_MODEL)
+
+  print(f"Batch ingest of {source}: {sum(map(len, new_contexts.values()))} contexts and {sum(map(len, new_embeddings.values()))} embeddings cached")
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+from typing import List, Optional
+
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES") or 20)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET") or 3000)
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA") or 0.7)
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD") or 0.95)
+CONTEXT_SIMILARITY_GAP = float(os.getenv("CONTEXT_SIMILARITY_GAP") or 0.08)
+
+def estimate_tokens(text: str) -> int:
+  # ~4 characters per token for english text and code
+  return len(text) // 4 + 1
+
+# the pairwise similarities mmr needs, in the shape match_docs returns them: {id: similarity} per match
+def add_similarities(matches: List[dict], vectors: np.ndarray) -> List[dict]:
+  norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+  norms[norms == 0] = 1
+  vectors = vectors / norms
+  ids = [str(match["id"]) for match in matches]
+  return [
+    {**match, "similarities": dict(zip(ids, row.tolist()))}
+    for match, row in zip(matches, vectors @ vectors.T)
+  ]
+
+def _similarity(a: dict, b: dict) -> float:
+  return float(a["similarities"].get(str(b["id"]), 0.0))
+
+def _cut_at_gap(matches: List[dict], gap: float) -> List[dict]:
+  # keep the leading run of candidates, stop at the first big drop in similarity
+  for i in range(1, len(matches)):
+    if matches[i - 1]["similarity"] - matches[i]["similarity"] > gap:
+      return matches[:i]
+  return matches
+
+def _select_mmr(matches: List[dict], mmr_lambda: float, duplicate_threshold: float) -> List[dict]:
+  remaining = list(range(len(matches)))
+  selected = []
+
+  while remaining:
+    best, best_score = None, None
+    for i in remaining:
+      redundancy = max((_similarity(matches[i], matches[j]) for j in selected), default=0.0)
+      if redundancy > duplicate_threshold:
+        continue
+      score = mmr_lambda * matches[i]["relevance"] - (1 - mmr_lambda) * redundancy
+      if best_score is None or score > best_score:
+        best, best_score = i, score
+
+    if best is None:
+      break
+    selected.append(best)
+    remaining.remove(best)
+    remaining = [i for i in remaining if _similarity(matches[i], matches[best]) <= duplicate_threshold]
+
+  return [matches[i] for i in selected]
+
+def _pack(matches: List[dict], token_budget: int) -> List[dict]:
+  packed = []
+  used = 0
+  for match in matches:
+    tokens = estimate_tokens(match["contextual_text"])
+    if packed and used + tokens > token_budget:
+      continue
+    packed.append(match)
+    used += tokens
+  return packed
+
+def _merge_adjacent(matches: List[dict]) -> List[str]:
+  # chunks that sit next to each other in the same file read better as one block, in file order
+  rank = {id(match): i for i, match in enumerate(matches)}
+  blocks = []
+  for match in sorted(matches, key=lambda m: (m["filepath"], m["chunk_id"])):
+    last = blocks[-1] if blocks else None
+    if last and last["filepath"] == match["filepath"] and last["chunk_id"] + 1 == match["chunk_id"]:
+      last["texts"].append(match["contextual_text"])
+      last["chunk_id"] = match["chunk_id"]
+      last["rank"] = min(last["rank"], rank[id(match)])
+    else:
+      blocks.append({
+        "filepath": match["filepath"],
+        "chunk_id": match["chunk_id"],
+        "texts": [match["contextual_text"]],
+        "rank": rank[id(match)]
+      })
+
+  return ["\n\n".join(block["texts"]) for block in sorted(blocks, key=lambda block: block["rank"])]
+
+def build_context(
+    matches: List[dict],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+    duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD,
+    similarity_gap: float = CONTEXT_SIMILARITY_GAP
+) -> Optional[str]:
+  matches = [match for match in matches if match.get("contextual_text")]
+  if not matches:
+    return None
+
+  # hybrid matches come ranked by their fused score, where similarity gaps say little
+  if all(match.get("score") is not None for match in matches):
+    top_score = max(match["score"] for match in matches) or 1
+    matches = [{**match, "relevance": match["score"] / top_score} for match in matches]
+    matches = sorted(matches, key=lambda match: match["relevance"], reverse=True)
+  else:
+    matches = [{**match, "relevance": match["similarity"]} for match in matches]
+    matches = sorted(matches, key=lambda match: match["relevance"], reverse=True)
+    matches = _cut_at_gap(matches, similarity_gap)
+
+  if all(match.get("similarities") is not None for match in matches):
+    matches = _select_mmr(matches, mmr_lambda, duplicate_threshold)
+
+  matches = _pack(matches, token_budget)
+  return "\n\n".join(_merge_adjacent(matches))
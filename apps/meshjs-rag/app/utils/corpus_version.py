@@ -0,0 +1,28 @@
+import os
+import time
+from typing import Optional
+from supabase import AsyncClient
+
+CORPUS_VERSION_TTL = float(os.getenv("CORPUS_VERSION_TTL") or 30)
+
+_cached_version: Optional[int] = None
+_fetched_at = 0.0
+
+async def get_corpus_version(supabase: AsyncClient) -> Optional[int]:
+  global _cached_version, _fetched_at
+
+  if _cached_version is not None and time.monotonic() - _fetched_at < CORPUS_VERSION_TTL:
+    return _cached_version
+
+  try:
+    response = await supabase.table("corpus_meta") \
+                            .select("version") \
+                            .eq("id", 1) \
+                            .execute()
+  except Exception as e:
+    print(f"Failed to fetch the corpus version: {e}")
+    return None
+
+  _cached_version = response.data[0]["version"] if response.data else None
+  _fetched_at = time.monotonic()
+  return _cached_version
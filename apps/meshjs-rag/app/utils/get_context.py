@@ -1,18 +1,51 @@
-from typing import List
+import os
+from typing import List, Optional
 from supabase import AsyncClient
 
+from app.services.metrics import span
+from app.services.vector_index import local_vector_index
+from app.utils.build_context import build_context, CONTEXT_CANDIDATES
 
+RETRIEVAL_MODE = (os.getenv("RETRIEVAL_MODE") or "vector").lower()
+HYBRID_FULL_TEXT_WEIGHT = float(os.getenv("HYBRID_FULL_TEXT_WEIGHT") or 1)
+HYBRID_SEMANTIC_WEIGHT = float(os.getenv("HYBRID_SEMANTIC_WEIGHT") or 1)
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K") or 50)
 
-async def get_context(embedded_query: List[float], supabase: AsyncClient) -> str:
-  response = await supabase.rpc("match_docs", {
-    "query_embedding": embedded_query,
-    "match_threshold": 0.2,
-    "match_count": 5
-  }).execute()
 
-  contextual_text = "\n\n".join([data["contextual_text"] for data in response.data]) if response.data else None
+async def get_context(embedded_query: List[float], supabase: AsyncClient, query_text: Optional[str] = None) -> str:
+  # the local replica answers without a round-trip; it returns None until a snapshot exists
+  local_matches = None
+  if RETRIEVAL_MODE == "local":
+    with span("local_search"):
+      local_matches = await local_vector_index.search(supabase, embedded_query, CONTEXT_CANDIDATES, 0.2)
+
+  if local_matches is not None:
+    response_data = local_matches
+  elif RETRIEVAL_MODE == "hybrid" and query_text:
+    with span("hybrid_match_docs"):
+      response = await supabase.rpc("hybrid_match_docs", {
+        "query_text": query_text,
+        "query_embedding": embedded_query,
+        "match_count": CONTEXT_CANDIDATES,
+        "full_text_weight": HYBRID_FULL_TEXT_WEIGHT,
+        "semantic_weight": HYBRID_SEMANTIC_WEIGHT,
+        "rrf_k": HYBRID_RRF_K
+      }).execute()
+    response_data = response.data
+  else:
+    with span("match_docs"):
+      response = await supabase.rpc("match_docs", {
+        "query_embedding": embedded_query,
+        "match_threshold": 0.2,
+        "match_count": CONTEXT_CANDIDATES
+      }).execute()
+    response_data = response.data
+
+  # over-fetched candidates are de-duplicated, merged and packed to the token budget
+  with span("build_context"):
+    contextual_text = build_context(response_data) if response_data else None
 
   if contextual_text:
     return contextual_text
   else:
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+import pathlib
+from typing import AsyncIterable, Awaitable, Callable, Iterable, List, Optional, Tuple, Union
+from supabase import AsyncClient
+
+from app.utils.get_file_content import get_file_content
+from app.utils.checksum import calculate_checksum
+from app.utils.ingest_manifest import load_manifest, record_ingested_file, delete_missing_files
+from app.utils.process_chunks import FileUpdate, contextualize_update, embed_update, write_update
+
+# files contextualized at once, the stage that waits on situate_context the longest
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY") or 8)
+INGEST_PREPARE_CONCURRENCY = int(os.getenv("INGEST_PREPARE_CONCURRENCY") or 4)
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY") or 8)
+INGEST_WRITE_CONCURRENCY = int(os.getenv("INGEST_WRITE_CONCURRENCY") or 4)
+# files waiting between two stages; a full queue holds back the stage before it, down to the downloads
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE") or 16)
+
+FileEntry = Tuple[Union[str, pathlib.Path], str]
+
+async def _iterate(files: Union[Iterable[FileEntry], AsyncIterable[FileEntry]]):
+  if hasattr(files, "__aiter__"):
+    async for entry in files:
+      yield entry
+  else:
+    for entry in files:
+      yield entry
+
+async def _run_stage(inbox: asyncio.Queue, outbox: Optional[asyncio.Queue], workers: int, handle: Callable):
+  async def worker():
+    while True:
+      item = await inbox.get()
+      if item is None:
+        # leave the end marker for the other workers of the stage
+        await inbox.put(None)
+        return
+      result = await handle(item)
+      if result is not None and outbox is not None:
+        await outbox.put(result)
+
+  await asyncio.gather(*(worker() for _ in range(max(workers, 1))))
+  if outbox is not None:
+    await outbox.put(None)
+
+# files go through prepare (read, skip unchanged, diff against the db), contextualize, embed and
+# write as separate stages joined by bounded queues, so a file is embedded and written while later
+# ones are still contextualized or downloaded. files can be a list or an async iterable that yields
+# them as they arrive
+async def ingest_files(
+    files: Union[Iterable[FileEntry], AsyncIterable[FileEntry]],
+    plan_file: Callable[[str, str, AsyncClient], Awaitable[Optional[FileUpdate]]],
+    supabase: AsyncClient,
+    source: str,
+    concurrency: int = INGEST_CONCURRENCY,
+    on_progress: Optional[Callable[[dict], Awaitable[None]]] = None
+) -> dict:
+  discovered: List[str] = []
+  failed = []
+  skipped = []
+  processed = 0
+  listing_error: Optional[BaseException] = None
+  start = time.perf_counter()
+
+  async def report_progress():
+    elapsed = time.perf_counter() - start
+    await on_progress({
+      "files": len(discovered),
+      "processed": processed,
+      "unchanged": len(skipped),
+      "failed": failed,
+      "files_per_second": round(processed / elapsed, 2) if elapsed else 0.0
+    })
+
+  async def finish(relative_path: str, error: Optional[str] = None):
+    nonlocal processed
+    if error is not None:
+      failed.append({"filepath": relative_path, "error": error})
+    processed += 1
+    if on_progress:
+      await report_progress()
+
+  # one query up front instead of a per-file lookup for files that did not change
+  manifest = await load_manifest(supabase, source)
+
+  to_prepare = asyncio.Queue(maxsize=max(INGEST_QUEUE_SIZE, 1))
+  to_contextualize = asyncio.Queue(maxsize=max(INGEST_QUEUE_SIZE, 1))
+  to_embed = asyncio.Queue(maxsize=max(INGEST_QUEUE_SIZE, 1))
+  to_write = asyncio.Queue(maxsize=max(INGEST_QUEUE_SIZE, 1))
+
+  async def feed():
+    nonlocal listing_error
+    try:
+      async for abs_path, relative_path in _iterate(files):
+        discovered.append(relative_path)
+        await to_prepare.put((abs_path, relative_path))
+    except Exception as e:
+      print(f"Listing the files of '{source}' failed after {len(discovered)} files: {e}")
+      listing_error = e
+    finally:
+      await to_prepare.put(None)
+
+  async def prepare(item):
+    abs_path, relative_path = item
+    try:
+      file_content = await asyncio.to_thread(get_file_content, abs_path)
+      checksum = calculate_checksum(file_content)
+      if manifest.get(relative_path) == checksum:
+        skipped.append(relative_path)
+        await finish(relative_path)
+        return None
+
+      update = await plan_file(file_content, relative_path, supabase)
+      if update is None:
+        await finish(relative_path, "Not every chunk of the file was written")
+        return None
+      return checksum, update
+    except (FileNotFoundError, IOError) as e:
+      print(f"Skipping the file '{relative_path}' due to an error: {e}")
+      await finish(relative_path, str(e))
+    except Exception as e:
+      print(f"An error occured during the ingestion of '{relative_path}': {e}")
+      await finish(relative_path, str(e))
+    return None
+
+  def stage(step: Callable[[FileUpdate], Awaitable[None]]):
+    async def handle(item):
+      _, update = item
+      try:
+        await step(update)
+        return item
+      except Exception as e:
+        print(f"An error occured during the ingestion of '{update.relative_path}': {e}")
+        await finish(update.relative_path, str(e))
+        return None
+    return handle
+
+  async def write(item):
+    checksum, update = item
+    try:
+      if await write_update(update, supabase):
+        await record_ingested_file(supabase, source, update.relative_path, checksum)
+        await finish(update.relative_path)
+      else:
+        await finish(update.relative_path, "Not every chunk of the file was written")
+    except Exception as e:
+      print(f"An error occured during the ingestion of '{update.relative_path}': {e}")
+      await finish(update.relative_path, str(e))
+
+  await asyncio.gather(
+    feed(),
+    _run_stage(to_prepare, to_contextualize, INGEST_PREPARE_CONCURRENCY, prepare),
+    _run_stage(to_contextualize, to_embed, concurrency, stage(contextualize_update)),
+    _run_stage(to_embed, to_write, INGEST_EMBED_CONCURRENCY, stage(embed_update)),
+    _run_stage(to_write, None, INGEST_WRITE_CONCURRENCY, write)
+  )
+
+  # a listing that broke off is not the whole tree, and an empty one most likely means the
+  # download failed; never wipe the source because of either
+  if listing_error is not None:
+    raise listing_error
+  deleted = await delete_missing_files(supabase, source, discovered) if discovered else 0
+
+  elapsed = time.perf_counter() - start
+  summary = {
+    "files": len(discovered),
+    "succeeded": len(discovered) - len(failed),
+    "unchanged": len(skipped),
+    "deleted_chunks": deleted,
+    "failed": failed,
+    "seconds": round(elapsed, 2),
+    "files_per_second": round(len(discovered) / elapsed, 2) if elapsed else 0.0
+  }
+  print(f"Ingested {summary['succeeded']}/{summary['files']} files in {summary['seconds']}s ({summary['files_per_second']} files/s, {len(skipped)} unchanged, {len(failed)} failed)")
+  return summary
@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+from typing import Dict, List
+from supabase import AsyncClient
+
+MANIFEST_PAGE_SIZE = 1000
+
+async def load_manifest(supabase: AsyncClient, source: str) -> Dict[str, str]:
+  manifest = {}
+  start = 0
+  try:
+    # paged, postgrest caps a single response at 1000 rows
+    while True:
+      response = await supabase.table("ingest_manifest") \
+                              .select("filepath", "checksum") \
+                              .eq("source", source) \
+                              .order("filepath") \
+                              .range(start, start + MANIFEST_PAGE_SIZE - 1) \
+                              .execute()
+      for record in response.data or []:
+        manifest[record["filepath"]] = record["checksum"]
+      if len(response.data or []) < MANIFEST_PAGE_SIZE:
+        return manifest
+      start += MANIFEST_PAGE_SIZE
+  except Exception as e:
+    print(f"Failed to load the ingest manifest for '{source}', every file will be processed: {e}")
+    return {}
+
+async def record_ingested_file(supabase: AsyncClient, source: str, relative_path: str, checksum: str):
+  try:
+    await supabase.table("ingest_manifest").upsert({
+      "source": source,
+      "filepath": relative_path,
+      "checksum": checksum,
+      "last_ingested": datetime.now(timezone.utc).isoformat()
+    }).execute()
+  except Exception as e:
+    print(f"Failed to record '{relative_path}' in the ingest manifest: {e}")
+
+async def delete_missing_files(supabase: AsyncClient, source: str, current_filepaths: List[str]) -> int:
+  try:
+    response = await supabase.rpc("delete_missing_docs", {
+      "target_source": source,
+      "current_filepaths": current_filepaths
+    }).execute()
+  except Exception as e:
+    print(f"Failed to delete the files missing from '{source}': {e}")
+    return 0
+
+  return response.data or 0
@@ -0,0 +1,104 @@
+import os
+import pathlib
+import functools
+from typing import AsyncIterable, Awaitable, Callable, List, Optional, Tuple, Union
+from supabase import AsyncClient
+
+from app.services.github import GithubService
+from app.utils.batch_ingest import prewarm_chunk_cache
+from app.utils.get_file_paths import get_packages_file_paths
+from app.utils.ingest_files import ingest_files
+from app.utils.process_chunks import FileUpdate
+from app.utils.process_docs_file_and_update_db import chunk_docs_file, plan_docs_file_update
+from app.utils.process_package_docs_and_update_db import chunk_package_file, plan_package_file_update
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[2]
+# where the docs downloaded from github (and their manifests) are kept, next to the app by default
+INGEST_DOWNLOAD_DIR = pathlib.Path(os.getenv("INGEST_DOWNLOAD_DIR") or ROOT_DIR)
+
+FileEntries = Union[List[Tuple[Union[str, pathlib.Path], str]], AsyncIterable[Tuple[pathlib.Path, str]]]
+
+async def _ingest(
+    files: FileEntries,
+    plan_file: Callable[[str, str, AsyncClient], Awaitable[Optional[FileUpdate]]],
+    chunk_file: Callable[[str, str], List[str]],
+    supabase: AsyncClient,
+    source: str,
+    on_progress: Optional[Callable[[dict], Awaitable[None]]],
+    batch: bool
+) -> dict:
+  if batch:
+    # the batches are built from every file, so the download has to finish first
+    if not isinstance(files, list):
+      files = [entry async for entry in files]
+    await prewarm_chunk_cache(files, chunk_file, supabase, source, on_progress)
+
+  return await ingest_files(files, plan_file, supabase, source=source, on_progress=on_progress)
+
+# the .mdx pages of a repo, yielded as they are downloaded so ingestion starts with the first one
+async def _stream_docs(github: GithubService, docs_dir: pathlib.Path):
+  async for relative_path in github.stream_docs():
+    if relative_path.endswith(".mdx"):
+      yield docs_dir / relative_path, relative_path
+
+async def ingest_mesh_docs(
+    supabase: AsyncClient,
+    on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+    batch: bool = False
+) -> dict:
+  github = GithubService(owner="MeshJS", repo="mimir", doc_path="apps/docs/content/docs", output_path=str(INGEST_DOWNLOAD_DIR / "docs"))
+
+  return await _ingest(
+    _stream_docs(github, INGEST_DOWNLOAD_DIR / "docs"),
+    plan_docs_file_update,
+    chunk_docs_file,
+    supabase,
+    "docs",
+    on_progress,
+    batch
+  )
+
+async def ingest_package_docs(
+    supabase: AsyncClient,
+    on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+    batch: bool = False
+) -> dict:
+  packages_docs_md_path = ROOT_DIR.parents[2] / "mesh/docs/markdown"
+  files_path = get_packages_file_paths(packages_docs_md_path)
+
+  return await _ingest(
+    [(abs_path, str(pathlib.Path(abs_path).relative_to(packages_docs_md_path))) for abs_path in files_path],
+    plan_package_file_update,
+    chunk_package_file,
+    supabase,
+    "packages",
+    on_progress,
+    batch
+  )
+
+async def ingest_aiken_docs(
+    supabase: AsyncClient,
+    on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+    batch: bool = False
+) -> dict:
+  github = GithubService(owner="aiken-lang", repo="site", doc_path="src/pages", output_path=str(INGEST_DOWNLOAD_DIR / "aiken-docs"))
+
+  return await _ingest(
+    _stream_docs(github, INGEST_DOWNLOAD_DIR / "aiken-docs"),
+    plan_docs_file_update,
+    chunk_docs_file,
+    supabase,
+    "aiken-docs",
+    on_progress,
+    batch
+  )
+
+INGEST_SOURCES = {
+  "docs": ingest_mesh_docs,
+  "packages": ingest_package_docs,
+  "aiken-docs": ingest_aiken_docs
+}
+
+def get_ingest_runner(source: str, mode: str = "interactive"):
+  runner = INGEST_SOURCES[source]
+  return functools.partial(runner, batch=True) if mode == "batch" else runner
@@ -1,28 +1,68 @@
 from app.utils.checksum import calculate_checksum
-from app.utils.safe_db_operation import safe_db_operation
-from app.services.openai import OpenAIService 
+from app.services.openai import OpenAIService, EMBEDDING_CACHE_MODEL
+from app.services.chunk_cache import chunk_cache
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.metrics import span, observe
+from app.services.rate_limiter import openai_rate_limiter, openai_embedding_rate_limiter
 from app.utils.reorder_chunks import reorder_chunks
 from supabase import AsyncClient
-from typing import List
+from typing import List, Optional
 from tenacity import RetryError
 import openai
 import asyncio
+import time
 import os
 
 openai_api_key = os.getenv("OPENAI_KEY") or None
 if openai_api_key is None:
   raise ValueError("OpenAI api key is missing")
 
-openai_service = OpenAIService(openai_api_key=openai_api_key)
+openai_service = OpenAIService(
+  openai_api_key=openai_api_key,
+  rate_limiter=openai_rate_limiter,
+  embedding_rate_limiter=openai_embedding_rate_limiter
+)
+# files ingested concurrently share embedding requests
+embedding_batcher = EmbeddingBatcher(openai_service)
 
-async def process_chunks_and_update_db(
+def join_context(context: str, chunk: str) -> str:
+  return "---\n".join([context, chunk])
+
+async def contextualize_chunk(file_content: str, chunk_title: str, chunk: str, cache_key, operation: dict):
+  try:
+    response = await openai_service.situate_context(file_content, chunk, cache_key=cache_key)
+  except (openai.APIError, openai.AuthenticationError, openai.RateLimitError, RetryError) as e:
+    print(f"Skipping chunk {chunk_title} due to OpenAI 'situation_context' API error: {e}")
+    return None
+
+  return join_context(response, chunk), operation
+
+# one file on its way through the ingest stages: planned, contextualized, embedded, written
+class FileUpdate:
+  def __init__(self, relative_path: str, file_content: str, cache_key):
+    self.relative_path = relative_path
+    self.file_content = file_content
+    self.cache_key = cache_key
+    self.chunks_to_embed: List[str] = []
+    self.db_operations: List[dict] = []
+    self.cached_embeddings: List[Optional[List[float]]] = []
+    self.uncontextualized: List[dict] = []
+    self.moved_chunks: List[dict] = []
+    self.delete_ids: List[int] = []
+    self.embeddings: Optional[List[Optional[List[float]]]] = None
+    self.needs_reorder = False
+    self.complete = True
+    self.started = time.perf_counter()
+
+async def plan_chunks_update(
     chunks: List[str],
     file_content: str,
     relative_path: str,
     supabase: AsyncClient,
     cache_key,
     title_extractor
-):
+) -> Optional[FileUpdate]:
+  update = FileUpdate(relative_path, file_content, cache_key)
   current_chunk_data = {}
 
   # current chunks
@@ -52,13 +92,10 @@ async def process_chunks_and_update_db(
     }
   except Exception as e:
     print(f"Failed to fetch existing records for {relative_path}: {e}")
-    return
+    return None
 
   # compare
-  chunks_to_embed = []
-  db_operations = []
-  needs_reorder = False
-
+  pending_operations = []
   all_keys = set(current_chunk_data.keys()) | set(existing_records.keys())
 
   for key in all_keys:
@@ -69,115 +106,186 @@ async def process_chunks_and_update_db(
     if current and existing:
       if current["checksum"] != existing["checksum"]:
         print(f"Updating chunk: {chunk_title}")
-        try:
-          response = await openai_service.situate_context(file_content, current["chunk"], cache_key=cache_key)
-          await asyncio.sleep(1)
-          contextual_chunk = "---\n".join([response, current["chunk"]])
-          chunks_to_embed.append(contextual_chunk)
-
-          db_operations.append({
-              "filepath": relative_path,
-              "chunk_id": current["chunk_id"],
-              "chunk_title": chunk_title,
-              "checksum": current["checksum"],
-              "content": current["chunk"],
-              "record_id": existing["id"],
-              "is_update": True
-          })
-        except (openai.APIError, openai.AuthenticationError, openai.RateLimitError, RetryError) as e:
-          print(f"Skipping chunk {chunk_title} due to OpenAI 'situation_context' API error: {e}")
-          continue
+        pending_operations.append({
+            "filepath": relative_path,
+            "chunk_id": current["chunk_id"],
+            "chunk_title": chunk_title,
+            "checksum": current["checksum"],
+            "content": current["chunk"],
+            "record_id": existing["id"],
+            "is_update": True
+        })
 
       elif current["chunk_id"] != existing.get("chunk_id"):
         print(f"Updating chunk order for {chunk_title}")
-        updated_title = chunk_title.split("_")[0] + f"_{current['chunk_id']}" if "_" in chunk_title else chunk_title
-        await safe_db_operation(
-          supabase.table("docs").update({"chunk_id": current["chunk_id"], "chunk_title": updated_title}).eq("id", existing["id"]).execute()
-        )
-        # reorder after update
-        needs_reorder = True
+        # applied together with the reorder below in a single rpc
+        update.moved_chunks.append({"id": existing["id"], "chunk_id": current["chunk_id"]})
+        update.needs_reorder = True
 
       else:
         print(f"Skipping the unchanged chunk: {chunk_title}")
 
     elif current and not existing:
       print(f"New chunk {chunk_title}")
-      try:
-        response = await openai_service.situate_context(file_content, current["chunk"], cache_key=cache_key)
-        await asyncio.sleep(1)
-        contextual_chunk = "---\n".join([response, current["chunk"]])
-        chunks_to_embed.append(contextual_chunk)
-        db_operations.append({
-            "filepath": relative_path,
-            "chunk_id": current["chunk_id"],
-            "chunk_title": chunk_title,
-            "checksum": current["checksum"],
-            "content": current["chunk"],
-            "is_update": False
-        })
-        # reorder after new chunk
-        needs_reorder = True
-      except (openai.APIError, openai.AuthenticationError, openai.RateLimitError, RetryError) as e:
-          print(f"Skipping chunk {chunk_title} due to OpenAI 'situation_context' API error: {e}")
-          continue
+      pending_operations.append({
+          "filepath": relative_path,
+          "chunk_id": current["chunk_id"],
+          "chunk_title": chunk_title,
+          "checksum": current["checksum"],
+          "content": current["chunk"],
+          "is_update": False
+      })
 
     elif not current and existing:
       print(f"Deleting chunk: {chunk_title}")
-      await safe_db_operation(
-        supabase.table("docs").delete().eq("id", existing["id"]).execute()
-      )
+      # deleted by upsert_docs together with the rest of the file's writes
+      update.delete_ids.append(existing["id"])
 
       # reorder after deletion
-      needs_reorder = True
+      update.needs_reorder = True
+
+  # reorder after new chunks
+  if any(not operation["is_update"] for operation in pending_operations):
+    update.needs_reorder = True
+
+  # the same chunk of the same document was contextualized before, e.g. after a revert or on another database
+  cached = await chunk_cache.get_many(
+    cache_key,
+    [operation["checksum"] for operation in pending_operations],
+    EMBEDDING_CACHE_MODEL
+  )
+  if cached:
+    print(f"Reusing {len(cached)}/{len(pending_operations)} cached chunk contexts for {relative_path}")
+
+  for operation in pending_operations:
+    hit = cached.get(operation["checksum"])
+    if hit:
+      contextual_chunk, embedding = hit
+      update.chunks_to_embed.append(contextual_chunk)
+      update.db_operations.append(operation)
+      update.cached_embeddings.append(embedding)
+    else:
+      update.uncontextualized.append(operation)
+
+  return update
+
+async def contextualize_update(update: FileUpdate):
+  if not update.uncontextualized:
+    return
+
+  # all chunks of the file are contextualized concurrently, paced by the shared rate limiter
+  contexts = {}
+  with span("ingest_contextualize"):
+    results = await asyncio.gather(*(
+      contextualize_chunk(update.file_content, operation["chunk_title"], operation["content"], update.cache_key, operation)
+      for operation in update.uncontextualized
+    ))
+  for result in results:
+    if result is None:
+      update.complete = False
+      continue
+    contextual_chunk, operation = result
+    update.chunks_to_embed.append(contextual_chunk)
+    update.db_operations.append(operation)
+    update.cached_embeddings.append(None)
+    contexts[operation["checksum"]] = contextual_chunk
+  update.uncontextualized = []
+  await chunk_cache.set_contexts(update.cache_key, contexts)
+
+async def embed_update(update: FileUpdate):
+  if not update.chunks_to_embed:
+    return
 
+  embeddings = list(update.cached_embeddings)
+  missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
 
-  if chunks_to_embed:
+  if missing:
     try:
-      embeddings = await openai_service.get_batch_embeddings(chunks_to_embed)
+      with span("ingest_embed"):
+        fresh = await embedding_batcher.embed([update.chunks_to_embed[i] for i in missing])
     except (openai.APIError, openai.AuthenticationError, openai.RateLimitError, RetryError) as e:
       print(f"Skipping all DB operations for this file due to failed embedding batch: {e}")
+      update.complete = False
       return
 
-    db_tasks = []
-    for i, embedding in enumerate(embeddings):
-      if not embedding:
-        title = db_operations[i]["chunk_title"]
-        print(f"Skipping DB operation for chunk '{title}' due to failed embedding")
-        continue
-
-      operation_data = db_operations[i]
-
-      if operation_data["is_update"]:
-        db_tasks.append(
-          safe_db_operation(
-            supabase.table("docs").update({
-              "content": operation_data["content"],
-              "contextual_text": chunks_to_embed[i],
-              "embedding": embedding,
-              "filepath": operation_data["filepath"],
-              "chunk_id": operation_data["chunk_id"],
-              "chunk_title": operation_data["chunk_title"],
-              "checksum": operation_data["checksum"]
-            }).eq("id", operation_data["record_id"]).execute()
-          )
-        )
-      else:
-        db_tasks.append(
-          safe_db_operation(
-            supabase.table("docs").insert({
-              "content": operation_data["content"],
-              "contextual_text": chunks_to_embed[i],
-              "embedding": embedding,
-              "filepath": operation_data["filepath"],
-              "chunk_id": operation_data["chunk_id"],
-              "chunk_title": operation_data["chunk_title"],
-              "checksum": operation_data["checksum"]
-            }).execute()
-          )
-        )
-
-    await asyncio.gather(*db_tasks)
-    
-  if needs_reorder:
-    await reorder_chunks(supabase, relative_path)
+    for i, embedding in zip(missing, fresh):
+      embeddings[i] = embedding
+
+    await chunk_cache.set_embeddings(
+      update.cache_key,
+      {update.db_operations[i]["checksum"]: embeddings[i] for i in missing if embeddings[i]},
+      EMBEDDING_CACHE_MODEL
+    )
+
+  update.embeddings = embeddings
+
+async def _write_chunks(update: FileUpdate, supabase: AsyncClient, delete_ids: List[int]) -> bool:
+  rows = []
+  for i, embedding in enumerate(update.embeddings or []):
+    if not embedding:
+      title = update.db_operations[i]["chunk_title"]
+      print(f"Skipping DB operation for chunk '{title}' due to failed embedding")
+      continue
+
+    operation_data = update.db_operations[i]
+    rows.append({
+      "record_id": operation_data.get("record_id") if operation_data["is_update"] else None,
+      "content": operation_data["content"],
+      "contextual_text": update.chunks_to_embed[i],
+      "embedding": embedding,
+      "filepath": operation_data["filepath"],
+      "chunk_id": operation_data["chunk_id"],
+      "chunk_title": operation_data["chunk_title"],
+      "checksum": operation_data["checksum"]
+    })
+
+  # one transactional round-trip for every changed and deleted chunk of the file
+  try:
+    with span("ingest_write"):
+      response = await supabase.rpc("upsert_docs", {"payload": rows, "delete_ids": delete_ids}).execute()
+  except Exception as e:
+    print(f"Failed to write the chunks of {update.relative_path}, nothing was committed: {e}")
+    return False
 
+  results = response.data or []
+  written = {result["chunk_title"] for result in results if result["action"] != "deleted"}
+  for row in rows:
+    if row["chunk_title"] not in written:
+      print(f"Chunk '{row['chunk_title']}' of {update.relative_path} was not written")
+  deleted = sum(1 for result in results if result["action"] == "deleted")
+  print(f"Wrote {len(written)}/{len(rows)} chunks and deleted {deleted} for {update.relative_path}")
+  return len(rows) == len(update.chunks_to_embed) and all(row["chunk_title"] in written for row in rows)
+
+async def write_update(update: FileUpdate, supabase: AsyncClient) -> bool:
+  # chunks that left the file are only deleted once every chunk replacing them could be written
+  delete_ids = update.delete_ids if update.complete else []
+  if update.embeddings is not None or delete_ids:
+    update.complete = await _write_chunks(update, supabase, delete_ids) and update.complete
+
+  if update.needs_reorder:
+    # a failed reorder leaves moved chunks at their old positions, so the file must not be recorded as ingested
+    reordered = await reorder_chunks(supabase, update.relative_path, update.moved_chunks)
+    update.complete = update.complete and bool(reordered)
+
+  observe("ingest_file", time.perf_counter() - update.started)
+  return update.complete
+
+# every stage back to back, for a single file; ingest_files runs them as a pipeline instead
+async def apply_file_update(update: Optional[FileUpdate], supabase: AsyncClient) -> bool:
+  if update is None:
+    return False
+
+  await contextualize_update(update)
+  await embed_update(update)
+  return await write_update(update, supabase)
+
+async def process_chunks_and_update_db(
+    chunks: List[str],
+    file_content: str,
+    relative_path: str,
+    supabase: AsyncClient,
+    cache_key,
+    title_extractor
+) -> bool:
+  update = await plan_chunks_update(chunks, file_content, relative_path, supabase, cache_key, title_extractor)
+  return await apply_file_update(update, supabase)
@@ -1,21 +1,33 @@
 from supabase.client import AsyncClient
+from typing import List, Optional
 from app.utils.chunk_content import chunk_content_by_h2
 from app.utils.checksum import calculate_checksum
-from app.utils.process_chunks import process_chunks_and_update_db
+from app.utils.process_chunks import FileUpdate, apply_file_update, plan_chunks_update
 from app.utils.extract_title import extract_chunk_title
 
-async def process_docs_file_and_update_db(
+def chunk_docs_file(file_content: str, relative_path: str) -> List[str]:
+    return chunk_content_by_h2(file_content)
+
+async def plan_docs_file_update(
         file_content: str,
         relative_path: str,
         supabase: AsyncClient
-):
-    chunks = chunk_content_by_h2(file_content)
+) -> Optional[FileUpdate]:
+    chunks = chunk_docs_file(file_content, relative_path)
     cache_key = calculate_checksum(file_content)
-    await process_chunks_and_update_db(
+    return await plan_chunks_update(
         chunks,
         file_content,
         relative_path,
         supabase,
         cache_key,
         title_extractor=lambda chunk, idx, chunks: extract_chunk_title(chunk)
-    )
\ No newline at end of file
+    )
+
+async def process_docs_file_and_update_db(
+        file_content: str,
+        relative_path: str,
+        supabase: AsyncClient
+) -> bool:
+    update = await plan_docs_file_update(file_content, relative_path, supabase)
+    return await apply_file_update(update, supabase)
@@ -2,30 +2,43 @@ from supabase.client import AsyncClient
 from app.utils.checksum import calculate_checksum
 from app.utils.chunk_content import chunk_class_file
 from app.utils.extract_title import extract_class_chunk_title, extract_chunk_title
-from app.utils.process_chunks import process_chunks_and_update_db
+from app.utils.process_chunks import FileUpdate, apply_file_update, plan_chunks_update
+from typing import List, Optional
 import pathlib
 
 
-async def process_package_docs_and_update_db(
+def is_class_file(relative_path: str) -> bool:
+    return any(part == "classes" for part in pathlib.Path(relative_path).parts)
+
+def chunk_package_file(file_content: str, relative_path: str) -> List[str]:
+    return chunk_class_file(file_content) if is_class_file(relative_path) else [file_content]
+
+async def plan_package_file_update(
         file_content: str,
         relative_path: str,
         supabase: AsyncClient
-):
-    class_type = any(part == "classes" for part in pathlib.Path(relative_path).parts)
+) -> Optional[FileUpdate]:
     cache_key = calculate_checksum(file_content)
+    chunks = chunk_package_file(file_content, relative_path)
 
-    if class_type:
-        chunks = chunk_class_file(file_content)
+    if is_class_file(relative_path):
         title_extractor = lambda chunk, idx, chunks: f"{extract_class_chunk_title(chunk, chunks)}"
     else:
-        chunks = [file_content]
         title_extractor = lambda chunk, idx, chunks: f"{extract_chunk_title(chunk)}_{idx}"
 
-    await process_chunks_and_update_db(
+    return await plan_chunks_update(
         chunks,
         file_content,
         relative_path,
         supabase, 
         cache_key,
         title_extractor
-    )
\ No newline at end of file
+    )
+
+async def process_package_docs_and_update_db(
+        file_content: str,
+        relative_path: str,
+        supabase: AsyncClient
+) -> bool:
+    update = await plan_package_file_update(file_content, relative_path, supabase)
+    return await apply_file_update(update, supabase)
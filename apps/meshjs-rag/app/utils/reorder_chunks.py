@@ -1,28 +1,18 @@
-from app.utils.safe_db_operation import safe_db_operation
-import asyncio
+from typing import List
 
 async def reorder_chunks(
         supabase,
-        relative_path
+        relative_path,
+        moved_chunks: List[dict] = None
 ):
-    response = await supabase.table("docs") \
-        .select("id", "chunk_id", "chunk_title") \
-        .eq("filepath", relative_path) \
-        .order("chunk_id") \
-        .execute()
-
-    if response and response.data:
-        reorder_chunks = []
-        for new_idx, chunk in enumerate(response.data):
-            if chunk["chunk_id"] != new_idx:
-                updated_title = chunk["chunk_title"].split("_")[0] + f"_{new_idx}" if "_" in chunk["chunk_title"] else chunk["chunk_title"]
-                reorder_chunks.append(
-                    safe_db_operation(
-                    supabase.table("docs") \
-                    .update({"chunk_id": new_idx, "chunk_title": updated_title}) \
-                    .eq("id", chunk["id"]) \
-                    .execute()
-                    )
-                )
-        
-        await asyncio.gather(*reorder_chunks)
\ No newline at end of file
+    # renumbers chunk_id (and the chunk_title suffix) of the whole file server-side in one rpc;
+    # returns True once it went through, None like safe_db_operation when it did not
+    try:
+        await supabase.rpc("reorder_docs", {
+            "target_filepath": relative_path,
+            "moved_chunks": moved_chunks or []
+        }).execute()
+    except Exception as e:
+        print(f"Failed to reorder the chunks of {relative_path}: {e}")
+        return None
+    return True
@@ -0,0 +1,63 @@
+import os
+import asyncio
+from typing import AsyncIterator
+
+SSE_PASSTHROUGH = (os.getenv("SSE_PASSTHROUGH") or "true").lower() in ("1", "true", "yes")
+SSE_COALESCE_WINDOW_MS = float(os.getenv("SSE_COALESCE_WINDOW_MS") or 0)
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES") or 4096)
+
+async def _next(iterator: AsyncIterator[bytes]) -> bytes:
+  return await iterator.__anext__()
+
+async def coalesce_frames(
+    chunks: AsyncIterator[bytes],
+    window_ms: float = SSE_COALESCE_WINDOW_MS,
+    max_bytes: int = SSE_COALESCE_BYTES
+) -> AsyncIterator[bytes]:
+  # holds bytes for up to window_ms (or until max_bytes) and writes them at once. the events themselves
+  # are untouched, clients only see them arrive in fewer writes. the first write is never held back
+  if window_ms <= 0:
+    async for chunk in chunks:
+      yield chunk
+    return
+
+  loop = asyncio.get_running_loop()
+  iterator = chunks.__aiter__()
+  buffer = bytearray()
+  deadline = None
+  first = True
+  pending = asyncio.create_task(_next(iterator))
+
+  try:
+    while True:
+      timeout = None if deadline is None else max(deadline - loop.time(), 0)
+      done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+      if not done:
+        # upstream is slow, don't sit on what we have
+        yield bytes(buffer)
+        buffer.clear()
+        deadline = None
+        continue
+
+      try:
+        chunk = pending.result()
+      except StopAsyncIteration:
+        break
+
+      buffer += chunk
+      if first or len(buffer) >= max_bytes:
+        first = False
+        yield bytes(buffer)
+        buffer.clear()
+        deadline = None
+      elif deadline is None:
+        deadline = loop.time() + window_ms / 1000
+
+      pending = asyncio.create_task(_next(iterator))
+
+    if buffer:
+      yield bytes(buffer)
+  finally:
+    if not pending.done():
+      pending.cancel()
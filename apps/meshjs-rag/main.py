@@ -1,10 +1,27 @@
 from dotenv import load_dotenv
 load_dotenv()
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from contextlib import asynccontextmanager
 from app.api.v1.api import api_router
+from app.db.client import init_db_client, close_db_client
+from app.services.openai_pool import openai_service_pool
+from app.services.embedding_cache import query_embedding_cache
+from app.services.answer_cache import mcp_answer_cache
+from app.services.single_flight import retrieval_flight, answer_flight, answer_streams
+from app.services.ingest_jobs import shutdown_jobs
+from app.services.metrics import ServerTimingMiddleware, render_metrics, METRICS_CONTENT_TYPE
 import uvicorn
 
-app = FastAPI(title="MeshAI Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  await init_db_client()
+  yield
+  await shutdown_jobs()
+  await openai_service_pool.aclose()
+  await close_db_client()
+
+app = FastAPI(title="MeshAI Backend", lifespan=lifespan)
+app.add_middleware(ServerTimingMiddleware)
 app.include_router(api_router, prefix="/api/v1", tags=["api"])
 
 @app.get("/")
@@ -16,9 +33,21 @@ async def root():
 @app.get("/health")
 async def get_health_status():
   return {
-    "status": "OK"
+    "status": "OK",
+    "openai_client_cache": openai_service_pool.stats(),
+    "query_embedding_cache": query_embedding_cache.stats(),
+    "mcp_answer_cache": mcp_answer_cache.stats(),
+    "single_flight": {
+      "retrieval": retrieval_flight.stats(),
+      "answers": answer_flight.stats(),
+      "answer_streams": answer_streams.stats()
+    }
   }
 
+@app.get("/metrics")
+async def get_metrics():
+  return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
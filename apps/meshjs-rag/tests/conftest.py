@@ -0,0 +1,8 @@
+import os
+
+# the app reads these at import; nothing here talks to a real supabase or openai
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("OPENAI_KEY", "sk-test")
+os.environ.setdefault("ADMIN_KEY", "admin")
+os.environ.setdefault("CHUNK_CACHE_PATH", "")
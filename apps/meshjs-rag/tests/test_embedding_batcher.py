@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+
+from app.services.embedding_batcher import EmbeddingBatcher
+
+class FakeService:
+  def __init__(self):
+    self.requests = []
+
+  async def get_batch_embeddings(self, texts):
+    self.requests.append(texts)
+    if "bad input" in texts:
+      raise ValueError("invalid input")
+    return [[float(len(text))] for text in texts]
+
+def test_a_failed_coalesced_request_only_fails_the_file_that_caused_it():
+  service = FakeService()
+  batcher = EmbeddingBatcher(service, delay=0.01)
+
+  async def embed_files():
+    return await asyncio.gather(
+      batcher.embed(["a", "bb"]),
+      batcher.embed(["bad input"]),
+      batcher.embed(["ccc"]),
+      return_exceptions=True
+    )
+
+  good, bad, other = asyncio.run(embed_files())
+
+  assert good == [[1.0], [2.0]]
+  assert other == [[3.0]]
+  assert isinstance(bad, ValueError)
+  # one coalesced request, then one per file
+  assert service.requests == [["a", "bb", "bad input", "ccc"], ["a", "bb"], ["bad input"], ["ccc"]]
+
+def test_a_single_file_is_not_sent_twice():
+  service = FakeService()
+  batcher = EmbeddingBatcher(service, delay=0.01)
+
+  with pytest.raises(ValueError):
+    asyncio.run(batcher.embed(["bad input"]))
+  assert service.requests == [["bad input"]]
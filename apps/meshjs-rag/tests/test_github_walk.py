@@ -0,0 +1,133 @@
+import asyncio
+import functools
+import httpx
+import pytest
+
+from app.services.github import GithubService
+from app.utils import ingest_files as ingest_module
+
+API = "https://api.github.test"
+
+def github_api(broken_dir: bool = False, broken_file: bool = False, tree: bool = False, version: int = 1):
+  listings = {
+    "/repos/o/r/contents/docs": [
+      {"name": "a.mdx", "path": "docs/a.mdx", "type": "file", "download_url": f"{API}/raw/a.mdx"},
+      {"name": "b.mdx", "path": "docs/b.mdx", "type": "file", "download_url": f"{API}/raw/b.mdx"},
+      {"name": "guides", "path": "docs/guides", "type": "dir"}
+    ],
+    "/repos/o/r/contents/docs/guides": [
+      {"name": "c.mdx", "path": "docs/guides/c.mdx", "type": "file", "download_url": f"{API}/raw/c.mdx"}
+    ]
+  }
+
+  # the same files through the git trees api, their shas change with version
+  tree_files = ["a.mdx", "b.mdx", "guides/c.mdx"]
+
+  def handle(request: httpx.Request):
+    path = request.url.path
+    if path.startswith("/repos/o/r/git/trees/"):
+      if not tree:
+        # no tree api, so the directories are walked
+        return httpx.Response(404)
+      return httpx.Response(200, json={"tree": [
+        {"path": f"docs/{name}", "type": "blob", "sha": f"{name}@{version}"} for name in tree_files
+      ]})
+    if path.startswith("/repos/o/r/git/blobs/"):
+      if broken_file and path.endswith("/b.mdx@" + str(version)):
+        return httpx.Response(502)
+      return httpx.Response(200, text=f"# {path}")
+    if path in listings:
+      if broken_dir and path.endswith("/guides"):
+        return httpx.Response(502)
+      return httpx.Response(200, json=listings[path])
+    if broken_file and path == "/raw/b.mdx":
+      return httpx.Response(500)
+    return httpx.Response(200, text=f"# {path}")
+
+  return httpx.MockTransport(handle)
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+  monkeypatch.setattr("app.services.github.GITHUB_API_URL", API)
+  return GithubService(owner="o", repo="r", doc_path="docs", output_path=str(tmp_path / "docs"))
+
+def stream(service, monkeypatch, **api):
+  monkeypatch.setattr(httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=github_api(**api)))
+
+  async def collect():
+    files = []
+    try:
+      async for path in service.stream_docs():
+        files.append(path)
+    except RuntimeError as e:
+      return sorted(files), e
+    return sorted(files), None
+
+  return asyncio.run(collect())
+
+def test_the_walk_hands_on_every_file(service, monkeypatch):
+  files, error = stream(service, monkeypatch)
+
+  assert files == ["a.mdx", "b.mdx", "guides/c.mdx"]
+  assert error is None
+
+def test_a_failed_download_hands_on_the_copy_already_on_disk(service, monkeypatch):
+  stream(service, monkeypatch)
+  files, error = stream(service, monkeypatch, broken_file=True)
+
+  assert files == ["a.mdx", "b.mdx", "guides/c.mdx"]
+  assert error is None
+
+def test_a_failed_download_without_a_copy_marks_the_listing_partial(service, monkeypatch):
+  files, error = stream(service, monkeypatch, broken_file=True)
+
+  assert files == ["a.mdx", "guides/c.mdx"]
+  assert error is not None
+
+def test_a_directory_that_cannot_be_listed_marks_the_listing_partial(service, monkeypatch):
+  files, error = stream(service, monkeypatch, broken_dir=True)
+
+  assert files == ["a.mdx", "b.mdx"]
+  assert error is not None
+
+def test_the_tree_sync_hands_on_every_file(service, monkeypatch):
+  files, error = stream(service, monkeypatch, tree=True)
+
+  assert files == ["a.mdx", "b.mdx", "guides/c.mdx"]
+  assert error is None
+
+def test_a_failed_blob_download_hands_on_the_copy_already_on_disk(service, monkeypatch):
+  stream(service, monkeypatch, tree=True)
+  files, error = stream(service, monkeypatch, tree=True, version=2, broken_file=True)
+
+  assert files == ["a.mdx", "b.mdx", "guides/c.mdx"]
+  assert error is None
+
+def test_a_failed_blob_download_without_a_copy_marks_the_listing_partial(service, monkeypatch):
+  files, error = stream(service, monkeypatch, tree=True, broken_file=True)
+
+  assert files == ["a.mdx", "guides/c.mdx"]
+  assert error is not None
+
+def test_a_partial_listing_keeps_the_chunks_of_files_it_missed(monkeypatch):
+  deleted = []
+
+  async def load_manifest(supabase, source):
+    return {"a.mdx": "unchanged"}
+
+  async def delete_missing_files(supabase, source, discovered):
+    deleted.append(discovered)
+    return 0
+
+  monkeypatch.setattr(ingest_module, "load_manifest", load_manifest)
+  monkeypatch.setattr(ingest_module, "delete_missing_files", delete_missing_files)
+  monkeypatch.setattr(ingest_module, "get_file_content", lambda path: "unchanged")
+  monkeypatch.setattr(ingest_module, "calculate_checksum", lambda content: content)
+
+  async def partial_listing():
+    yield "a.mdx", "a.mdx"
+    raise RuntimeError("Part of 'o/r/docs' could not be downloaded")
+
+  with pytest.raises(RuntimeError):
+    asyncio.run(ingest_module.ingest_files(partial_listing(), None, None, source="docs"))
+  assert deleted == []
@@ -0,0 +1,49 @@
+import asyncio
+
+from app.utils.ingest_manifest import load_manifest
+
+class FakeResponse:
+  def __init__(self, data):
+    self.data = data
+
+class FakeQuery:
+  def __init__(self, rows):
+    self.rows = rows
+    self.start = 0
+    self.end = None
+
+  def select(self, *columns):
+    return self
+
+  def eq(self, column, value):
+    self.rows = [row for row in self.rows if row[column] == value]
+    return self
+
+  def order(self, column):
+    self.rows = sorted(self.rows, key=lambda row: row[column])
+    return self
+
+  def range(self, start, end):
+    self.start, self.end = start, end
+    return self
+
+  async def execute(self):
+    end = len(self.rows) if self.end is None else self.end + 1
+    # like postgrest, never more than 1000 rows in one response
+    return FakeResponse(self.rows[self.start:min(end, self.start + 1000)])
+
+class FakeSupabase:
+  def __init__(self, rows):
+    self.rows = rows
+
+  def table(self, name):
+    return FakeQuery(self.rows)
+
+def test_the_whole_manifest_is_loaded_past_the_response_cap():
+  rows = [{"source": "packages", "filepath": f"file-{i:05}.md", "checksum": str(i)} for i in range(2500)]
+  rows.append({"source": "docs", "filepath": "other.mdx", "checksum": "x"})
+
+  manifest = asyncio.run(load_manifest(FakeSupabase(rows), "packages"))
+
+  assert len(manifest) == 2500
+  assert manifest["file-02499.md"] == "2499"
@@ -0,0 +1,65 @@
+import asyncio
+import httpx
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.api.v1 import ask_mesh_ai
+from app.db.client import get_db_client
+from app.services.answer_cache import mcp_answer_cache
+from app.services.embedding_cache import query_embedding_cache
+from app.services.openai import OpenAIService, EMBEDDING_CACHE_MODEL
+from app.services.openai_pool import openai_service_pool
+
+VALID_KEY = "sk-valid"
+QUESTION = "How do I mint a token?"
+MODEL = "gpt-4o-mini"
+
+@pytest.fixture
+def client(monkeypatch):
+  checked = []
+
+  async def check_key(self):
+    checked.append(self.client.api_key)
+    if self.client.api_key != VALID_KEY:
+      request = httpx.Request("GET", "https://api.openai.com/v1/models")
+      raise openai.AuthenticationError("Incorrect API key provided", response=httpx.Response(401, request=request), body=None)
+
+  async def corpus_version(supabase):
+    return 1
+
+  monkeypatch.setattr(OpenAIService, "check_key", check_key)
+  monkeypatch.setattr(ask_mesh_ai, "get_corpus_version", corpus_version)
+  main.app.dependency_overrides[get_db_client] = lambda: None
+
+  # the question was answered before, so both its embedding and its answer are cached
+  embedding = [1.0] + [0.0] * 7
+  asyncio.run(query_embedding_cache.set(QUESTION, EMBEDDING_CACHE_MODEL, embedding))
+  mcp_answer_cache.set(embedding, MODEL, 1, "cached answer")
+
+  with TestClient(main.app) as test_client:
+    test_client.checked = checked
+    yield test_client
+
+  main.app.dependency_overrides.clear()
+  openai_service_pool._verified.clear()
+
+def ask(client, key):
+  return client.post(
+    "/api/v1/ask-mesh-ai/mcp",
+    headers={"Authorization": f"Bearer {key}"},
+    json={"query": QUESTION, "model": MODEL}
+  )
+
+def test_unknown_key_is_rejected_on_a_cached_question(client):
+  response = ask(client, "garbage")
+
+  assert response.status_code == 401
+  assert client.checked == ["garbage"]
+
+def test_verified_key_gets_the_cached_answer(client):
+  assert ask(client, VALID_KEY).json() == "cached answer"
+  assert ask(client, VALID_KEY).json() == "cached answer"
+  # checked once, then remembered for OPENAI_KEY_VERIFIED_TTL
+  assert client.checked == [VALID_KEY]
@@ -0,0 +1,65 @@
+import asyncio
+
+from app.utils.process_chunks import FileUpdate, write_update
+
+class FakeResponse:
+  def __init__(self, data):
+    self.data = data
+
+class FakeRpc:
+  def __init__(self, error, data):
+    self.error = error
+    self.data = data
+
+  async def execute(self):
+    if self.error:
+      raise self.error
+    return FakeResponse(self.data)
+
+class FakeSupabase:
+  def __init__(self, error=None):
+    self.error = error
+    self.calls = []
+
+  def rpc(self, name, params):
+    self.calls.append((name, params))
+    data = [{"id": i, "chunk_title": f"a_{i}", "action": "deleted"} for i in params.get("delete_ids", [])]
+    return FakeRpc(self.error, data)
+
+def moved_update():
+  update = FileUpdate("guides/a.mdx", "", "cache-key")
+  update.moved_chunks = [{"id": 7, "chunk_id": 0}]
+  update.needs_reorder = True
+  return update
+
+def test_a_reordered_file_is_complete():
+  supabase = FakeSupabase()
+
+  assert asyncio.run(write_update(moved_update(), supabase)) is True
+  assert supabase.calls == [("reorder_docs", {"target_filepath": "guides/a.mdx", "moved_chunks": [{"id": 7, "chunk_id": 0}]})]
+
+def test_a_failed_reorder_leaves_the_file_incomplete():
+  supabase = FakeSupabase(RuntimeError("connection reset"))
+
+  # an incomplete file is not recorded in the ingest manifest, so the next run tries again
+  assert asyncio.run(write_update(moved_update(), supabase)) is False
+
+def shrunk_update():
+  update = FileUpdate("guides/a.mdx", "", "cache-key")
+  update.delete_ids = [3, 4]
+  update.needs_reorder = True
+  return update
+
+def test_removed_chunks_are_deleted_in_the_same_rpc_as_the_writes():
+  supabase = FakeSupabase()
+
+  assert asyncio.run(write_update(shrunk_update(), supabase)) is True
+  assert supabase.calls[0] == ("upsert_docs", {"payload": [], "delete_ids": [3, 4]})
+
+def test_removed_chunks_are_kept_when_their_replacements_could_not_be_embedded():
+  supabase = FakeSupabase()
+  update = shrunk_update()
+  update.complete = False
+
+  assert asyncio.run(write_update(update, supabase)) is False
+  assert [name for name, _ in supabase.calls] == ["reorder_docs"]
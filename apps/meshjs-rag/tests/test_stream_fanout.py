@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+
+from app.services.single_flight import StreamFanout
+
+class Upstream:
+  def __init__(self, frames, fail: bool = False):
+    self.frames = frames
+    self.fail = fail
+    self.release = asyncio.Event()
+    self.started = 0
+    self.closed = False
+
+  async def stream(self):
+    self.started += 1
+    try:
+      # held until the test has its subscribers in place
+      await self.release.wait()
+      if self.fail:
+        raise RuntimeError("upstream failed")
+      for frame in self.frames:
+        yield frame
+        await asyncio.sleep(0)
+    finally:
+      self.closed = True
+
+async def read(generator):
+  return [frame async for frame in generator]
+
+def test_subscribers_share_one_upstream():
+  async def scenario():
+    fanout = StreamFanout()
+    upstream = Upstream([b"a", b"b"])
+    first = asyncio.create_task(read(fanout.subscribe("q", upstream.stream)))
+    second = asyncio.create_task(read(fanout.subscribe("q", upstream.stream)))
+    await asyncio.sleep(0.01)
+    upstream.release.set()
+    return await first, await second, upstream.started, fanout.stats()
+
+  first, second, started, stats = asyncio.run(scenario())
+
+  assert first == second == [b"a", b"b"]
+  assert started == 1
+  assert stats == {"in_flight": 0, "streams": 1, "shared": 1}
+
+def test_a_joined_subscriber_starts_its_own_stream_when_the_shared_one_fails():
+  async def scenario():
+    fanout = StreamFanout()
+    failing = Upstream([], fail=True)
+    working = Upstream([b"answer"])
+    working.release.set()
+    owner = asyncio.create_task(read(fanout.subscribe("q", failing.stream)))
+    await asyncio.sleep(0.01)
+    joined = asyncio.create_task(read(fanout.subscribe("q", working.stream)))
+    await asyncio.sleep(0.01)
+    failing.release.set()
+    return await asyncio.gather(owner, joined, return_exceptions=True)
+
+  owner, joined = asyncio.run(scenario())
+
+  assert isinstance(owner, RuntimeError)
+  assert joined == [b"answer"]
+
+def test_the_upstream_keeps_running_until_the_last_subscriber_leaves():
+  async def scenario():
+    fanout = StreamFanout()
+    upstream = Upstream([b"a"])
+    first = asyncio.create_task(read(fanout.subscribe("q", upstream.stream)))
+    second = asyncio.create_task(read(fanout.subscribe("q", upstream.stream)))
+    await asyncio.sleep(0.01)
+
+    first.cancel()
+    await asyncio.sleep(0.01)
+    still_running = not upstream.closed and fanout.stats()["in_flight"] == 1
+
+    second.cancel()
+    await asyncio.sleep(0.01)
+    with pytest.raises(asyncio.CancelledError):
+      await second
+    return still_running, upstream.closed, fanout.stats()["in_flight"]
+
+  still_running, closed, in_flight = asyncio.run(scenario())
+
+  assert still_running
+  assert closed
+  assert in_flight == 0
+
+def test_a_new_subscriber_after_the_last_one_left_starts_a_new_stream():
+  async def scenario():
+    fanout = StreamFanout()
+    abandoned = Upstream([b"old"])
+    subscriber = asyncio.create_task(read(fanout.subscribe("q", abandoned.stream)))
+    await asyncio.sleep(0.01)
+    subscriber.cancel()
+    await asyncio.sleep(0.01)
+
+    fresh = Upstream([b"new"])
+    fresh.release.set()
+    return await read(fanout.subscribe("q", fresh.stream)), abandoned.closed
+
+  frames, abandoned_closed = asyncio.run(scenario())
+
+  assert frames == [b"new"]
+  assert abandoned_closed
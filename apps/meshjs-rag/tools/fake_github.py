@@ -0,0 +1,114 @@
+import os
+import json
+import random
+import asyncio
+import hashlib
+import functools
+import uvicorn
+from typing import Dict, List
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+
+# local stand-in for the git trees and blobs endpoints GithubService syncs from, serving a generated
+# corpus of .mdx pages under every doc path the ingest sources read. each repo gets its own file
+# paths, so ingesting two sources does not find the first one's chunks:
+#   GITHUB_API_URL=http://127.0.0.1:8102 ...
+FAKE_GITHUB_HOST = os.getenv("FAKE_GITHUB_HOST", "127.0.0.1")
+FAKE_GITHUB_PORT = int(os.getenv("FAKE_GITHUB_PORT", 8102))
+FAKE_GITHUB_FILES = int(os.getenv("FAKE_GITHUB_FILES", 100))
+FAKE_GITHUB_SECTIONS = int(os.getenv("FAKE_GITHUB_SECTIONS", 6))
+FAKE_GITHUB_SEED = int(os.getenv("FAKE_GITHUB_SEED", 0))
+FAKE_GITHUB_DOC_PATHS = os.getenv("FAKE_GITHUB_DOC_PATHS", "apps/docs/content/docs,src/pages")
+FAKE_GITHUB_LATENCY_MS = float(os.getenv("FAKE_GITHUB_LATENCY_MS", 0))
+
+VOCABULARY = (
+  "transaction builder wallet address utxo datum redeemer script plutus aiken mint burn token policy asset "
+  "stake pool delegation reward withdrawal certificate governance vote drep metadata signature witness "
+  "collateral fee change output input slot epoch network provider blockfrost koios ogmios maestro "
+  "react hook component provider browser extension cip30 seed mnemonic derivation key hash cbor "
+  "serialize deserialize validator contract escrow marketplace vesting multisig oracle reference inline"
+).split()
+
+def _section_words(rng: random.Random, topic: List[str], count: int) -> List[str]:
+  # sections lean on their own topic words, so a question built from them has a right answer
+  return [rng.choice(topic) if rng.random() < 0.4 else rng.choice(VOCABULARY) for _ in range(count)]
+
+def build_corpus(files: int = FAKE_GITHUB_FILES, sections: int = FAKE_GITHUB_SECTIONS, seed: int = FAKE_GITHUB_SEED) -> Dict[str, str]:
+  rng = random.Random(seed)
+  corpus = {}
+  for file_index in range(files):
+    page = f"guide{file_index:04d}"
+    lines = ["---", f"title: {page.title()}", "---", "", f"Introduction to {page} and {' '.join(rng.sample(VOCABULARY, 5))}.", ""]
+    for section_index in range(sections):
+      topic = rng.sample(VOCABULARY, 3) + [f"{page}s{section_index}"]
+      lines.append(f"## {' '.join(topic[:3]).title()} {page}s{section_index}")
+      lines.append("")
+      for _ in range(4):
+        lines.append(" ".join(_section_words(rng, topic, 30)) + ".")
+        lines.append("")
+      lines.append("```ts")
+      lines.append(f"const {topic[0]} = new MeshTxBuilder({{ {topic[1]}: '{topic[2]}' }});")
+      lines.append("```")
+      lines.append("")
+    corpus[f"section{file_index % 10}/{page}.mdx"] = "\n".join(lines)
+  return corpus
+
+def corpus_questions(corpus: Dict[str, str], count: int, seed: int = FAKE_GITHUB_SEED) -> List[dict]:
+  # one question per (random) section, with the page and section it was taken from
+  rng = random.Random(seed + 1)
+  sections = []
+  for path, content in sorted(corpus.items()):
+    for chunk in content.split("\n## ")[1:]:
+      title, body = chunk.split("\n", 1)
+      sections.append((path, title.strip(), body.split()))
+
+  questions = []
+  for i in range(count):
+    path, title, words = rng.choice(sections)
+    identifier = title.split()[-1]
+    question = f"How do I use {' '.join(rng.sample(words, min(6, len(words))))} in {identifier}? ({i})"
+    questions.append({"question": question, "filepath": path, "chunk_title": title})
+  return questions
+
+def _blob_sha(content: str) -> str:
+  data = content.encode("utf-8")
+  return hashlib.sha1(b"blob " + str(len(data)).encode("ascii") + b"\0" + data).hexdigest()
+
+app = FastAPI()
+corpus = build_corpus()
+blobs = {_blob_sha(content): content for content in corpus.values()}
+
+@functools.lru_cache(maxsize=None)
+def repo_tree(repo: str):
+  tree = [
+    {"path": f"{doc_path.strip('/')}/{repo}/{path}", "mode": "100644", "type": "blob", "sha": _blob_sha(content)}
+    for doc_path in FAKE_GITHUB_DOC_PATHS.split(",") if doc_path.strip()
+    for path, content in corpus.items()
+  ]
+  return tree, f'"{hashlib.sha1(json.dumps(tree).encode("utf-8")).hexdigest()}"'
+
+async def _delay():
+  if FAKE_GITHUB_LATENCY_MS:
+    await asyncio.sleep(FAKE_GITHUB_LATENCY_MS / 1000)
+
+@app.get("/repos/{owner}/{repo}/git/trees/{ref}")
+async def get_tree(owner: str, repo: str, ref: str, request: Request):
+  await _delay()
+  tree, tree_etag = repo_tree(repo)
+  if request.headers.get("if-none-match") == tree_etag:
+    return Response(status_code=304, headers={"ETag": tree_etag})
+  return Response(
+    content=json.dumps({"sha": ref, "tree": tree, "truncated": False}),
+    media_type="application/json",
+    headers={"ETag": tree_etag}
+  )
+
+@app.get("/repos/{owner}/{repo}/git/blobs/{sha}")
+async def get_blob(owner: str, repo: str, sha: str):
+  await _delay()
+  if sha not in blobs:
+    raise HTTPException(status_code=404, detail="Not Found")
+  return PlainTextResponse(blobs[sha])
+
+if __name__ == "__main__":
+  uvicorn.run(app, host=FAKE_GITHUB_HOST, port=FAKE_GITHUB_PORT)
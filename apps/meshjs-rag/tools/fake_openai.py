@@ -0,0 +1,234 @@
+import os
+import re
+import time
+import uuid
+import json
+import asyncio
+import hashlib
+import functools
+import uvicorn
+from email import policy
+from email.parser import BytesParser
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+# local stand-in for the parts of the openai api the service uses. answers are deterministic so a
+# batch ingest or a load test (tools/load_test.py) can be run end to end without a key:
+#   OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_KEY=sk-local ...
+FAKE_OPENAI_HOST = os.getenv("FAKE_OPENAI_HOST", "127.0.0.1")
+FAKE_OPENAI_PORT = int(os.getenv("FAKE_OPENAI_PORT", 8100))
+# number of polls a batch stays in_progress before it completes
+FAKE_OPENAI_BATCH_POLLS = int(os.getenv("FAKE_OPENAI_BATCH_POLLS", 1))
+# time to the first token (or to the whole response for embeddings), then the pace of the tokens after it
+FAKE_OPENAI_LATENCY_MS = float(os.getenv("FAKE_OPENAI_LATENCY_MS", 0))
+FAKE_OPENAI_TOKENS_PER_SECOND = float(os.getenv("FAKE_OPENAI_TOKENS_PER_SECOND", 0))
+FAKE_OPENAI_COMPLETION_TOKENS = int(os.getenv("FAKE_OPENAI_COMPLETION_TOKENS", 100))
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+app = FastAPI()
+files = {}
+batches = {}
+
+@functools.lru_cache(maxsize=65536)
+def _word_slot(word: str, dimensions: int):
+  digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+  return int.from_bytes(digest[:4], "little") % dimensions, 1.0 if digest[4] & 1 else -1.0
+
+def fake_embedding(text: str, dimensions: int) -> list:
+  # hashed bag of words: texts sharing words point the same way, so retrieval over them behaves plausibly
+  values = [0.0] * dimensions
+  for word in WORD_PATTERN.findall(text.lower()):
+    index, sign = _word_slot(word, dimensions)
+    values[index] += sign
+  norm = sum(value * value for value in values) ** 0.5
+  if not norm:
+    values[0] = norm = 1.0
+  return [value / norm for value in values]
+
+def _completion_words(body: dict) -> list:
+  # the answer reuses words of the prompt, so generated contexts still match their chunk
+  words = WORD_PATTERN.findall(body["messages"][-1]["content"].lower()) or ["answer"]
+  count = min(body.get("max_tokens") or body.get("max_completion_tokens") or FAKE_OPENAI_COMPLETION_TOKENS, FAKE_OPENAI_COMPLETION_TOKENS)
+  return [words[i % len(words)] for i in range(count)]
+
+def _usage(body: dict, completion_tokens: int) -> dict:
+  prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+  return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+def chat_completion(body: dict) -> dict:
+  words = _completion_words(body)
+  return {
+    "id": f"chatcmpl-{uuid.uuid4().hex}",
+    "object": "chat.completion",
+    "created": int(time.time()),
+    "model": body["model"],
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+    "usage": _usage(body, len(words))
+  }
+
+async def stream_chat_completion(body: dict):
+  words = _completion_words(body)
+  completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+  created = int(time.time())
+
+  def frame(choices: list, **extra) -> bytes:
+    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body["model"], "choices": choices, **extra}
+    return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+  yield frame([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+  for i, word in enumerate(words):
+    if FAKE_OPENAI_TOKENS_PER_SECOND and i:
+      await asyncio.sleep(1 / FAKE_OPENAI_TOKENS_PER_SECOND)
+    yield frame([{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}])
+  yield frame([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+  if (body.get("stream_options") or {}).get("include_usage"):
+    yield frame([], usage=_usage(body, len(words)))
+  yield b"data: [DONE]\n\n"
+
+async def _delay(tokens: int = 0):
+  seconds = FAKE_OPENAI_LATENCY_MS / 1000
+  if FAKE_OPENAI_TOKENS_PER_SECOND:
+    seconds += tokens / FAKE_OPENAI_TOKENS_PER_SECOND
+  if seconds:
+    await asyncio.sleep(seconds)
+
+def embeddings(body: dict) -> dict:
+  inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+  dimensions = body.get("dimensions") or 1536
+  return {
+    "object": "list",
+    "model": body["model"],
+    "data": [
+      {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+      for i, text in enumerate(inputs)
+    ],
+    "usage": {"prompt_tokens": sum(len(text) // 4 for text in inputs), "total_tokens": sum(len(text) // 4 for text in inputs)}
+  }
+
+HANDLERS = {
+  "/v1/chat/completions": chat_completion,
+  "/v1/embeddings": embeddings
+}
+
+def _file_object(file_id: str) -> dict:
+  stored = files[file_id]
+  return {
+    "id": file_id,
+    "object": "file",
+    "bytes": len(stored["content"]),
+    "created_at": stored["created_at"],
+    "filename": stored["filename"],
+    "purpose": stored["purpose"],
+    "status": "processed"
+  }
+
+def _store_file(filename: str, purpose: str, content: bytes) -> str:
+  file_id = f"file-{uuid.uuid4().hex}"
+  files[file_id] = {"filename": filename, "purpose": purpose, "content": content, "created_at": int(time.time())}
+  return file_id
+
+def _complete(batch: dict):
+  lines = files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+  output = []
+  for line in lines:
+    if not line.strip():
+      continue
+    request = json.loads(line)
+    output.append(json.dumps({
+      "id": f"batch_req_{uuid.uuid4().hex}",
+      "custom_id": request["custom_id"],
+      "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": HANDLERS[request["url"]](request["body"])},
+      "error": None
+    }))
+
+  batch["output_file_id"] = _store_file(f"{batch['id']}_output.jsonl", "batch_output", "\n".join(output).encode("utf-8"))
+  batch["status"] = "completed"
+  batch["completed_at"] = int(time.time())
+  batch["request_counts"] = {"total": len(output), "completed": len(output), "failed": 0}
+
+@app.post("/v1/chat/completions")
+async def create_chat_completion(request: Request):
+  body = await request.json()
+  if body.get("stream"):
+    await _delay()
+    return StreamingResponse(stream_chat_completion(body), media_type="text/event-stream")
+
+  response = chat_completion(body)
+  await _delay(response["usage"]["completion_tokens"])
+  return response
+
+@app.get("/v1/models/{model}")
+async def retrieve_model(model: str):
+  await _delay()
+  return {"id": model, "object": "model", "created": 0, "owned_by": "system"}
+
+@app.post("/v1/embeddings")
+async def create_embeddings(request: Request):
+  await _delay()
+  return embeddings(await request.json())
+
+@app.post("/v1/files")
+async def create_file(request: Request):
+  # parsed by hand so the stand-in does not need python-multipart
+  raw = f"Content-Type: {request.headers['content-type']}\r\n\r\n".encode("utf-8") + await request.body()
+  fields = {}
+  for part in BytesParser(policy=policy.default).parsebytes(raw).iter_parts():
+    name = part.get_param("name", header="content-disposition")
+    fields[name] = (part.get_filename(), part.get_payload(decode=True))
+
+  filename, content = fields["file"]
+  return _file_object(_store_file(filename, fields["purpose"][1].decode("utf-8"), content))
+
+@app.get("/v1/files/{file_id}/content")
+async def get_file_content(file_id: str):
+  if file_id not in files:
+    raise HTTPException(status_code=404, detail="No such file")
+  return PlainTextResponse(files[file_id]["content"].decode("utf-8"))
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+  body = await request.json()
+  if body["input_file_id"] not in files:
+    raise HTTPException(status_code=404, detail="No such file")
+
+  batch_id = f"batch_{uuid.uuid4().hex}"
+  batches[batch_id] = {
+    "id": batch_id,
+    "object": "batch",
+    "endpoint": body["endpoint"],
+    "input_file_id": body["input_file_id"],
+    "completion_window": body["completion_window"],
+    "status": "in_progress",
+    "created_at": int(time.time()),
+    "output_file_id": None,
+    "error_file_id": None,
+    "errors": None,
+    "request_counts": {"total": 0, "completed": 0, "failed": 0},
+    "polls": 0
+  }
+  return batches[batch_id]
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+  batch = batches.get(batch_id)
+  if batch is None:
+    raise HTTPException(status_code=404, detail="No such batch")
+
+  batch["polls"] += 1
+  if batch["status"] == "in_progress" and batch["polls"] >= FAKE_OPENAI_BATCH_POLLS:
+    _complete(batch)
+  return batch
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str):
+  batch = batches.get(batch_id)
+  if batch is None:
+    raise HTTPException(status_code=404, detail="No such batch")
+
+  if batch["status"] == "in_progress":
+    batch["status"] = "cancelled"
+  return batch
+
+if __name__ == "__main__":
+  uvicorn.run(app, host=FAKE_OPENAI_HOST, port=FAKE_OPENAI_PORT)
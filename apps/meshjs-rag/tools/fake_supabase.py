@@ -0,0 +1,389 @@
+import os
+import re
+import json
+import uuid
+import asyncio
+import uvicorn
+import numpy as np
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+# in-memory stand-in for the postgrest api and the pgvector functions setup_db.py creates, enough for
+# the service to answer and ingest against it:
+#   SUPABASE_URL=http://127.0.0.1:8101 SUPABASE_KEY=<any jwt-shaped string> ...
+# match_docs is an exact search, so it answers like a perfect index
+FAKE_SUPABASE_HOST = os.getenv("FAKE_SUPABASE_HOST", "127.0.0.1")
+FAKE_SUPABASE_PORT = int(os.getenv("FAKE_SUPABASE_PORT", 8101))
+# round trip added to every request, the database is never on the same machine
+FAKE_SUPABASE_LATENCY_MS = float(os.getenv("FAKE_SUPABASE_LATENCY_MS", 0))
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+RESERVED_PARAMS = ("select", "order", "offset", "limit", "on_conflict", "columns")
+PRIMARY_KEYS = {
+  "docs": ("id",),
+  "ingest_jobs": ("id",),
+  "ingest_manifest": ("source", "filepath"),
+  "corpus_meta": ("id",)
+}
+
+app = FastAPI()
+
+def _now() -> str:
+  return datetime.now(timezone.utc).isoformat()
+
+tables: Dict[str, List[dict]] = {
+  "docs": [],
+  "ingest_jobs": [],
+  "ingest_manifest": [],
+  "corpus_meta": [{"id": 1, "version": 0, "updated_at": _now()}]
+}
+next_doc_id = 1
+
+# unit vectors of the docs rows, rebuilt on the first search after a write
+vectors: Dict[int, np.ndarray] = {}
+matrix: Optional[np.ndarray] = None
+matrix_ids: List[int] = []
+
+def _defaults(table: str) -> dict:
+  global next_doc_id
+  if table == "docs":
+    next_doc_id += 1
+    return {"id": next_doc_id - 1, "created_at": _now(), "updated_at": _now()}
+  if table == "ingest_jobs":
+    return {
+      "id": str(uuid.uuid4()), "status": "queued", "mode": "interactive", "files": 0, "processed": 0,
+      "unchanged": 0, "failed": [], "files_per_second": 0, "attempts": 1, "error": None, "summary": None,
+      "heartbeat_at": None, "created_at": _now(), "updated_at": _now()
+    }
+  if table == "ingest_manifest":
+    return {"last_ingested": _now()}
+  return {}
+
+def _error(status: int, message: str) -> JSONResponse:
+  return JSONResponse({"code": "PGRST000", "message": message, "details": None, "hint": None}, status_code=status)
+
+def _vector_text(embedding: List[float]) -> str:
+  # pgvector's text output, which is what postgrest returns for vector columns
+  return "[" + ",".join(f"{value:g}" for value in embedding) + "]"
+
+def _set_embedding(row: dict, embedding):
+  global matrix
+  if isinstance(embedding, str):
+    embedding = json.loads(embedding)
+  vector = np.asarray(embedding, dtype=np.float32)
+  norm = np.linalg.norm(vector)
+  vectors[row["id"]] = vector / norm if norm else vector
+  row["embedding"] = _vector_text(embedding)
+  matrix = None
+
+def _forget_docs(rows: List[dict]):
+  global matrix
+  for row in rows:
+    vectors.pop(row["id"], None)
+  matrix = None
+
+def _docs_changed():
+  # the statement-level trigger of corpus_version_schema
+  meta = tables["corpus_meta"][0]
+  meta["version"] += 1
+  meta["updated_at"] = _now()
+
+def _compare(value, operand: str) -> Optional[int]:
+  if value is None:
+    return None
+  try:
+    left, right = float(value), float(operand)
+  except (TypeError, ValueError):
+    left, right = str(value), operand
+  return (left > right) - (left < right)
+
+def _parse_list(operand: str) -> List[str]:
+  items = operand.strip()[1:-1]
+  return [item.strip().strip('"') for item in items.split(",")] if items else []
+
+def _split_top_level(text: str) -> List[str]:
+  # commas inside (...) or "..." belong to the operand
+  parts, depth, quoted, start = [], 0, False, 0
+  for i, char in enumerate(text):
+    if char == '"':
+      quoted = not quoted
+    elif not quoted and char in "()":
+      depth += 1 if char == "(" else -1
+    elif not quoted and depth == 0 and char == ",":
+      parts.append(text[start:i])
+      start = i + 1
+  parts.append(text[start:])
+  return parts
+
+def _parse_filter(term: str) -> tuple:
+  column, _, rest = term.partition(".")
+  operator, _, operand = rest.partition(".")
+  return column, operator, operand.strip('"')
+
+def _matches(row: dict, filters: List[tuple]) -> bool:
+  for column, operator, operand in filters:
+    if column == "or":
+      if not any(_matches(row, [condition]) for condition in operand):
+        return False
+      continue
+    value = row.get(column)
+    if operator == "eq" and str(value) != operand and not (isinstance(value, bool) and str(value).lower() == operand):
+      return False
+    if operator == "neq" and str(value) == operand:
+      return False
+    if operator == "in" and str(value) not in _parse_list(operand):
+      return False
+    if operator in ("gt", "gte", "lt", "lte"):
+      comparison = _compare(value, operand)
+      if comparison is None:
+        return False
+      if (operator == "gt" and comparison <= 0) or (operator == "gte" and comparison < 0) \
+         or (operator == "lt" and comparison >= 0) or (operator == "lte" and comparison > 0):
+        return False
+  return True
+
+def _project(row: dict, select: str) -> dict:
+  if not select or select == "*":
+    return dict(row)
+  return {column: row.get(column) for column in select.split(",")}
+
+def _query(request: Request):
+  filters = []
+  for key, value in request.query_params.multi_items():
+    if key in RESERVED_PARAMS:
+      continue
+    if key == "or":
+      filters.append(("or", None, [_parse_filter(term) for term in _split_top_level(value[1:-1])]))
+      continue
+    operator, _, operand = value.partition(".")
+    filters.append((key, operator, operand))
+  return filters
+
+def _order(rows: List[dict], order: Optional[str]) -> List[dict]:
+  for term in reversed((order or "").split(",")):
+    if not term:
+      continue
+    column, _, direction = term.partition(".")
+    rows = sorted(rows, key=lambda row: (row.get(column) is None, row.get(column)), reverse=direction.startswith("desc"))
+  return rows
+
+async def _delay():
+  if FAKE_SUPABASE_LATENCY_MS:
+    await asyncio.sleep(FAKE_SUPABASE_LATENCY_MS / 1000)
+
+@app.api_route("/rest/v1/{table}", methods=["GET", "POST", "PATCH", "DELETE"])
+async def table_request(table: str, request: Request):
+  await _delay()
+  if table not in tables:
+    return _error(404, f"relation \"public.{table}\" does not exist")
+
+  rows = tables[table]
+  filters = _query(request)
+  select = request.query_params.get("select")
+
+  if request.method == "GET":
+    result = _order([row for row in rows if _matches(row, filters)], request.query_params.get("order"))
+    offset = int(request.query_params.get("offset", 0))
+    limit = request.query_params.get("limit")
+    result = result[offset:offset + int(limit)] if limit is not None else result[offset:]
+    return [_project(row, select) for row in result]
+
+  if request.method == "PATCH":
+    changes = await request.json()
+    result = []
+    for row in rows:
+      if _matches(row, filters):
+        row.update({key: value for key, value in changes.items() if key != "embedding"})
+        if "embedding" in changes and table == "docs":
+          _set_embedding(row, changes["embedding"])
+        if "updated_at" in row:
+          row["updated_at"] = _now()
+        result.append(row)
+    if table == "docs" and result:
+      _docs_changed()
+    return [_project(row, select) for row in result]
+
+  if request.method == "DELETE":
+    result = [row for row in rows if _matches(row, filters)]
+    tables[table] = [row for row in rows if not _matches(row, filters)]
+    if table == "docs" and result:
+      _forget_docs(result)
+      _docs_changed()
+    return [_project(row, select) for row in result]
+
+  # insert, or upsert on the primary key when postgrest is asked to merge duplicates
+  payload = await request.json()
+  merge = "merge-duplicates" in request.headers.get("prefer", "")
+  keys = PRIMARY_KEYS[table]
+  result = []
+  for values in payload if isinstance(payload, list) else [payload]:
+    existing = next((row for row in rows if all(key in values and row.get(key) == values[key] for key in keys)), None) if merge else None
+    if existing is None:
+      row = _defaults(table)
+      rows.append(row)
+    else:
+      row = existing
+    row.update({key: value for key, value in values.items() if key != "embedding"})
+    if "embedding" in values and table == "docs":
+      _set_embedding(row, values["embedding"])
+    result.append(row)
+  if table == "docs" and result:
+    _docs_changed()
+  return JSONResponse([_project(row, select) for row in result], status_code=201)
+
+###########################################################################################################
+# FUNCTIONS
+###########################################################################################################
+def _similarities(query_embedding) -> Dict[int, float]:
+  global matrix, matrix_ids
+  if matrix is None:
+    matrix_ids = list(vectors)
+    matrix = np.stack([vectors[doc_id] for doc_id in matrix_ids]) if matrix_ids else np.zeros((0, 0), dtype=np.float32)
+  if not matrix_ids:
+    return {}
+
+  query = np.asarray(json.loads(query_embedding) if isinstance(query_embedding, str) else query_embedding, dtype=np.float32)
+  query /= np.linalg.norm(query) or 1
+  return dict(zip(matrix_ids, (matrix @ query).tolist()))
+
+def _match_row(row: dict, similarity: float) -> dict:
+  return {
+    "id": row["id"],
+    "contextual_text": row.get("contextual_text"),
+    "similarity": similarity,
+    "filepath": row["filepath"],
+    "chunk_id": row["chunk_id"],
+    "chunk_title": row["chunk_title"],
+    "checksum": row["checksum"]
+  }
+
+def _with_similarities(rows: List[dict]) -> List[dict]:
+  # what the sql functions return for build_context's mmr, instead of the vectors
+  for row in rows:
+    row["similarities"] = {
+      str(other["id"]): float(vectors[row["id"]] @ vectors[other["id"]])
+      for other in rows
+      if row["id"] in vectors and other["id"] in vectors
+    }
+  return rows
+
+def match_docs(params: dict):
+  similarities = _similarities(params["query_embedding"])
+  nearest = sorted(similarities.items(), key=lambda item: -item[1])[:params["match_count"]]
+  by_id = {row["id"]: row for row in tables["docs"]}
+  return _with_similarities([_match_row(by_id[doc_id], similarity) for doc_id, similarity in nearest if similarity > params["match_threshold"]])
+
+def hybrid_match_docs(params: dict):
+  # word overlap stands in for ts_rank_cd; the fusion is the same as the sql function
+  count = params["match_count"]
+  similarities = _similarities(params["query_embedding"])
+  semantic = [doc_id for doc_id, _ in sorted(similarities.items(), key=lambda item: -item[1])[:count * 2]]
+
+  query_words = set(WORD_PATTERN.findall(params["query_text"].lower()))
+  overlaps = []
+  for row in tables["docs"]:
+    overlap = len(query_words & set(WORD_PATTERN.findall(f"{row['chunk_title']} {row.get('contextual_text') or ''}".lower())))
+    if overlap:
+      overlaps.append((overlap, row["id"]))
+  full_text = [doc_id for _, doc_id in sorted(overlaps, key=lambda item: -item[0])[:count * 2]]
+
+  rrf_k = params.get("rrf_k", 50)
+  scores = {}
+  for rank, doc_id in enumerate(full_text, 1):
+    scores[doc_id] = scores.get(doc_id, 0.0) + params.get("full_text_weight", 1) / (rrf_k + rank)
+  for rank, doc_id in enumerate(semantic, 1):
+    scores[doc_id] = scores.get(doc_id, 0.0) + params.get("semantic_weight", 1) / (rrf_k + rank)
+
+  by_id = {row["id"]: row for row in tables["docs"]}
+  ranked = sorted(scores.items(), key=lambda item: -item[1])[:count]
+  return _with_similarities([{**_match_row(by_id[doc_id], similarities.get(doc_id, 0.0)), "score": score} for doc_id, score in ranked])
+
+def upsert_docs(params: dict):
+  by_id = {row["id"]: row for row in tables["docs"]}
+  result = []
+  for values in params["payload"]:
+    record_id = values.pop("record_id", None)
+    embedding = values.pop("embedding", None)
+    if record_id is not None:
+      row = by_id.get(record_id)
+      if row is None:
+        continue
+      row.update(values)
+      row["updated_at"] = _now()
+      action = "updated"
+    else:
+      row = {**_defaults("docs"), **values}
+      tables["docs"].append(row)
+      action = "inserted"
+    if embedding is not None:
+      _set_embedding(row, embedding)
+    result.append({"id": row["id"], "chunk_title": row["chunk_title"], "action": action})
+
+  delete_ids = set(params.get("delete_ids") or [])
+  deleted = [row for row in tables["docs"] if row["id"] in delete_ids]
+  if deleted:
+    tables["docs"] = [row for row in tables["docs"] if row["id"] not in delete_ids]
+    _forget_docs(deleted)
+    result.extend({"id": row["id"], "chunk_title": row["chunk_title"], "action": "deleted"} for row in deleted)
+  if result:
+    _docs_changed()
+  return result
+
+def _renumbered_title(title: str, chunk_id: int) -> str:
+  return f"{title.split('_')[0]}_{chunk_id}" if "_" in title else title
+
+def reorder_docs(params: dict):
+  rows = [row for row in tables["docs"] if row["filepath"] == params["target_filepath"]]
+  by_id = {row["id"]: row for row in rows}
+  for moved in params.get("moved_chunks") or []:
+    row = by_id.get(moved["id"])
+    if row is not None:
+      row["chunk_id"] = moved["chunk_id"]
+      row["chunk_title"] = _renumbered_title(row["chunk_title"], moved["chunk_id"])
+
+  renumbered = 0
+  for new_index, row in enumerate(sorted(rows, key=lambda row: (row["chunk_id"], row["id"]))):
+    if row["chunk_id"] != new_index:
+      row["chunk_id"] = new_index
+      row["chunk_title"] = _renumbered_title(row["chunk_title"], new_index)
+      row["updated_at"] = _now()
+      renumbered += 1
+  if rows:
+    _docs_changed()
+  return renumbered
+
+def delete_missing_docs(params: dict):
+  source = params["target_source"]
+  current = set(params["current_filepaths"])
+  missing = {row["filepath"] for row in tables["ingest_manifest"] if row["source"] == source and row["filepath"] not in current}
+  tables["ingest_manifest"] = [row for row in tables["ingest_manifest"] if not (row["source"] == source and row["filepath"] in missing)]
+  kept_elsewhere = {row["filepath"] for row in tables["ingest_manifest"]}
+
+  deleted = [row for row in tables["docs"] if row["filepath"] in missing and row["filepath"] not in kept_elsewhere]
+  if deleted:
+    deleted_ids = {row["id"] for row in deleted}
+    tables["docs"] = [row for row in tables["docs"] if row["id"] not in deleted_ids]
+    _forget_docs(deleted)
+    _docs_changed()
+  return len(deleted)
+
+FUNCTIONS = {
+  "match_docs": match_docs,
+  "hybrid_match_docs": hybrid_match_docs,
+  "upsert_docs": upsert_docs,
+  "reorder_docs": reorder_docs,
+  "delete_missing_docs": delete_missing_docs
+}
+
+@app.post("/rest/v1/rpc/{function}")
+async def call_function(function: str, request: Request):
+  await _delay()
+  if function not in FUNCTIONS:
+    return _error(404, f"Could not find the function public.{function}")
+  result = FUNCTIONS[function](await request.json())
+  return Response(json.dumps(result), media_type="application/json")
+
+if __name__ == "__main__":
+  uvicorn.run(app, host=FAKE_SUPABASE_HOST, port=FAKE_SUPABASE_PORT)
@@ -0,0 +1,440 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import pathlib
+import argparse
+import platform
+import threading
+import tempfile
+import subprocess
+import httpx
+import numpy as np
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from fake_github import build_corpus, corpus_questions
+
+# offline load test: starts the openai, supabase (postgrest + pgvector) and github stand-ins from
+# tools/, runs the service against them the way the Dockerfile does, ingests the generated corpus
+# and then drives /ask-mesh-ai at each concurrency level. results are written as json, pass an
+# earlier file as --baseline to compare.
+#   python3 tools/load_test.py --concurrency 1,16,64 --openai-latency-ms 400 --tokens-per-second 60
+# the service runs in this directory and inherits the environment, so any of its settings
+# (RETRIEVAL_MODE, INGEST_CONCURRENCY, SSE_COALESCE_WINDOW_MS, ...) can be set for a run. the
+# ingest downloads the generated corpus into a temporary directory (INGEST_DOWNLOAD_DIR), so the docs/,
+# aiken-docs/ and manifests of the checkout are left alone.
+# the openai rate limiters keep their budgets (OPENAI_TOKENS_PER_MINUTE, OPENAI_EMBEDDING_TOKENS_PER_MINUTE),
+# so ingest is paced as it would be against the real account
+
+APP_DIR = pathlib.Path(__file__).resolve().parents[1]
+TOOLS_DIR = APP_DIR / "tools"
+ADMIN_KEY = "load-test-admin"
+OPENAI_KEY = "sk-load-test"
+SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.e30.load-test"
+FINAL_JOB_STATUSES = ("completed", "failed", "cancelled", "interrupted")
+SECRET_SETTINGS = ("OPENAI_KEY", "SUPABASE_KEY", "ADMIN_KEY", "GITHUB_TOKEN", "DB_PASSWORD")
+
+def parse_args():
+  parser = argparse.ArgumentParser(description="Load test the service against local OpenAI, Supabase and GitHub stand-ins")
+  parser.add_argument("--scenarios", default="chat,mcp", help="comma separated: chat, mcp (the ingest always runs first)")
+  parser.add_argument("--concurrency", default="1,8,32", help="comma separated concurrency levels")
+  parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+  parser.add_argument("--distinct-questions", type=int, default=0, help="questions to cycle through, 0 for a new question per request")
+  parser.add_argument("--ingest-sources", default="docs", help="comma separated ingest sources fed by the github stand-in: docs, aiken-docs")
+  parser.add_argument("--batch-ingest", action="store_true", help="ingest through the Batch API stand-in")
+  parser.add_argument("--files", type=int, default=100, help="generated pages per source")
+  parser.add_argument("--sections", type=int, default=6, help="h2 sections (chunks) per page")
+  parser.add_argument("--openai-latency-ms", type=float, default=300)
+  parser.add_argument("--tokens-per-second", type=float, default=80)
+  parser.add_argument("--completion-tokens", type=int, default=100)
+  parser.add_argument("--db-latency-ms", type=float, default=5)
+  parser.add_argument("--github-latency-ms", type=float, default=20)
+  parser.add_argument("--workers", type=int, default=4, help="gunicorn workers, as in the Dockerfile")
+  parser.add_argument("--model", default="gpt-4o-mini")
+  parser.add_argument("--label", default="", help="stored with the results")
+  parser.add_argument("--output", help="results file, defaults to load-test-results/<timestamp>.json")
+  parser.add_argument("--baseline", help="an earlier results file to compare against")
+  return parser.parse_args()
+
+def free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+def service_settings() -> Dict[str, str]:
+  # the settings from .env.example this run overrides, so results of differently tuned runs are told apart
+  try:
+    names = [line.split("=", 1)[0] for line in (APP_DIR / ".env.example").read_text(encoding="utf-8").splitlines() if "=" in line]
+  except OSError:
+    return {}
+  return {name: os.environ[name] for name in names if name in os.environ and name not in SECRET_SETTINGS}
+
+def git_commit() -> Optional[str]:
+  try:
+    return subprocess.run(["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+###########################################################################################################
+# PROCESSES
+###########################################################################################################
+def start(command: List[str], env: dict, log_path: pathlib.Path) -> subprocess.Popen:
+  log = open(log_path, "w")
+  return subprocess.Popen(command, cwd=APP_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    if process.poll() is not None:
+      raise RuntimeError(f"{process.args} exited with {process.returncode}")
+    try:
+      httpx.get(url, timeout=1)
+      return
+    except httpx.HTTPError:
+      time.sleep(0.2)
+  raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def _children(pid: int) -> List[int]:
+  children = []
+  for stat in pathlib.Path("/proc").glob("[0-9]*/stat"):
+    try:
+      fields = stat.read_text().rsplit(")", 1)[1].split()
+    except OSError:
+      continue
+    if int(fields[1]) == pid:
+      children.append(int(stat.parent.name))
+  return children
+
+def tree_rss_mb(pid: int) -> Optional[float]:
+  # gunicorn master plus its workers; linux only
+  if not pathlib.Path("/proc").is_dir():
+    return None
+
+  total = 0
+  pending = [pid]
+  while pending:
+    current = pending.pop()
+    try:
+      status = pathlib.Path(f"/proc/{current}/status").read_text()
+    except OSError:
+      continue
+    for line in status.splitlines():
+      if line.startswith("VmRSS:"):
+        total += int(line.split()[1])
+    pending.extend(_children(current))
+  return round(total / 1024, 1)
+
+class MemorySampler:
+  def __init__(self, pid: int, interval: float = 0.25):
+    self.pid = pid
+    self.interval = interval
+    self.peak = 0.0
+    self._stop = threading.Event()
+    self._thread = None
+
+  def __enter__(self):
+    self.start_mb = tree_rss_mb(self.pid)
+    self.peak = self.start_mb or 0.0
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+    return self
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      self.peak = max(self.peak, tree_rss_mb(self.pid) or 0.0)
+
+  def __exit__(self, *exc):
+    self._stop.set()
+    self._thread.join()
+    self.end_mb = tree_rss_mb(self.pid)
+
+  def result(self) -> dict:
+    return {"start": self.start_mb, "peak": self.peak or None, "end": self.end_mb}
+
+###########################################################################################################
+# SCENARIOS
+###########################################################################################################
+def distribution(values: List[float]) -> Optional[dict]:
+  if not values:
+    return None
+  values = np.asarray(values) * 1000
+  return {
+    "p50": round(float(np.percentile(values, 50)), 1),
+    "p95": round(float(np.percentile(values, 95)), 1),
+    "p99": round(float(np.percentile(values, 99)), 1),
+    "mean": round(float(values.mean()), 1),
+    "max": round(float(values.max()), 1)
+  }
+
+async def chat_request(client: httpx.AsyncClient, question: str, model: str) -> dict:
+  start = time.perf_counter()
+  first_byte = None
+  size = 0
+  tail = b""
+  async with client.stream(
+    "POST",
+    "/api/v1/ask-mesh-ai/chat/completions",
+    headers={"Authorization": f"Bearer {ADMIN_KEY}"},
+    json={"model": model, "messages": [{"role": "user", "content": question}], "stream": True}
+  ) as response:
+    async for chunk in response.aiter_bytes():
+      if chunk and first_byte is None:
+        first_byte = time.perf_counter() - start
+      size += len(chunk)
+      tail = (tail + chunk)[-64:]
+  ok = response.status_code == 200 and b"[DONE]" in tail
+  return {"ok": ok, "status": response.status_code, "latency": time.perf_counter() - start, "ttft": first_byte, "bytes": size}
+
+async def mcp_request(client: httpx.AsyncClient, question: str, model: str) -> dict:
+  start = time.perf_counter()
+  response = await client.post(
+    "/api/v1/ask-mesh-ai/mcp",
+    headers={"Authorization": f"Bearer {OPENAI_KEY}"},
+    json={"query": question, "model": model}
+  )
+  latency = time.perf_counter() - start
+  return {"ok": response.status_code == 200, "status": response.status_code, "latency": latency, "ttft": latency, "bytes": len(response.content)}
+
+SCENARIOS = {
+  "chat": chat_request,
+  "mcp": mcp_request
+}
+
+async def run_level(base_url: str, scenario: str, concurrency: int, questions: List[str], model: str, pid: int) -> dict:
+  send = SCENARIOS[scenario]
+  queue = asyncio.Queue()
+  for question in questions:
+    queue.put_nowait(question)
+
+  results = []
+  limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+  async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+    async def worker():
+      while not queue.empty():
+        question = queue.get_nowait()
+        try:
+          results.append(await send(client, question, model))
+        except httpx.HTTPError as e:
+          results.append({"ok": False, "status": None, "error": str(e)})
+
+    with MemorySampler(pid) as memory:
+      start = time.perf_counter()
+      await asyncio.gather(*(worker() for _ in range(concurrency)))
+      duration = time.perf_counter() - start
+
+  succeeded = [result for result in results if result["ok"]]
+  statuses = {}
+  for result in results:
+    if not result["ok"]:
+      statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+
+  return {
+    "concurrency": concurrency,
+    "requests": len(results),
+    "errors": len(results) - len(succeeded),
+    "error_statuses": statuses,
+    "duration_s": round(duration, 3),
+    "rps": round(len(succeeded) / duration, 2) if duration else None,
+    "latency_ms": distribution([result["latency"] for result in succeeded]),
+    "ttft_ms": distribution([result["ttft"] for result in succeeded if result["ttft"] is not None]),
+    "rss_mb": memory.result()
+  }
+
+async def run_ingest(base_url: str, source: str, batch: bool, pid: int) -> dict:
+  path = {"docs": "/api/v1/ingest/", "aiken-docs": "/api/v1/ingest/aiken-docs"}[source]
+  headers = {"Authorization": f"Bearer {ADMIN_KEY}"}
+  async with httpx.AsyncClient(base_url=base_url, timeout=60, headers=headers) as client:
+    with MemorySampler(pid) as memory:
+      start = time.perf_counter()
+      response = await client.post(path, params={"batch": batch})
+      response.raise_for_status()
+      job_id = response.json()["job_id"]
+
+      while True:
+        await asyncio.sleep(0.5)
+        job = (await client.get(f"/api/v1/ingest/jobs/{job_id}")).json()
+        if job["status"] in FINAL_JOB_STATUSES:
+          break
+      duration = time.perf_counter() - start
+
+  return {
+    "source": source,
+    "mode": "batch" if batch else "interactive",
+    "status": job["status"],
+    "error": job.get("error"),
+    "duration_s": round(duration, 3),
+    "files": job["files"],
+    "processed": job["processed"],
+    "unchanged": job["unchanged"],
+    "failed": len(job["failed"] or []),
+    "files_per_second": round(job["files"] / duration, 2) if duration else None,
+    "job_files_per_second": job["files_per_second"],
+    "rss_mb": memory.result()
+  }
+
+###########################################################################################################
+# REPORT
+###########################################################################################################
+def print_level(scenario: str, level: dict):
+  latency = level["latency_ms"] or {}
+  ttft = level["ttft_ms"] or {}
+  print(
+    f"{scenario:5} c={level['concurrency']:<4} {level['requests']} requests, {level['errors']} errors, {level['rps']} req/s | "
+    f"latency p50 {latency.get('p50')} p95 {latency.get('p95')} p99 {latency.get('p99')} ms | "
+    f"ttft p50 {ttft.get('p50')} p95 {ttft.get('p95')} ms | peak rss {level['rss_mb']['peak']} MB"
+  )
+
+def compare(results: dict, baseline: dict):
+  def change(current, previous):
+    if current is None or not previous:
+      return "n/a"
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+  print(f"\nCompared with {baseline.get('label') or baseline.get('started_at')} ({baseline.get('git_commit')}):")
+  for scenario in SCENARIOS:
+    previous_levels = {level["concurrency"]: level for level in baseline.get(scenario, [])}
+    for level in results.get(scenario, []):
+      previous = previous_levels.get(level["concurrency"])
+      if previous is None:
+        continue
+      print(
+        f"{scenario:5} c={level['concurrency']:<4} rps {change(level['rps'], previous['rps'])}, "
+        f"p95 {change((level['latency_ms'] or {}).get('p95'), (previous['latency_ms'] or {}).get('p95'))}, "
+        f"ttft p95 {change((level['ttft_ms'] or {}).get('p95'), (previous['ttft_ms'] or {}).get('p95'))}"
+      )
+  previous_ingest = {run["source"]: run for run in baseline.get("ingest", [])}
+  for run in results.get("ingest", []):
+    if run["source"] in previous_ingest:
+      print(f"ingest {run['source']}: files/s {change(run['files_per_second'], previous_ingest[run['source']]['files_per_second'])}")
+
+###########################################################################################################
+# MAIN
+###########################################################################################################
+async def run(args, base_url: str, app_pid: int) -> dict:
+  results = {"ingest": []}
+  for source in [source.strip() for source in args.ingest_sources.split(",") if source.strip()]:
+    run_result = await run_ingest(base_url, source, args.batch_ingest, app_pid)
+    results["ingest"].append(run_result)
+    print(
+      f"ingest {source}: {run_result['status']} in {run_result['duration_s']}s, {run_result['files']} files, "
+      f"{run_result['files_per_second']} files/s, {run_result['failed']} failed | peak rss {run_result['rss_mb']['peak']} MB"
+    )
+
+  corpus = build_corpus(args.files, args.sections)
+  levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+  for scenario_index, scenario in enumerate([scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]):
+    results[scenario] = []
+    for level_index, concurrency in enumerate(levels):
+      # questions are not shared between levels or scenarios, so caches only help within a level
+      pool = corpus_questions(corpus, args.distinct_questions or args.requests, seed=scenario_index * 1000 + level_index)
+      questions = [pool[i % len(pool)]["question"] for i in range(args.requests)]
+      level = await run_level(base_url, scenario, concurrency, questions, args.model, app_pid)
+      results[scenario].append(level)
+      print_level(scenario, level)
+
+  async with httpx.AsyncClient(base_url=base_url) as client:
+    results["health"] = (await client.get("/health")).json()
+  return results
+
+def main():
+  args = parse_args()
+  started_at = datetime.now(timezone.utc)
+  log_dir = APP_DIR / "load-test-results" / "logs"
+  log_dir.mkdir(parents=True, exist_ok=True)
+
+  ports = {name: free_port() for name in ("openai", "supabase", "github", "app")}
+  fakes = {
+    "openai": ({
+      "FAKE_OPENAI_PORT": str(ports["openai"]),
+      "FAKE_OPENAI_LATENCY_MS": str(args.openai_latency_ms),
+      "FAKE_OPENAI_TOKENS_PER_SECOND": str(args.tokens_per_second),
+      "FAKE_OPENAI_COMPLETION_TOKENS": str(args.completion_tokens),
+      "FAKE_OPENAI_BATCH_POLLS": "1"
+    }, "/v1/batches/none"),
+    "supabase": ({
+      "FAKE_SUPABASE_PORT": str(ports["supabase"]),
+      "FAKE_SUPABASE_LATENCY_MS": str(args.db_latency_ms)
+    }, "/rest/v1/corpus_meta"),
+    "github": ({
+      "FAKE_GITHUB_PORT": str(ports["github"]),
+      "FAKE_GITHUB_FILES": str(args.files),
+      "FAKE_GITHUB_SECTIONS": str(args.sections),
+      "FAKE_GITHUB_LATENCY_MS": str(args.github_latency_ms)
+    }, "/repos/none/none/git/blobs/none")
+  }
+
+  # downloads and batch files of the run, removed afterwards
+  work_dir = pathlib.Path(tempfile.mkdtemp(prefix="meshjs-rag-load-test-"))
+  processes = []
+  try:
+    for name, (env, probe) in fakes.items():
+      process = start([sys.executable, str(TOOLS_DIR / f"fake_{name}.py")], env, log_dir / f"fake_{name}.log")
+      processes.append(process)
+      wait_until_up(f"http://127.0.0.1:{ports[name]}{probe}", process)
+
+    app_env = {
+      "OPENAI_BASE_URL": f"http://127.0.0.1:{ports['openai']}/v1",
+      "OPENAI_KEY": OPENAI_KEY,
+      "SUPABASE_URL": f"http://127.0.0.1:{ports['supabase']}",
+      "SUPABASE_KEY": SUPABASE_KEY,
+      "GITHUB_API_URL": f"http://127.0.0.1:{ports['github']}",
+      "ADMIN_KEY": ADMIN_KEY,
+      "INGEST_BATCH_POLL_INTERVAL": os.getenv("INGEST_BATCH_POLL_INTERVAL", "1"),
+      "INGEST_DOWNLOAD_DIR": str(work_dir),
+      "INGEST_BATCH_DIR": str(work_dir / "ingest-batches"),
+      # every run starts cold, otherwise the second run would only read the chunk cache
+      "CHUNK_CACHE_PATH": os.getenv("CHUNK_CACHE_PATH", "")
+    }
+    if args.workers > 1:
+      multiproc_dir = log_dir / "prometheus"
+      multiproc_dir.mkdir(exist_ok=True)
+      for stale in multiproc_dir.iterdir():
+        stale.unlink()
+      app_env["PROMETHEUS_MULTIPROC_DIR"] = str(multiproc_dir)
+
+    app = start(
+      [sys.executable, "-m", "gunicorn", "-k", "uvicorn.workers.UvicornWorker", "main:app",
+       "-b", f"127.0.0.1:{ports['app']}", "--workers", str(args.workers)],
+      app_env,
+      log_dir / "app.log"
+    )
+    processes.append(app)
+    base_url = f"http://127.0.0.1:{ports['app']}"
+    wait_until_up(f"{base_url}/health", app)
+
+    results = asyncio.run(run(args, base_url, app.pid))
+  finally:
+    for process in reversed(processes):
+      process.terminate()
+    for process in processes:
+      try:
+        process.wait(timeout=15)
+      except subprocess.TimeoutExpired:
+        process.kill()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+  results = {
+    "label": args.label,
+    "started_at": started_at.isoformat(),
+    "duration_s": round((datetime.now(timezone.utc) - started_at).total_seconds(), 1),
+    "git_commit": git_commit(),
+    "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+    "config": vars(args),
+    "service_settings": service_settings(),
+    **results
+  }
+
+  output = pathlib.Path(args.output) if args.output else APP_DIR / "load-test-results" / f"{started_at.strftime('%Y%m%d-%H%M%S')}.json"
+  output.parent.mkdir(parents=True, exist_ok=True)
+  output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+  print(f"\nResults written to {output}")
+
+  if args.baseline:
+    compare(results, json.loads(pathlib.Path(args.baseline).read_text(encoding="utf-8")))
+
+if __name__ == "__main__":
+  main()